@@ -0,0 +1,201 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compare Neutron with OpenDaylight and optionally repair the differences.
+
+Run with the configuration files of neutron-server, for instance::
+
+    odl-neutron-audit --config-file /etc/neutron/neutron.conf \
+        --config-file /etc/neutron/plugins/ml2/ml2_conf.ini [--repair]
+"""
+
+import collections
+import itertools
+import sys
+
+import eventlet
+from oslo.config import cfg
+
+from neutron.common import config
+from neutron import context as n_context
+from neutron import manager
+from neutron.openstack.common import log
+from neutron.plugins.ml2 import config as ml2_config  # noqa
+
+from odldrivers.common import config as odl_config  # noqa
+from odldrivers.common import sync
+from odldrivers.l3 import l3_odl
+from odldrivers.ml2 import mech_driver
+
+LOG = log.getLogger(__name__)
+
+audit_opts = [
+    cfg.BoolOpt('repair', default=False,
+                help=_("Push the Neutron copy of every object which differs "
+                       "to OpenDaylight, and delete the objects only "
+                       "OpenDaylight has.")),
+    cfg.IntOpt('repair_workers', default=8,
+               help=_("Number of objects repaired concurrently.")),
+]
+
+KINDS = (sync.MISSING, sync.EXTRA, sync.DIVERGENT)
+
+# Names the OpenDaylight L3 plugin may be configured under.
+L3_PLUGIN_NAMES = ('odl-router',
+                   'odldrivers.l3.l3_odl.OpenDaylightL3RouterPlugin')
+
+# differences() yields (id, kind) pairs and repair(id) makes ODL's copy of
+# one object match Neutron.
+Collection = collections.namedtuple('Collection',
+                                    ['object_type', 'differences', 'repair'])
+
+
+class Audit(object):
+
+    """Finds, and optionally repairs, objects which differ in ODL.
+
+    Every collection is compared at the same time, and each difference is
+    written out as it is found. Repairs start once the comparison is done
+    and run repair_workers at a time. Collections are repaired in the
+    order given, parents first, except that objects only ODL has are
+    deleted last and children first.
+    """
+
+    def __init__(self, collections, repair=False, repair_workers=8,
+                 out=sys.stdout):
+        self.collections = collections
+        self.repair = repair
+        self.repair_workers = repair_workers
+        self.out = out
+        self.counts = dict(
+            (c.object_type,
+             dict.fromkeys(KINDS + ('repaired', 'failed'), 0))
+            for c in collections)
+        self.found = dict((c.object_type, []) for c in collections)
+
+    def run(self):
+        """Audit every collection. Returns True if ODL is now in sync."""
+        pool = eventlet.GreenPool(max(len(self.collections), 1))
+        for collection in pool.imap(self._compare, self.collections):
+            pass
+        if self.repair:
+            self._repair_all()
+        self.report()
+        return all(sum(c[kind] for kind in KINDS) == c['repaired']
+                   for c in self.counts.values())
+
+    def _compare(self, collection):
+        counts = self.counts[collection.object_type]
+        for obj_id, kind in collection.differences():
+            counts[kind] += 1
+            self.out.write('%s %s %s\n' % (collection.object_type, obj_id,
+                                           kind))
+            if self.repair:
+                self.found[collection.object_type].append((obj_id, kind))
+        return collection
+
+    def _repair_all(self):
+        pool = eventlet.GreenPool(max(self.repair_workers, 1))
+        for extra, ordered in ((False, self.collections),
+                               (True, reversed(self.collections))):
+            for collection in ordered:
+                ids = [obj_id for obj_id, kind
+                       in self.found[collection.object_type]
+                       if (kind == sync.EXTRA) == extra]
+                counts = self.counts[collection.object_type]
+                for repaired in pool.imap(self._repair,
+                                          itertools.repeat(collection), ids):
+                    counts['repaired' if repaired else 'failed'] += 1
+
+    def _repair(self, collection, obj_id):
+        try:
+            collection.repair(obj_id)
+        except Exception as e:
+            LOG.warning(_("Failed to repair %(type)s %(id)s: %(exc)s"),
+                        {'type': collection.object_type, 'id': obj_id,
+                         'exc': e})
+            return False
+        return True
+
+    def report(self):
+        columns = KINDS + (('repaired', 'failed') if self.repair else ())
+        self.out.write('\n%-12s' % 'collection' +
+                       ''.join(' %10s' % c for c in columns) + '\n')
+        for collection in self.collections:
+            counts = self.counts[collection.object_type]
+            self.out.write('%-12s' % collection.object_type +
+                           ''.join(' %10d' % counts[c] for c in columns) +
+                           '\n')
+
+
+def get_collections(dbcontext):
+    """Return the collections kept in ODL by the drivers Neutron uses.
+
+    Service plugins are not loaded by the NeutronManager, since they would
+    start consuming the agent RPC traffic meant for neutron-server; the
+    OpenDaylight L3 plugin is built without RPC instead.
+    """
+    result = []
+    l3_enabled = bool(set(L3_PLUGIN_NAMES) & set(cfg.CONF.service_plugins))
+    cfg.CONF.set_override('service_plugins', [])
+    plugin = manager.NeutronManager.get_plugin()
+    if 'odl' in cfg.CONF.ml2.mechanism_drivers:
+        mech = mech_driver.OpenDaylightMechanismDriver()
+        mech.initialize()
+        for object_type in (mech_driver.ODL_NETWORKS,
+                            mech_driver.ODL_SUBNETS, mech_driver.ODL_PORTS):
+            result.append(Collection(
+                object_type,
+                lambda t=object_type: mech.differences(t, plugin, dbcontext),
+                lambda obj_id, t=object_type: mech.resync_resource(
+                    t, obj_id, plugin, dbcontext)))
+    if l3_enabled:
+        l3_plugin = l3_odl.OpenDaylightL3RouterPlugin(rpc=False)
+        for object_type in (l3_odl.ROUTERS, l3_odl.FLOATINGIPS):
+            result.append(Collection(
+                object_type,
+                lambda t=object_type: l3_plugin.differences(t, dbcontext),
+                lambda obj_id, t=object_type: l3_plugin.resync_resource(
+                    t, obj_id, dbcontext)))
+    return result
+
+
+def main():
+    # Read Neutron and ODL concurrently, as neutron-server would.
+    eventlet.monkey_patch()
+    cfg.CONF.register_cli_opts(audit_opts)
+    config.init(sys.argv[1:])
+    config.setup_logging()
+    # The running server owns the journal and the snapshot.
+    cfg.CONF.set_override('journal_enabled', False, 'odl_rest')
+    cfg.CONF.set_override('snapshot_path', '', 'odl_rest')
+
+    dbcontext = n_context.get_admin_context()
+    collections = get_collections(dbcontext)
+    if not collections:
+        LOG.error(_("Neutron is not configured to use the OpenDaylight "
+                    "drivers"))
+        return 2
+    audit = Audit(collections, cfg.CONF.repair, cfg.CONF.repair_workers)
+    try:
+        in_sync = audit.run()
+    except Exception:
+        LOG.exception(_("Failed to audit OpenDaylight"))
+        return 2
+    return 0 if in_sync else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,11 +14,21 @@
 #    under the License.
 # @author: Dave Tucker, Hewlett-Packard Development Company L.P.
 
+import os
+import threading
 import time
 
+import eventlet
+from eventlet import semaphore
 import requests
 
+from neutron.openstack.common import log
+
+from odldrivers.common import config
 from odldrivers.common import exceptions as exc
+from odldrivers.common import metrics
+
+LOG = log.getLogger(__name__)
 
 
 class JsessionId(requests.auth.AuthBase):
@@ -26,17 +36,22 @@ class JsessionId(requests.auth.AuthBase):
     """Attaches the JSESSIONID and JSESSIONIDSSO cookies to an HTTP Request.
 
     If the cookies are not available or when the session expires, a new
-    set of cookies are obtained.
+    set of cookies are obtained. Only one caller refreshes the cookies at a
+    time, and a background thread renews them refresh_margin seconds ahead
+    of the deadline so that requests rarely wait on authentication.
     """
 
-    def __init__(self, url, username, password, timeout):
-        """Initialization function for JsessionId."""
+    def __init__(self, url, username, password, timeout,
+                 probe_path=config.DEFAULT_AUTH_PROBE_PATH, refresh_margin=0,
+                 request_timeout=None, get_session=None, metrics_sink=None,
+                 green=False):
+        """Initialization function for JsessionId.
 
-        # NOTE(kmestery) The 'limit' paramater is intended to limit how much
-        # data is returned from ODL. This is not implemented in the Hydrogen
-        # release of OpenDaylight, but will be implemented in the Helium
-        # timeframe. Hydrogen will silently ignore this value.
-        self.url = str(url) + '/networks?limit=1'
+        green makes callers wait for a refresh without blocking the eventlet
+        hub, for sessions which send through green sockets in processes
+        which are not monkey patched.
+        """
+        self.url = str(url) + '/' + probe_path
         self.username = username
         self.password = password
         self.auth_cookies = None
@@ -44,32 +59,84 @@ class JsessionId(requests.auth.AuthBase):
         self.expired = None
         self.session_timeout = timeout * 60
         self.session_deadline = 0
+        self.refresh_margin = refresh_margin
+        self.request_timeout = request_timeout
+        # Returns the pooled requests.Session the probe should be sent on.
+        self.get_session = get_session
+        self.metrics = metrics_sink or metrics.NullSink()
+        self._lock = semaphore.Semaphore() if green else threading.Lock()
+        self._generation = 0
+        self._refresher_pid = None
+
+    def obtain_auth_cookies(self, generation=None):
+        """Make a REST call to obtain cookies for ODL authenticiation.
+
+        generation is the value of _generation when the caller found the
+        cookies due for renewal. If they were renewed since, by a caller
+        which held the lock first, they are reused instead of
+        authenticating again. Without it the cookies are always renewed.
+        """
+
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            http = self.get_session() if self.get_session else requests
+            start = time.time()
+            try:
+                r = http.get(self.url, auth=(self.username, self.password),
+                             timeout=self.request_timeout)
+                r.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                self.metrics.incr('auth.failed')
+                raise exc.OpendaylightAuthError(msg=_("Failed to authenticate"
+                                                      " with OpenDaylight: %s"
+                                                      ) % e)
+            except requests.exceptions.Timeout as e:
+                self.metrics.incr('auth.failed')
+                raise exc.OpendaylightAuthError(msg=_("Authentication Timed"
+                                                      " Out: %s") % e)
+
+            self.metrics.timing('auth.refresh', time.time() - start)
+            jsessionid = r.cookies.get('JSESSIONID')
+            jsessionidsso = r.cookies.get('JSESSIONIDSSO')
+            if jsessionid and jsessionidsso:
+                self.auth_cookies = dict(JSESSIONID=jsessionid,
+                                         JSESSIONIDSSO=jsessionidsso)
+            self.session_deadline = time.time() + self.session_timeout
+            self._generation += 1
+
+    def _refresh_loop(self):
+        """Renew the cookies refresh_margin seconds before they expire."""
+        while True:
+            generation = self._generation
+            delay = self.session_deadline - self.refresh_margin - time.time()
+            if delay > 0:
+                eventlet.sleep(delay)
+                continue
+            try:
+                self.obtain_auth_cookies(generation)
+            except Exception as e:
+                LOG.warning(_("Failed to renew OpenDaylight session: %s"), e)
+                eventlet.sleep(self.refresh_margin)
 
-    def obtain_auth_cookies(self):
-        """Make a REST call to obtain cookies for ODL authenticiation."""
-
-        try:
-            r = requests.get(self.url, auth=(self.username, self.password))
-            r.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            raise exc.OpendaylightAuthError(msg=_("Failed to authenticate"
-                                                  " with OpenDaylight: %s"
-                                                  ) % e)
-        except requests.exceptions.Timeout as e:
-            raise exc.OpendaylightAuthError(msg=_("Authentication Timed"
-                                                  " Out: %s") % e)
-
-        jsessionid = r.cookies.get('JSESSIONID')
-        jsessionidsso = r.cookies.get('JSESSIONIDSSO')
-        if jsessionid and jsessionidsso:
-            self.auth_cookies = dict(JSESSIONID=jsessionid,
-                                     JSESSIONIDSSO=jsessionidsso)
+    def start_refresher(self):
+        """Start the background refresh thread once in each process."""
+        if not self.refresh_margin or self._refresher_pid == os.getpid():
+            return
+        self._refresher_pid = os.getpid()
+        eventlet.spawn_n(self._refresh_loop)
 
     def __call__(self, r):
         """Verify timestamp for Tomcat session timeout."""
 
+        generation = self._generation
         if time.time() > self.session_deadline:
-            self.obtain_auth_cookies()
+            self.obtain_auth_cookies(generation)
+            self.start_refresher()
         self.session_deadline = time.time() + self.session_timeout
+        if self.auth_cookies:
+            # The pooled session may already have set the cookies of an
+            # expired session, which prepare_cookies() would not replace.
+            r.headers.pop('Cookie', None)
         r.prepare_cookies(self.auth_cookies)
         return r
@@ -14,37 +14,513 @@
 #    under the License.
 # @author: Dave Tucker, Red Hat Inc.
 
-import requests
+import collections
+import functools
+import gzip
+import io
+import itertools
+import logging
+import os
+import random
+import threading
+import time
 
+import eventlet
+from oslo.config import cfg
 from oslo.serialization import jsonutils
+from oslo.utils import importutils
+import requests
+from requests import adapters
+from six.moves.urllib import parse as urlparse
+
 from neutron.openstack.common import log
 
 from odldrivers.common import auth
+from odldrivers.common import config
+from odldrivers.common import exceptions as odl_exc
+from odldrivers.common import green_http
+from odldrivers.common import metrics
+from odldrivers.common import utils
 
 LOG = log.getLogger(__name__)
 
+# Methods which are safe to repeat if the first attempt may have reached
+# the controller.
+IDEMPOTENT_METHODS = frozenset(['get', 'head', 'put', 'delete'])
+RETRY_STATUS_CODES = frozenset([500, 502, 503, 504])
+BACKENDS = ('requests', 'eventlet')
 
-class OpenDaylightRestClient(object):
+BatchResult = collections.namedtuple('BatchResult',
+                                     ['index', 'count', 'failed'])
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def load_json_encoder(name):
+    """Return the dumps function of the named JSON module, if available.
+
+    Falls back to jsonutils.dumps when name is empty or the module cannot
+    be imported, so a faster encoder such as ujson stays optional.
+    """
+    if name:
+        module = importutils.try_import(name)
+        if module is not None and hasattr(module, 'dumps'):
+            return module.dumps
+        LOG.warning(_("JSON encoder %s is not available, using jsonutils"),
+                    name)
+    return jsonutils.dumps
+
+
+def get_client():
+    """Return the OpenDaylightRestClient shared by every driver.
+
+    The ML2, L3, LBaaS and FWaaS drivers all talk to the same controller,
+    so they share a single client (and its connection pool) per process.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            conf = cfg.CONF.odl_rest
+            _client = OpenDaylightRestClient(
+                conf.url,
+                conf.username,
+                conf.password,
+                conf.timeout,
+                conf.session_timeout,
+                auth_probe_path=conf.auth_probe_path,
+                auth_refresh_margin=conf.auth_refresh_margin,
+                cluster_urls=conf.cluster_urls,
+                pool_connections=conf.pool_connections,
+                pool_maxsize=conf.pool_maxsize,
+                pool_idle_timeout=conf.pool_idle_timeout,
+                json_compact=conf.json_compact,
+                json_encoder=conf.json_encoder,
+                compress_threshold=conf.compress_threshold,
+                retry_count=conf.retry_count,
+                retry_backoff=conf.retry_backoff,
+                retry_backoff_max=conf.retry_backoff_max,
+                circuit_failure_threshold=conf.circuit_failure_threshold,
+                circuit_reset_timeout=conf.circuit_reset_timeout,
+                metrics_sink=metrics.get_sink(),
+                backend=conf.client_backend
+            )
+        return _client
+
+
+class CircuitBreaker(object):
+
+    """Fail fast once the controller has failed repeatedly.
 
-    def __init__(self, url, username, password, timeout, session_timeout):
+    After threshold consecutive failures the breaker opens and allow()
+    returns False. Once reset_timeout seconds have passed a single trial
+    request is allowed; its success closes the breaker again, and its
+    failure re-opens it. A threshold of 0 disables the breaker.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    @property
+    def available(self):
+        """Whether allow() would currently let a request through."""
+        return self.opened_at is None or (
+            not self._trial and
+            time.time() - self.opened_at >= self.reset_timeout)
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if (not self._trial and
+                    time.time() - self.opened_at >= self.reset_timeout):
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold and (self._trial or
+                                   self.failures >= self.threshold):
+                if self.opened_at is None or self._trial:
+                    LOG.warning(_("OpenDaylight failed %d times in a row, "
+                                  "failing fast for %d seconds"),
+                                self.failures, self.reset_timeout)
+                self.opened_at = time.time()
+                self._trial = False
+
+
+class ClusterMember(object):
+
+    """One OpenDaylight controller the client can send requests to.
+
+    Each member has its own session cookies and circuit breaker, and keeps
+    a moving average of its response time and a count of requests in
+    flight, which the client uses to spread load across the cluster.
+    """
+
+    latency_weight = 0.2
+
+    def __init__(self, url, auth, breaker):
         self.url = url
+        self.auth = auth
+        self.breaker = breaker
+        self.latency = 0.0
+        self.inflight = 0
+        self.requests = 0
+
+    def record_latency(self, seconds):
+        if not self.latency:
+            self.latency = seconds
+        else:
+            self.latency += self.latency_weight * (seconds - self.latency)
+
+    @property
+    def load(self):
+        return self.latency * (self.inflight + 1)
+
+
+class OpenDaylightRestClient(object):
+
+    def __init__(self, url, username, password, timeout, session_timeout,
+                 auth_probe_path=config.DEFAULT_AUTH_PROBE_PATH,
+                 auth_refresh_margin=0,
+                 cluster_urls=None, pool_connections=10, pool_maxsize=10,
+                 pool_idle_timeout=0,
+                 json_compact=True, json_encoder=None, compress_threshold=0,
+                 retry_count=0, retry_backoff=0.5, retry_backoff_max=10,
+                 circuit_failure_threshold=0, circuit_reset_timeout=30,
+                 metrics_sink=None, backend='requests'):
+        if backend not in BACKENDS:
+            LOG.warning(_("Unknown client backend %s, using requests"),
+                        backend)
+            backend = 'requests'
+        self.backend = backend
+        urls = cluster_urls or [url]
+        self.metrics = metrics_sink or metrics.NullSink()
+        self.url = urls[0]
         self.timeout = timeout
-        self.auth = auth.JsessionId(url, username, password, session_timeout)
+        self.members = [
+            ClusterMember(
+                member_url,
+                auth.JsessionId(member_url, username, password,
+                                session_timeout,
+                                probe_path=auth_probe_path,
+                                refresh_margin=auth_refresh_margin,
+                                request_timeout=timeout,
+                                get_session=lambda: self.session,
+                                metrics_sink=self.metrics,
+                                green=backend == 'eventlet'),
+                CircuitBreaker(circuit_failure_threshold,
+                               circuit_reset_timeout))
+            for member_url in urls]
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_idle_timeout = pool_idle_timeout
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+        self._last_used = 0
+        self.json_compact = json_compact
+        self.compress_threshold = compress_threshold
+        self._dumps = load_json_encoder(json_encoder)
+        self.retry_count = retry_count
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+
+    def _new_session(self):
+        """Build a requests session backed by a keep-alive connection pool.
+
+        The eventlet backend sends through green sockets, so any number of
+        green threads can have requests in flight, sharing pool_maxsize
+        connections per controller, without blocking the hub.
+        """
+        session = requests.Session()
+        if self.backend == 'eventlet':
+            adapter = green_http.GreenHTTPAdapter(self.pool_maxsize)
+        else:
+            adapter = adapters.HTTPAdapter(
+                pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def session(self):
+        """Return the pooled session, recycling it when it has gone idle.
+
+        The session is also rebuilt after a fork so that API workers never
+        share sockets with their parent.
+        """
+        with self._session_lock:
+            now = time.time()
+            if self._session is not None:
+                idle = now - self._last_used
+                if ((self.pool_idle_timeout and
+                     idle > self.pool_idle_timeout) or
+                        self._session_pid != os.getpid()):
+                    self._session.close()
+                    self._session = None
+            if self._session is None:
+                self._session = self._new_session()
+                self._session_pid = os.getpid()
+            self._last_used = now
+            return self._session
+
+    def encode(self, obj):
+        """Serialize obj for the request body."""
+        if self.json_compact:
+            return self._dumps(obj)
+        return self._dumps(obj, indent=2)
+
+    def _compress(self, data, headers):
+        """Gzip bodies larger than compress_threshold bytes."""
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        if not self.compress_threshold or len(data) < self.compress_threshold:
+            return data
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+            f.write(data)
+        headers['Content-Encoding'] = 'gzip'
+        return buf.getvalue()
+
+    def _backoff(self, attempt):
+        """Sleep for a jittered, exponentially growing delay."""
+        delay = min(self.retry_backoff * 2 ** attempt, self.retry_backoff_max)
+        eventlet.sleep(random.uniform(0, delay))
+
+    def _choose_member(self, tried):
+        """Pick the least loaded healthy member, preferring untried ones."""
+        healthy = [m for m in self.members if m.breaker.available]
+        untried = [m for m in healthy if m not in tried]
+        for member in sorted(untried or healthy,
+                             key=lambda m: (m.load, m.requests)):
+            if member.breaker.allow():
+                return member
+
+    def _send(self, member, method, urlpath, headers, data):
+        url = '/'.join([member.url, urlpath])
+        LOG.debug(_('ODL-----> sending URL (%s) <-----ODL'), url)
+        member.inflight += 1
+        member.requests += 1
+        start = time.time()
+        try:
+            r = self.session.request(method, url=url,
+                                     headers=headers, data=data,
+                                     auth=member.auth, timeout=self.timeout)
+        finally:
+            member.inflight -= 1
+        member.record_latency(time.time() - start)
+        return r
+
+    def _request(self, method, urlpath, headers, data):
+        """Send a request to the best available cluster member.
+
+        Idempotent methods are retried up to retry_count times on timeouts,
+        connection errors and 5xx responses, and any request which cannot
+        connect fails over to a member which has not been tried yet. The
+        client only backs off once every healthy member has been tried.
+
+        Raises OpendaylightUnavailable without contacting the controller
+        while every member's circuit breaker is open.
+        """
+        retries = 0
+        if method.lower() in IDEMPOTENT_METHODS:
+            retries = self.retry_count
+        tried = set()
+        attempt = 0
+        while True:
+            member = self._choose_member(tried)
+            if member is None:
+                raise odl_exc.OpendaylightUnavailable(
+                    url=', '.join(m.url for m in self.members))
+            if member in tried:
+                self._backoff(attempt - 1)
+            tried.add(member)
+            attempt += 1
+            try:
+                r = self._send(member, method, urlpath, headers, data)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                member.breaker.record_failure()
+                failover = (isinstance(e, requests.exceptions.ConnectionError)
+                            and len(tried) < len(self.members))
+                if attempt > retries and not failover:
+                    raise
+                LOG.debug(_("Retrying %(method)s %(urlpath)s after "
+                            "%(exc)s from %(url)s"),
+                          {'method': method, 'urlpath': urlpath, 'exc': e,
+                           'url': member.url})
+                continue
+            except Exception:
+                # Whatever ends a half-open trial has to settle the breaker,
+                # or it stays open for good.
+                member.breaker.record_failure()
+                raise
+            if r.status_code not in RETRY_STATUS_CODES:
+                member.breaker.record_success()
+                return r
+            member.breaker.record_failure()
+            if attempt > retries:
+                return r
+            LOG.debug(_("Retrying %(method)s %(urlpath)s after status "
+                        "%(status)d from %(url)s"),
+                      {'method': method, 'urlpath': urlpath,
+                       'status': r.status_code, 'url': member.url})
 
     def sendjson(self, method, urlpath, obj, ignorecodes=[]):
-        """Send json to the OpenDaylight controller."""
+        """Send json to the OpenDaylight controller.
 
+        Records the request's latency, status code and byte counts under
+        'request.<collection>.<method>', and the time spent encoding the
+        body under 'encode.<collection>'.
+        """
+
+        collection = urlpath.split('?', 1)[0].split('/', 1)[0]
+        name = 'request.%s.%s' % (collection, method.lower())
         headers = {'Content-Type': 'application/json'}
-        data = jsonutils.dumps(obj, indent=2) if obj else None
-        url = '/'.join([self.url, urlpath])
-        LOG.debug(_('ODL-----> sending URL (%s) <-----ODL') % url)
-        LOG.debug(_('ODL-----> sending JSON (%s) <-----ODL') % data)
-        r = requests.request(method, url=url,
-                             headers=headers, data=data,
-                             auth=self.auth, timeout=self.timeout)
+        data = None
+        if obj:
+            with self.metrics.timer('encode.' + collection):
+                data = self.encode(obj)
+            # Payloads can be very large during a resync; only log them if
+            # they will actually be written.
+            if LOG.isEnabledFor(logging.DEBUG):
+                LOG.debug(_('ODL-----> sending JSON (%s) <-----ODL'), data)
+            data = self._compress(data, headers)
+            self.metrics.incr(name + '.bytes_sent', len(data))
+        start = time.time()
+        try:
+            r = self._request(method, urlpath, headers, data)
+        except Exception:
+            self.metrics.incr(name + '.failed')
+            raise
+        self.metrics.timing(name, time.time() - start)
+        self.metrics.incr('%s.status.%d' % (name, r.status_code))
+        self.metrics.incr(name + '.bytes_received', len(r.content))
 
         # ignorecodes contains a list of HTTP error codes to ignore.
-        LOG.debug(_('ODL-----> status code (%i) <------ODL') % r.status_code)
+        LOG.debug(_('ODL-----> status code (%i) <------ODL'), r.status_code)
         if r.status_code in ignorecodes:
             return
         r.raise_for_status()
+        return r
+
+    def list_collection(self, collection, page_size=None, fields=None,
+                        filters=None):
+        """Iterate over every object in an OpenDaylight collection.
+
+        The collection is fetched a page at a time using limit/marker
+        pagination, so walking it costs one request per page rather than
+        one per object. Controllers which ignore 'limit' (Hydrogen) return
+        the whole collection in the first page, which ends the walk. The
+        collection may be a path such as 'lbaas/pools', whose objects are
+        listed under its last segment. filters maps attributes to the
+        value the listed objects must have; callers should not rely on a
+        controller applying them.
+        """
+        key = collection.rsplit('/', 1)[-1]
+        marker = None
+        first_id = None
+        while True:
+            query = dict(filters or {})
+            if page_size:
+                query['limit'] = page_size
+            if marker:
+                query['marker'] = marker
+            if fields:
+                query['fields'] = fields
+            urlpath = collection
+            if query:
+                urlpath += '?' + urlparse.urlencode(sorted(query.items()),
+                                                    doseq=True)
+            r = self.sendjson('get', urlpath, None)
+            page = r.json().get(key, [])
+            if not page or page[0]['id'] == first_id:
+                return
+            for obj in page:
+                yield obj
+            if not page_size or len(page) != page_size:
+                return
+            first_id = page[0]['id']
+            marker = page[-1]['id']
+
+    def _post_batch(self, collection, resource_name, ignorecodes, index,
+                    batch):
+        """POST one batch, falling back to one request per resource.
+
+        ODL rejects a whole bulk request with a 400 when any of its objects
+        exists, so a 400 is only ignored for single objects; for a batch it
+        means the objects are retried one at a time.
+        """
+        if len(batch) > 1:
+            try:
+                self.sendjson('post', collection,
+                              {collection.rsplit('/', 1)[-1]: batch},
+                              [code for code in ignorecodes if code != 400])
+                return BatchResult(index, len(batch), [])
+            except odl_exc.OpendaylightUnavailable:
+                raise
+            except Exception as e:
+                LOG.warning(_("Bulk create of %(count)d %(collection)s "
+                              "failed, retrying individually: %(exc)s"),
+                            {'count': len(batch), 'collection': collection,
+                             'exc': e})
+
+        failed = []
+        for resource in batch:
+            try:
+                self.sendjson('post', collection, {resource_name: resource},
+                              ignorecodes)
+            except odl_exc.OpendaylightUnavailable:
+                raise
+            except Exception as e:
+                LOG.warning(_("Failed to create %(name)s %(id)s: %(exc)s"),
+                            {'name': resource_name, 'id': resource['id'],
+                             'exc': e})
+                failed.append(resource['id'])
+        return BatchResult(index, len(batch), failed)
+
+    def bulk_post(self, collection, resource_name, resources, batch_size,
+                  workers, ignorecodes=[]):
+        """Create resources in concurrent, size-bounded bulk requests.
+
+        Resources are split into batches of at most batch_size objects and
+        up to workers batches are in flight at once. A batch which fails
+        is retried one resource at a time so a single bad object does not
+        lose the rest. Returns a BatchResult for every batch.
+
+        OpendaylightUnavailable is raised rather than counted as a failure,
+        since nothing can be created until the controller is back.
+        """
+        pool = eventlet.GreenPool(max(workers, 1))
+        post = functools.partial(self._post_batch, collection, resource_name,
+                                 ignorecodes)
+        batches = utils.chunks(resources, max(batch_size, 1))
+        results = []
+        for result in pool.imap(post, itertools.count(), batches):
+            LOG.debug(_("Batch %(index)d of %(collection)s: %(ok)d created, "
+                        "%(failed)d failed"),
+                      {'index': result.index, 'collection': collection,
+                       'ok': result.count - len(result.failed),
+                       'failed': len(result.failed)})
+            results.append(result)
+        return results
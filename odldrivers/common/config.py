@@ -16,9 +16,15 @@
 
 from oslo.config import cfg
 
+# Default of auth_probe_path, also used by clients built without the options.
+DEFAULT_AUTH_PROBE_PATH = 'networks?limit=1&fields=id'
+
 odl_opts = [
     cfg.StrOpt('url',
                help=_("HTTP URL of OpenDaylight REST interface.")),
+    cfg.ListOpt('cluster_urls', default=[],
+                help=_("HTTP URLs of the REST interface of every member of "
+                       "an OpenDaylight cluster. Overrides url.")),
     cfg.StrOpt('username',
                help=_("HTTP username for authentication")),
     cfg.StrOpt('password', secret=True,
@@ -27,6 +33,145 @@ odl_opts = [
                help=_("HTTP timeout in seconds.")),
     cfg.IntOpt('session_timeout', default=30,
                help=_("Tomcat session timeout in minutes.")),
+    cfg.StrOpt('auth_probe_path', default=DEFAULT_AUTH_PROBE_PATH,
+               help=_("Path, relative to url, requested to obtain session "
+                      "cookies. It should be cheap for the controller to "
+                      "answer; releases of OpenDaylight which do not "
+                      "implement 'limit' or 'fields' ignore them.")),
+    cfg.IntOpt('auth_refresh_margin', default=60,
+               help=_("Seconds before the session expires at which it is "
+                      "renewed in the background. 0 renews it on the next "
+                      "request after it has expired.")),
+    cfg.IntOpt('pool_connections', default=10,
+               help=_("Number of per-host connection pools to cache.")),
+    cfg.IntOpt('pool_maxsize', default=10,
+               help=_("Maximum number of connections kept open to a single "
+                      "OpenDaylight host.")),
+    cfg.IntOpt('pool_idle_timeout', default=60,
+               help=_("Seconds the connection pool may sit idle before its "
+                      "connections are closed. 0 disables idle eviction.")),
+    cfg.StrOpt('client_backend', default='requests',
+               help=_("How requests are sent to OpenDaylight: 'requests' "
+                      "or 'eventlet', which never blocks other green "
+                      "threads and lets many share the connection pool.")),
+    cfg.BoolOpt('json_compact', default=True,
+                help=_("Send JSON without indentation.")),
+    cfg.StrOpt('json_encoder',
+               help=_("Name of a module with a json-compatible dumps "
+                      "function, such as ujson, used to encode request "
+                      "bodies when it is installed.")),
+    cfg.IntOpt('compress_threshold', default=0,
+               help=_("Gzip request bodies of at least this many bytes. "
+                      "0 disables compression.")),
+    cfg.IntOpt('retry_count', default=3,
+               help=_("Number of times an idempotent request (GET, PUT, "
+                      "DELETE) is retried after a timeout, connection error "
+                      "or 5xx response.")),
+    cfg.FloatOpt('retry_backoff', default=0.5,
+                 help=_("Initial delay in seconds between request retries. "
+                        "The delay doubles on each retry and is jittered.")),
+    cfg.FloatOpt('retry_backoff_max', default=10,
+                 help=_("Maximum delay in seconds between request "
+                        "retries.")),
+    cfg.IntOpt('circuit_failure_threshold', default=5,
+               help=_("Number of consecutive failed requests after which "
+                      "requests fail immediately instead of waiting on the "
+                      "controller. 0 disables the circuit breaker.")),
+    cfg.IntOpt('circuit_reset_timeout', default=30,
+               help=_("Seconds to fail fast before a request is let "
+                      "through to check whether the controller is back.")),
+    cfg.IntOpt('sync_page_size', default=1000,
+               help=_("Number of objects read per page from the Neutron "
+                      "database and from OpenDaylight collections during a "
+                      "resync.")),
+    cfg.IntOpt('sync_batch_size', default=500,
+               help=_("Maximum number of objects sent in a single bulk "
+                      "request during a resync.")),
+    cfg.IntOpt('sync_workers', default=4,
+               help=_("Number of bulk requests sent concurrently during a "
+                      "resync.")),
+    cfg.BoolOpt('journal_enabled', default=True,
+                help=_("Queue operations in a local journal and send them "
+                       "to OpenDaylight from background workers instead of "
+                       "inside the API request.")),
+    cfg.StrOpt('journal_path', default='$state_path/odl_journal.sqlite',
+               help=_("Location of the SQLite journal of pending "
+                      "OpenDaylight operations.")),
+    cfg.IntOpt('journal_workers', default=2,
+               help=_("Number of background workers draining the journal.")),
+    cfg.IntOpt('journal_max_retries', default=5,
+               help=_("Number of times a journal entry is retried before "
+                      "the driver falls back to a resync.")),
+    cfg.IntOpt('journal_retry_interval', default=1,
+               help=_("Initial delay in seconds before a failed journal "
+                      "entry is retried. The delay doubles on each retry.")),
+    cfg.IntOpt('journal_retry_interval_max', default=60,
+               help=_("Maximum delay in seconds between retries of a "
+                      "journal entry.")),
+    cfg.IntOpt('journal_batch_size', default=100,
+               help=_("Maximum number of journal entries sent to "
+                      "OpenDaylight in one bulk request.")),
+    cfg.FloatOpt('journal_batch_window', default=0.05,
+                 help=_("Seconds a journal worker waits for more entries "
+                        "to arrive before sending a bulk request.")),
+    cfg.StrOpt('snapshot_path', default='$state_path/odl_snapshot.json',
+               help=_("File recording what was last pushed to OpenDaylight, "
+                      "so that a restart only resyncs what changed. Empty "
+                      "disables the snapshot.")),
+    cfg.IntOpt('snapshot_save_interval', default=10,
+               help=_("Seconds between saves of the snapshot.")),
+    cfg.IntOpt('resync_retry_interval', default=10,
+               help=_("Seconds between attempts of a failed background "
+                      "full resync.")),
+    cfg.IntOpt('dirty_resync_interval', default=5,
+               help=_("Seconds between background resyncs of the objects "
+                      "which failed to reach OpenDaylight. 0 leaves them to "
+                      "the reconciler.")),
+    cfg.IntOpt('dirty_retry_interval_max', default=300,
+               help=_("Maximum seconds before an object whose background "
+                      "resync keeps failing is tried again.")),
+    cfg.IntOpt('sg_cache_size', default=1000,
+               help=_("Maximum number of security groups cached for port "
+                      "payloads. 0 disables the cache.")),
+    cfg.IntOpt('sg_cache_ttl', default=60,
+               help=_("Seconds a cached security group is used before it is "
+                      "read from the database again. 0 keeps it until the "
+                      "group changes.")),
+    cfg.BoolOpt('delta_updates', default=False,
+                help=_("Send only the attributes which changed when a "
+                       "network, subnet or port is updated, and nothing "
+                       "when none of the attributes sent to OpenDaylight "
+                       "changed.")),
+    cfg.ListOpt('network_types',
+                default=['local', 'gre', 'vxlan', 'vlan'],
+                help=_("Network types of the segments ports may be bound "
+                       "to.")),
+    cfg.IntOpt('segment_cache_size', default=1000,
+               help=_("Maximum number of networks whose chosen binding "
+                      "segment is cached. 0 disables the cache.")),
+    cfg.BoolOpt('hostconfig_enabled', default=False,
+                help=_("Only bind ports to segments the host's OpenDaylight "
+                       "hostconfig allows.")),
+    cfg.IntOpt('hostconfig_cache_ttl', default=300,
+               help=_("Seconds a host's OpenDaylight hostconfig is cached "
+                      "for.")),
+    cfg.IntOpt('reconcile_interval', default=0,
+               help=_("Seconds between background comparisons of Neutron "
+                      "and OpenDaylight which resync only the objects that "
+                      "differ. 0 disables the reconciler.")),
+    cfg.IntOpt('lbaas_stats_interval', default=30,
+               help=_("Seconds between polls of load balancer pool "
+                      "statistics from OpenDaylight. 0 disables polling.")),
+    cfg.StrOpt('metrics_sink', default='',
+               help=_("Where to send request and sync metrics: 'statsd', "
+                      "'memory', or the import path of a MetricsSink "
+                      "class. Empty disables metrics.")),
+    cfg.StrOpt('metrics_statsd_host', default='127.0.0.1',
+               help=_("Host of the statsd server metrics are sent to.")),
+    cfg.IntOpt('metrics_statsd_port', default=8125,
+               help=_("UDP port of the statsd server metrics are sent to.")),
+    cfg.StrOpt('metrics_prefix', default='odl',
+               help=_("Prefix of every metric name sent to statsd.")),
 ]
 
 cfg.CONF.register_opts(odl_opts, "odl_rest")
@@ -19,3 +19,11 @@ from neutron.common import exceptions as exc
 
 class OpendaylightAuthError(exc.NeutronException):
     message = '%(msg)s'
+
+
+class OpendaylightSyncError(exc.NeutronException):
+    message = _('Failed to sync %(count)d %(collection)s to OpenDaylight')
+
+
+class OpendaylightUnavailable(exc.ServiceUnavailable):
+    message = _('OpenDaylight at %(url)s is unavailable')
@@ -0,0 +1,213 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import socket
+import ssl
+import threading
+import zlib
+
+from eventlet.green import httplib
+from eventlet import pools
+import requests
+from requests import adapters
+from requests import certs
+from requests import cookies
+from requests import structures
+from requests import utils
+from six.moves.urllib import parse as urlparse
+
+# Methods which may be sent again when a reused connection fails after the
+# request was written, since the server may already have acted on it.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+
+def _ssl_context(verify, cert):
+    """Build the SSL context requests would use for verify and cert."""
+    if not hasattr(ssl, 'create_default_context'):
+        raise requests.exceptions.SSLError(
+            _("HTTPS with the eventlet client backend needs Python 2.7.9 "
+              "or later"))
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif verify is True:
+        context = ssl.create_default_context(cafile=certs.where())
+    elif os.path.isdir(verify):
+        context = ssl.create_default_context(capath=verify)
+    else:
+        context = ssl.create_default_context(cafile=verify)
+    if cert:
+        if isinstance(cert, tuple):
+            context.load_cert_chain(*cert)
+        else:
+            context.load_cert_chain(cert)
+    return context
+
+
+class _ConnectionPool(pools.Pool):
+
+    """Keep-alive connections to one host, shared by green threads.
+
+    A green thread which finds every connection busy waits for one to be
+    put back without blocking the hub, so any number of green threads may
+    send through max_size connections.
+    """
+
+    def __init__(self, scheme, host, port, max_size, context=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.context = context
+        super(_ConnectionPool, self).__init__(max_size=max_size)
+
+    def create(self):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, self.port,
+                                           context=self.context)
+        return httplib.HTTPConnection(self.host, self.port)
+
+    def close(self):
+        while self.free_items:
+            self.free_items.popleft().close()
+
+
+class _RawResponse(object):
+
+    """What requests expects to find in Response.raw for cookies."""
+
+    def __init__(self, response):
+        self._original_response = response
+
+    def release_conn(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class GreenHTTPAdapter(adapters.BaseAdapter):
+
+    """A requests transport adapter built on eventlet green sockets.
+
+    Requests never block the eventlet hub, even in processes which are not
+    monkey patched, and at most pool_maxsize connections are opened to
+    each host however many green threads are sending.
+
+    verify and cert are honored as by the requests adapter. Proxies are not
+    supported, so a request which would go through one fails instead of
+    silently bypassing it.
+    """
+
+    def __init__(self, pool_maxsize=10):
+        super(GreenHTTPAdapter, self).__init__()
+        self.pool_maxsize = pool_maxsize
+        self.pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, url, verify, cert):
+        key = (url.scheme, url.hostname,
+               url.port or (443 if url.scheme == 'https' else 80))
+        if url.scheme == 'https':
+            # Connections are only shared by requests with the same
+            # verify and cert.
+            key += (verify, cert)
+        with self._lock:
+            if key not in self.pools:
+                context = None
+                if url.scheme == 'https':
+                    context = _ssl_context(verify, cert)
+                self.pools[key] = _ConnectionPool(key[0], key[1], key[2],
+                                                  self.pool_maxsize, context)
+            return self.pools[key]
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        url = urlparse.urlsplit(request.url)
+        proxies = proxies or {}
+        if (proxies.get('%s://%s' % (url.scheme, url.hostname)) or
+                proxies.get(url.scheme) or proxies.get('all')):
+            raise requests.exceptions.RequestException(
+                _("The eventlet client backend does not support proxies; "
+                  "use the requests backend to reach %s") % request.url,
+                request=request)
+        if isinstance(cert, list):
+            cert = tuple(cert)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        if isinstance(timeout, tuple):
+            timeout = max(t for t in timeout if t is not None)
+        with self._pool(url, verify, cert).item() as conn:
+            response, content = self._exchange(conn, request, path, timeout)
+        return self.build_response(request, response, content)
+
+    def _exchange(self, conn, request, path, timeout):
+        # A connection the server closed while it sat in the pool only
+        # fails once it is used, so such a failure is tried once more on a
+        # new connection: always if the request could not be written, and
+        # only for idempotent methods once it was.
+        reused = conn.sock is not None
+        while True:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            written = False
+            try:
+                conn.request(request.method, path, body=request.body,
+                             headers=dict(request.headers))
+                written = True
+                response = conn.getresponse()
+                content = response.read()
+            except socket.timeout as e:
+                conn.close()
+                raise requests.exceptions.Timeout(e, request=request)
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                if reused and (not written or
+                               request.method.upper() in IDEMPOTENT_METHODS):
+                    reused = False
+                    continue
+                raise requests.exceptions.ConnectionError(e, request=request)
+            if response.will_close:
+                conn.close()
+            return response, content
+
+    def build_response(self, request, response, content):
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        if encoding == 'gzip':
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            content = zlib.decompress(content)
+        r = requests.Response()
+        r.status_code = response.status
+        r.reason = response.reason
+        r.headers = structures.CaseInsensitiveDict(response.getheaders())
+        r.encoding = utils.get_encoding_from_headers(r.headers)
+        r.raw = _RawResponse(response)
+        r._content = content
+        r._content_consumed = True
+        r.url = request.url
+        r.request = request
+        r.connection = self
+        cookies.extract_cookies_to_jar(r.cookies, request, r.raw)
+        return r
+
+    def close(self):
+        with self._lock:
+            for pool in self.pools.values():
+                pool.close()
+            self.pools.clear()
@@ -0,0 +1,477 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+
+import eventlet
+from oslo.config import cfg
+from oslo.serialization import jsonutils
+
+from neutron.openstack.common import log
+
+from odldrivers.common import config  # noqa
+from odldrivers.common import exceptions as odl_exc
+from odldrivers.common import metrics
+
+LOG = log.getLogger(__name__)
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    object_type TEXT NOT NULL,
+    object_id TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    state TEXT NOT NULL,
+    retry_count INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_update REAL NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS journal_object
+    ON journal (object_type, object_id, seq);
+CREATE INDEX IF NOT EXISTS journal_state
+    ON journal (state, next_attempt);
+"""
+
+# Pending operations which can be folded into a newer operation on the same
+# object: the result is sent instead of both, or nothing when it is None.
+# The object is always read back from the database when it is dispatched,
+# so a coalesced create or update carries the latest state. An update may
+# instead carry the attributes which changed as its data; coalesced updates
+# merge their data, newer values winning, unless either has none.
+COALESCED_OPERATIONS = {
+    ('create', 'update'): 'create',
+    ('create', 'delete'): None,
+    ('update', 'update'): 'update',
+    ('update', 'delete'): 'delete',
+}
+
+
+class RetryLater(Exception):
+    """Raised by a handler to put an entry back without using a retry."""
+
+
+Entry = collections.namedtuple('Entry', ['seq', 'object_type', 'object_id',
+                                         'operation', 'retry_count', 'data'])
+Entry.__new__.__defaults__ = (None,)
+
+
+def create_journal(object_types, handler, on_failure=None,
+                   batch_handler=None, batch_operations=()):
+    """Build a Journal for object_types from the [odl_rest] options."""
+    conf = cfg.CONF.odl_rest
+    return Journal(conf.journal_path, object_types, handler,
+                   on_failure=on_failure,
+                   batch_handler=batch_handler,
+                   batch_operations=batch_operations,
+                   batch_size=conf.journal_batch_size,
+                   batch_window=conf.journal_batch_window,
+                   workers=conf.journal_workers,
+                   max_retries=conf.journal_max_retries,
+                   retry_interval=conf.journal_retry_interval,
+                   retry_interval_max=conf.journal_retry_interval_max,
+                   unavailable_delay=conf.circuit_reset_timeout,
+                   metrics_sink=metrics.get_sink())
+
+
+class Journal(object):
+
+    """Persistent queue of operations waiting to be sent to OpenDaylight.
+
+    Postcommit hooks record an entry and return immediately; background
+    workers drain the journal by calling handler(entry). Entries for the
+    same object are dispatched strictly in the order they were recorded,
+    while different objects are dispatched concurrently. A failed entry is
+    retried with exponential backoff and handed to on_failure once it has
+    used up its retries. While the controller is known to be unavailable
+    entries keep their place and their retries, and the workers pause for
+    unavailable_delay seconds. A handler may also raise RetryLater to put
+    an entry back, and pause() holds every worker until resume().
+
+    Operations listed in batch_operations as (object_type, operation) pairs
+    are dispatched in groups: a worker which claims one waits batch_window
+    seconds for more to arrive, claims up to batch_size of them and calls
+    batch_handler(entries), which returns the entries that failed.
+
+    The journal is a SQLite database so that pending operations survive a
+    neutron-server restart, and several API worker processes may share it.
+    """
+
+    poll_interval = 1
+
+    def __init__(self, path, object_types, handler, on_failure=None,
+                 workers=2, max_retries=5, retry_interval=1,
+                 retry_interval_max=60, processing_timeout=300,
+                 unavailable_delay=30, batch_handler=None,
+                 batch_operations=(), batch_size=100, batch_window=0,
+                 metrics_sink=None):
+        self.path = path
+        self.object_types = tuple(object_types)
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self.retry_interval_max = retry_interval_max
+        self.processing_timeout = processing_timeout
+        self.unavailable_delay = unavailable_delay
+        self.batch_handler = batch_handler
+        self.batch_operations = frozenset(batch_operations)
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.metrics = metrics_sink or metrics.NullSink()
+        self._next_report = 0
+        self._next_reset = 0
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._conn = None
+        self._pid = None
+        self._worker_pid = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            if self.path != ':memory:':
+                dirname = os.path.dirname(self.path)
+                if dirname and not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+            self._conn = sqlite3.connect(self.path, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+            columns = [row[1] for row in
+                       self._conn.execute('PRAGMA table_info(journal)')]
+            if 'data' not in columns:
+                # Journal created by an older release.
+                self._conn.execute('ALTER TABLE journal ADD COLUMN data TEXT')
+            self._pid = os.getpid()
+        return self._conn
+
+    def size(self):
+        """Return the number of entries waiting or being dispatched."""
+        with self._lock:
+            return self.conn.execute(
+                'SELECT COUNT(*) FROM journal WHERE ' + self._type_filter(),
+                self.object_types).fetchone()[0]
+
+    def report_depth(self):
+        """Send the number of entries of each object type as gauges."""
+        depth = dict.fromkeys(self.object_types, 0)
+        with self._lock:
+            depth.update(self.conn.execute(
+                'SELECT object_type, COUNT(*) FROM journal WHERE ' +
+                self._type_filter() + ' GROUP BY object_type',
+                self.object_types).fetchall())
+        for object_type, count in depth.items():
+            self.metrics.gauge('journal.depth.' + object_type, count)
+
+    def _type_filter(self):
+        return ('object_type IN (%s)' %
+                ', '.join('?' for t in self.object_types))
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def record(self, object_type, object_id, operation, data=None):
+        """Append an operation to the journal and wake up a worker.
+
+        data is an optional dict stored with the entry and handed back to
+        the handler as entry.data. If the newest entry for the object has
+        not been dispatched yet, the two are coalesced according to
+        COALESCED_OPERATIONS so that bursts of changes to one object cost a
+        single request.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            last = conn.execute(
+                'SELECT seq, operation, state, data FROM journal '
+                'WHERE object_type = ? AND object_id = ? '
+                'ORDER BY seq DESC LIMIT 1',
+                (object_type, object_id)).fetchone()
+            if (last is not None and last[2] == PENDING and
+                    (last[1], operation) in COALESCED_OPERATIONS):
+                merged = COALESCED_OPERATIONS[(last[1], operation)]
+                LOG.debug(_("Coalescing %(new)s of %(type)s %(id)s with "
+                            "pending %(old)s"),
+                          {'new': operation, 'old': last[1],
+                           'type': object_type, 'id': object_id})
+                if merged is None:
+                    conn.execute('DELETE FROM journal WHERE seq = ?',
+                                 (last[0],))
+                    return
+                merged_data = None
+                if (merged == operation == last[1] and
+                        data is not None and last[3] is not None):
+                    merged_data = self._loads(last[3])
+                    merged_data.update(data)
+                conn.execute('UPDATE journal SET operation = ?, data = ?, '
+                             'last_update = ? WHERE seq = ?',
+                             (merged, self._dumps(merged_data), now,
+                              last[0]))
+            else:
+                conn.execute(
+                    'INSERT INTO journal (object_type, object_id, operation, '
+                    'state, next_attempt, last_update, data) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (object_type, object_id, operation, PENDING, now, now,
+                     self._dumps(data)))
+        self.start()
+        self._wakeup.set()
+
+    @staticmethod
+    def _dumps(data):
+        return None if data is None else jsonutils.dumps(data)
+
+    @staticmethod
+    def _loads(data):
+        return None if data is None else jsonutils.loads(data)
+
+    _DISPATCHABLE = ('SELECT seq, object_type, object_id, operation, '
+                     'retry_count, data FROM journal j '
+                     'WHERE state = ? AND next_attempt <= ? AND NOT EXISTS '
+                     '(SELECT 1 FROM journal o WHERE '
+                     'o.object_type = j.object_type AND '
+                     'o.object_id = j.object_id AND o.seq < j.seq) ')
+
+    def _claim(self, condition, params, limit):
+        now = time.time()
+        query = (self._DISPATCHABLE + 'AND j.' + condition +
+                 ' ORDER BY seq LIMIT ?')
+        with self._transaction() as conn:
+            rows = conn.execute(
+                query, (PENDING, now) + params + (limit,)).fetchall()
+            conn.executemany('UPDATE journal SET state = ?, '
+                             'last_update = ? WHERE seq = ?',
+                             [(PROCESSING, now, row[0]) for row in rows])
+        return [Entry(*row[:5], data=self._loads(row[5])) for row in rows]
+
+    def watermark(self):
+        """Return a mark of the journal as it is now, for drop_pending().
+
+        The mark is the sequence number of the newest entry, or 0, and the
+        current time.
+        """
+        with self._lock:
+            seq = self.conn.execute(
+                'SELECT COALESCE(MAX(seq), 0) FROM journal WHERE ' +
+                self._type_filter(), self.object_types).fetchone()[0]
+        return seq, time.time()
+
+    def drop_pending(self, operation, watermark):
+        """Delete pending entries of operation recorded up to watermark.
+
+        Used once a full resync has made entries recorded before it began
+        redundant. An entry which a newer operation was coalesced into
+        after the watermark is kept, since the resync may have missed that
+        change. Returns the number of entries dropped.
+        """
+        seq, since = watermark
+        with self._lock:
+            return self.conn.execute(
+                'DELETE FROM journal WHERE state = ? AND operation = ? '
+                'AND seq <= ? AND last_update < ? AND ' +
+                self._type_filter(),
+                (PENDING, operation, seq, since) +
+                self.object_types).rowcount
+
+    def pause(self):
+        """Stop the workers from claiming entries until resume()."""
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+        self._wakeup.set()
+
+    def claim(self):
+        """Mark the oldest dispatchable entry as processing and return it.
+
+        An entry is dispatchable once its backoff has expired and no older
+        entry for the same object is still in the journal.
+        """
+        entries = self._claim(self._type_filter(), self.object_types, 1)
+        return entries[0] if entries else None
+
+    def claim_batch(self, object_type, operation, limit):
+        """Claim up to limit dispatchable entries of one operation."""
+        return self._claim('object_type = ? AND j.operation = ?',
+                           (object_type, operation), limit)
+
+    def complete(self, entry):
+        """Remove a successfully dispatched entry."""
+        with self._lock:
+            self.conn.execute('DELETE FROM journal WHERE seq = ?',
+                              (entry.seq,))
+
+    def retry(self, entry):
+        """Reschedule a failed entry, or give up once retries run out."""
+        if entry.retry_count >= self.max_retries:
+            LOG.error(_("Giving up on %(operation)s of %(type)s %(id)s "
+                        "after %(count)d retries"),
+                      {'operation': entry.operation,
+                       'type': entry.object_type, 'id': entry.object_id,
+                       'count': entry.retry_count})
+            self.complete(entry)
+            if self.on_failure:
+                self.on_failure(entry)
+            return
+        delay = min(self.retry_interval * 2 ** entry.retry_count,
+                    self.retry_interval_max)
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'UPDATE journal SET state = ?, retry_count = ?, '
+                'next_attempt = ?, last_update = ? WHERE seq = ?',
+                (PENDING, entry.retry_count + 1, now + delay, now, entry.seq))
+
+    def postpone(self, entry):
+        """Put an entry back without counting a retry against it."""
+        with self._lock:
+            self.conn.execute(
+                'UPDATE journal SET state = ?, last_update = ? '
+                'WHERE seq = ?', (PENDING, time.time(), entry.seq))
+
+    def reset_stale(self):
+        """Requeue entries left processing by a worker which went away."""
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'UPDATE journal SET state = ?, last_update = ? '
+                'WHERE state = ? AND last_update < ? AND ' +
+                self._type_filter(),
+                (PENDING, now, PROCESSING, now - self.processing_timeout) +
+                self.object_types)
+
+    def _pause(self, entries):
+        LOG.debug(_("OpenDaylight unavailable, pausing the journal for "
+                    "%d seconds"), self.unavailable_delay)
+        for entry in entries:
+            self.postpone(entry)
+        self._paused_until = time.time() + self.unavailable_delay
+
+    def dispatch_one(self):
+        """Dispatch a single entry. Returns False if none was ready."""
+        entry = self.claim()
+        if entry is None:
+            return False
+        if (self.batch_handler and
+                (entry.object_type, entry.operation) in self.batch_operations):
+            self.dispatch_batch(entry)
+            return True
+        try:
+            with self.metrics.timer('journal.dispatch.%s.%s' %
+                                    (entry.object_type, entry.operation)):
+                self.handler(entry)
+        except RetryLater:
+            self.postpone(entry)
+        except odl_exc.OpendaylightUnavailable:
+            self._pause([entry])
+        except Exception:
+            LOG.exception(_("Failed to %(operation)s %(type)s %(id)s"),
+                          {'operation': entry.operation,
+                           'type': entry.object_type, 'id': entry.object_id})
+            self.retry(entry)
+        else:
+            self.complete(entry)
+        return True
+
+    def dispatch_batch(self, first):
+        """Dispatch first together with similar entries recorded after it."""
+        if self.batch_window:
+            eventlet.sleep(self.batch_window)
+        entries = [first] + self.claim_batch(first.object_type,
+                                             first.operation,
+                                             self.batch_size - 1)
+        try:
+            with self.metrics.timer('journal.dispatch_batch.%s.%s' %
+                                    (first.object_type, first.operation)):
+                failed = self.batch_handler(entries)
+        except RetryLater:
+            for entry in entries:
+                self.postpone(entry)
+            return
+        except odl_exc.OpendaylightUnavailable:
+            self._pause(entries)
+            return
+        except Exception:
+            LOG.exception(_("Failed to %(operation)s %(count)d %(type)s"),
+                          {'operation': first.operation,
+                           'count': len(entries), 'type': first.object_type})
+            failed = entries
+        failed_seqs = set(entry.seq for entry in failed)
+        for entry in entries:
+            if entry.seq in failed_seqs:
+                self.retry(entry)
+            else:
+                self.complete(entry)
+
+    def _maintain(self):
+        """Report the journal depth and requeue stale entries when due."""
+        now = time.time()
+        if self.metrics.enabled and now >= self._next_report:
+            self._next_report = now + self.poll_interval
+            self.report_depth()
+        if now >= self._next_reset:
+            # Entries of a worker which died while running are requeued
+            # once they are processing_timeout old, even if this process
+            # started before they went stale.
+            self._next_reset = now + min(self.processing_timeout, 60)
+            self.reset_stale()
+
+    def _run(self):
+        while True:
+            try:
+                self._maintain()
+                pause = self._paused_until - time.time()
+                if not self._resumed.is_set():
+                    self._resumed.wait(self.poll_interval)
+                elif pause > 0:
+                    eventlet.sleep(pause)
+                elif not self.dispatch_one():
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+            except Exception:
+                LOG.exception(_("Unexpected error in OpenDaylight journal "
+                                "worker"))
+                eventlet.sleep(self.poll_interval)
+
+    def start(self):
+        """Start the worker threads once in each process."""
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        for i in range(self.workers):
+            eventlet.spawn_n(self._run)
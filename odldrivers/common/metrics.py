@@ -0,0 +1,166 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import contextlib
+import socket
+import threading
+import time
+
+from oslo.config import cfg
+from oslo.utils import importutils
+
+from neutron.openstack.common import log
+
+from odldrivers.common import config  # noqa
+
+LOG = log.getLogger(__name__)
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+class MetricsSink(object):
+
+    """Receives timings, counters and gauges from the drivers.
+
+    Metric names are dotted paths such as 'request.ports.put'. Subclasses
+    override the methods for the kinds of metric they keep. Metrics which
+    are costly to gather are skipped unless enabled is true.
+    """
+
+    enabled = True
+
+    def timing(self, name, seconds):
+        pass
+
+    def incr(self, name, value=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Record how long the body of a with statement takes."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, time.time() - start)
+
+
+class NullSink(MetricsSink):
+
+    """Discards everything; used when no metrics_sink is configured."""
+
+    enabled = False
+
+
+class StatsdSink(MetricsSink):
+
+    """Sends metrics to a statsd server over UDP.
+
+    Datagrams are fire and forget, so a missing or slow statsd server never
+    holds up a request; percentiles are left to statsd to compute.
+    """
+
+    def __init__(self, host, port, prefix=''):
+        self.address = (host, port)
+        self.prefix = prefix + '.' if prefix else ''
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, name, value, kind):
+        data = '%s%s:%s|%s' % (self.prefix, name, value, kind)
+        try:
+            self._socket.sendto(data.encode('utf-8'), self.address)
+        except (socket.error, socket.gaierror) as e:
+            LOG.debug(_("Failed to send metric %(name)s: %(exc)s"),
+                      {'name': name, 'exc': e})
+
+    def timing(self, name, seconds):
+        self._send(name, int(seconds * 1000), 'ms')
+
+    def incr(self, name, value=1):
+        self._send(name, value, 'c')
+
+    def gauge(self, name, value):
+        self._send(name, value, 'g')
+
+
+class MemorySink(MetricsSink):
+
+    """Keeps every metric in memory, for tests and the benchmarks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.timings = collections.defaultdict(list)
+            self.counters = collections.Counter()
+            self.gauges = {}
+
+    def timing(self, name, seconds):
+        with self._lock:
+            self.timings[name].append(seconds)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def percentile(self, name, percent):
+        """Return the percent'th percentile of a timing, or None."""
+        with self._lock:
+            values = sorted(self.timings.get(name, ()))
+        if not values:
+            return None
+        return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+def load_sink(name, conf):
+    """Build the sink named by metrics_sink.
+
+    'statsd' and 'memory' select the built in sinks; anything else is the
+    import path of a MetricsSink subclass taking no arguments.
+    """
+    if not name:
+        return NullSink()
+    if name == 'statsd':
+        return StatsdSink(conf.metrics_statsd_host, conf.metrics_statsd_port,
+                          conf.metrics_prefix)
+    if name == 'memory':
+        return MemorySink()
+    try:
+        return importutils.import_object(name)
+    except (ImportError, AttributeError, ValueError) as e:
+        LOG.warning(_("Metrics sink %(name)s is not available, metrics are "
+                      "disabled: %(exc)s"), {'name': name, 'exc': e})
+        return NullSink()
+
+
+def get_sink():
+    """Return the MetricsSink shared by every driver in the process."""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            conf = cfg.CONF.odl_rest
+            _sink = load_sink(conf.metrics_sink, conf)
+        return _sink
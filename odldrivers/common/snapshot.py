@@ -0,0 +1,226 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+import threading
+import time
+
+from oslo.serialization import jsonutils
+
+from neutron.openstack.common import log
+from neutron.openstack.common import loopingcall
+
+LOG = log.getLogger(__name__)
+
+VERSION = 1
+
+
+def _digest(parts):
+    return hashlib.sha1(''.join(parts).encode('utf-8')).hexdigest()
+
+
+class MerkleTree(object):
+
+    """Content hashes of the objects of one type, in a two level tree.
+
+    Objects are spread over a fixed number of buckets by a hash of their
+    id. Each bucket's digest covers the ids and hashes in it and the root
+    covers the bucket digests, so two trees are compared by their roots and
+    then only the buckets whose digests differ are walked. Digests are
+    computed lazily and cached until the bucket changes.
+    """
+
+    def __init__(self, hashes=None, buckets=256):
+        self.buckets = [dict() for i in range(buckets)]
+        self._digests = [None] * buckets
+        self._root = None
+        for obj_id, content_hash in (hashes or {}).items():
+            self.set(obj_id, content_hash)
+
+    def _bucket(self, obj_id):
+        index = int(hashlib.md5(obj_id.encode('utf-8')).hexdigest()[:8], 16)
+        return index % len(self.buckets)
+
+    def size(self):
+        return sum(len(bucket) for bucket in self.buckets)
+
+    def get(self, obj_id):
+        return self.buckets[self._bucket(obj_id)].get(obj_id)
+
+    def set(self, obj_id, content_hash):
+        index = self._bucket(obj_id)
+        if self.buckets[index].get(obj_id) != content_hash:
+            self.buckets[index][obj_id] = content_hash
+            self._digests[index] = self._root = None
+
+    def discard(self, obj_id):
+        index = self._bucket(obj_id)
+        if self.buckets[index].pop(obj_id, None) is not None:
+            self._digests[index] = self._root = None
+
+    def digest(self, index):
+        if self._digests[index] is None:
+            bucket = self.buckets[index]
+            self._digests[index] = _digest(
+                '%s=%s;' % (obj_id, bucket[obj_id])
+                for obj_id in sorted(bucket))
+        return self._digests[index]
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = _digest(self.digest(index)
+                                 for index in range(len(self.buckets)))
+        return self._root
+
+    def diff(self, other):
+        """Return the ids whose hash differs, or which one tree lacks."""
+        if self.root == other.root:
+            return []
+        ids = []
+        for index in range(len(self.buckets)):
+            if self.digest(index) == other.digest(index):
+                continue
+            mine, theirs = self.buckets[index], other.buckets[index]
+            ids.extend(obj_id for obj_id in set(mine) | set(theirs)
+                       if mine.get(obj_id) != theirs.get(obj_id))
+        return ids
+
+    def items(self):
+        for bucket in self.buckets:
+            for item in bucket.items():
+                yield item
+
+
+class Snapshot(object):
+
+    """What was last pushed to OpenDaylight, persisted to a local file.
+
+    Drivers record the content hash of every object they push and forget
+    the objects they delete. After a restart the snapshot is loaded and
+    compared with the Neutron database, so only objects which changed
+    while the server was down are resynced instead of everything.
+
+    Saves are atomic and made by a periodic task every save_interval
+    seconds, so recording a change never waits for the file to be written.
+    A snapshot which is out of date, because of a crash or because several
+    processes share the file, only causes extra objects to be resynced.
+    """
+
+    def __init__(self, path, object_types, save_interval=10):
+        self.path = path
+        self.object_types = tuple(object_types)
+        self.save_interval = save_interval
+        self.trees = dict((object_type, MerkleTree())
+                          for object_type in self.object_types)
+        self.loaded = False
+        self._changed = False
+        self._saved_at = 0
+        self._saver_pid = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Read the snapshot from disk. Returns True if there was one."""
+        try:
+            with open(self.path) as f:
+                data = jsonutils.loads(f.read())
+        except (IOError, OSError, ValueError) as e:
+            LOG.debug(_("No usable OpenDaylight snapshot at %(path)s: "
+                        "%(exc)s"), {'path': self.path, 'exc': e})
+            return False
+        if (data.get('version') != VERSION or
+                set(data.get('trees', {})) != set(self.object_types)):
+            LOG.info(_("Ignoring OpenDaylight snapshot %s written by a "
+                       "different version"), self.path)
+            return False
+        with self._lock:
+            self.trees = dict(
+                (object_type, MerkleTree(hashes))
+                for object_type, hashes in data['trees'].items())
+            self.loaded = True
+        return True
+
+    def save(self):
+        with self._lock:
+            data = {'version': VERSION,
+                    'trees': dict((object_type, dict(tree.items()))
+                                  for object_type, tree in self.trees.items())}
+            self._changed = False
+            self._saved_at = time.time()
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(jsonutils.dumps(data))
+        os.rename(tmp, self.path)
+
+    def invalidate(self):
+        """Forget the snapshot, on disk too, before a full resync."""
+        with self._lock:
+            self.trees = dict((object_type, MerkleTree())
+                              for object_type in self.object_types)
+            self.loaded = False
+            self._changed = False
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def maybe_save(self, force=False):
+        """Save if anything changed and save_interval has passed."""
+        if force or (self._changed and
+                     time.time() - self._saved_at >= self.save_interval):
+            try:
+                self.save()
+            except (IOError, OSError) as e:
+                LOG.warning(_("Failed to save the OpenDaylight snapshot to "
+                              "%(path)s: %(exc)s"),
+                            {'path': self.path, 'exc': e})
+
+    def start_saver(self):
+        """Start saving the changes periodically, once in each process."""
+        if self._saver_pid == os.getpid():
+            return
+        self._saver_pid = os.getpid()
+        interval = max(self.save_interval, 1)
+        loopingcall.FixedIntervalLoopingCall(self.maybe_save).start(
+            interval=interval, initial_delay=interval)
+
+    def set(self, object_type, obj_id, content_hash):
+        with self._lock:
+            self.trees[object_type].set(obj_id, content_hash)
+            self._changed = True
+
+    def discard(self, object_type, obj_id):
+        with self._lock:
+            self.trees[object_type].discard(obj_id)
+            self._changed = True
+
+    def replace(self, object_type, tree):
+        """Install the tree of everything ODL was brought in sync with."""
+        with self._lock:
+            self.trees[object_type] = tree
+            self._changed = True
+
+    def size(self, object_type):
+        with self._lock:
+            return self.trees[object_type].size()
+
+    def diff(self, object_type, tree):
+        """Return the ids of object_type whose hash differs from tree's."""
+        with self._lock:
+            return self.trees[object_type].diff(tree)
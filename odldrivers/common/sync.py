@@ -0,0 +1,189 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import os
+import threading
+import time
+
+import eventlet
+
+from neutron.openstack.common import log
+
+from odldrivers.common import utils
+
+LOG = log.getLogger(__name__)
+
+
+class DirtyTracker(object):
+
+    """Objects which may differ between Neutron and OpenDaylight.
+
+    Every time an object is marked it gets a new generation number, and an
+    object is only cleared if it has not been marked again since its resync
+    started. This keeps a failure which races with a resync from being
+    forgotten.
+
+    An object whose resync fails is held back from pending() for
+    retry_interval seconds, doubling with each failure up to
+    retry_interval_max, so an object ODL keeps rejecting does not crowd out
+    the others. Marking it again retries it right away.
+    """
+
+    def __init__(self, retry_interval=0, retry_interval_max=0):
+        self.retry_interval = retry_interval
+        self.retry_interval_max = retry_interval_max
+        self._lock = threading.Lock()
+        self._dirty = collections.defaultdict(dict)
+        # (object_type, object_id): (failures, time of the next attempt)
+        self._backoff = {}
+        self._generation = 0
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(ids) for ids in self._dirty.values())
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    __bool__ = __nonzero__
+
+    def mark(self, object_type, object_id):
+        with self._lock:
+            self._generation += 1
+            self._dirty[object_type][object_id] = self._generation
+            self._backoff.pop((object_type, object_id), None)
+
+    def pending(self, object_type):
+        """Return {object_id: generation} for the objects due a resync."""
+        now = time.time()
+        with self._lock:
+            return dict(
+                (object_id, generation) for object_id, generation
+                in self._dirty.get(object_type, {}).items()
+                if self._backoff.get((object_type, object_id),
+                                     (0, 0))[1] <= now)
+
+    def clear(self, object_type, object_id, generation):
+        """Forget an object unless it was marked again after generation."""
+        with self._lock:
+            ids = self._dirty.get(object_type, {})
+            if ids.get(object_id) == generation:
+                del ids[object_id]
+                self._backoff.pop((object_type, object_id), None)
+
+    def failed(self, object_type, object_id, generation):
+        """Back off an object whose resync failed, unless marked since."""
+        with self._lock:
+            if self._dirty.get(object_type, {}).get(object_id) != generation:
+                return
+            key = (object_type, object_id)
+            failures = self._backoff.get(key, (0, 0))[0] + 1
+            delay = self.retry_interval * 2 ** (failures - 1)
+            if self.retry_interval_max:
+                delay = min(delay, self.retry_interval_max)
+            self._backoff[key] = (failures, time.time() + delay)
+
+
+MISSING = 'missing'
+EXTRA = 'extra'
+DIVERGENT = 'divergent'
+
+
+def _index(resources, keys):
+    return dict((resource['id'], utils.content_hash(resource, keys))
+                for resource in resources)
+
+
+def compare(neutron_resources, odl_resources, keys):
+    """Yield (id, kind) for each object which differs between Neutron and ODL.
+
+    kind is MISSING for an object ODL lacks, EXTRA for one only ODL has and
+    DIVERGENT for one whose keys hash differently on both sides. The two
+    sides are read concurrently, each into an index of ids and content
+    hashes, so the objects themselves are only held a page at a time.
+    """
+    odl_index = eventlet.spawn(_index, odl_resources, keys)
+    neutron_index = _index(neutron_resources, keys)
+    odl_index = odl_index.wait()
+    for object_id, expected in neutron_index.items():
+        actual = odl_index.pop(object_id, None)
+        if actual is None:
+            yield object_id, MISSING
+        elif actual != expected:
+            yield object_id, DIVERGENT
+    for object_id in odl_index:
+        yield object_id, EXTRA
+
+
+class BackgroundResync(object):
+
+    """Runs a driver's full resync in a background thread.
+
+    snapshot() pushes everything in the database to ODL and is retried
+    every retry_interval seconds until it succeeds; replay() then sends the
+    changes which were made while it ran. The journal, if there is one, is
+    paused meanwhile so recorded changes queue up behind the snapshot, and
+    creates recorded before the snapshot started are dropped since the
+    snapshot covered them. API requests never wait for any of this.
+    """
+
+    def __init__(self, snapshot, replay, journal=None, retry_interval=10):
+        self.snapshot = snapshot
+        self.replay = replay
+        self.journal = journal
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._pid = None
+
+    @property
+    def running(self):
+        return self._pid == os.getpid()
+
+    def start(self):
+        """Start the resync unless it is already running in this process."""
+        with self._lock:
+            if self.running:
+                return
+            self._pid = os.getpid()
+        if self.journal:
+            self.journal.pause()
+        eventlet.spawn_n(self._run)
+
+    def _run(self):
+        try:
+            while True:
+                watermark = self.journal.watermark() if self.journal else 0
+                try:
+                    self.snapshot()
+                    break
+                except Exception:
+                    LOG.exception(_("Full resync with OpenDaylight failed, "
+                                    "retrying in %d seconds"),
+                                  self.retry_interval)
+                    eventlet.sleep(self.retry_interval)
+            if self.journal:
+                dropped = self.journal.drop_pending('create', watermark)
+                LOG.debug(_("Dropped %d creates covered by the full resync"),
+                          dropped)
+        finally:
+            if self.journal:
+                self.journal.resume()
+            self._pid = None
+        try:
+            self.replay()
+        except Exception:
+            LOG.exception(_("Failed to replay changes made during the full "
+                            "resync"))
@@ -6,11 +6,97 @@
 #
 # @author: Dave Tucker <djt@redhat.com>
 
+import hashlib
+import itertools
 
-def try_del(d, keys):
-    """Ignore key errors when deleting from a dictionary."""
-    for key in keys:
-        try:
-            del d[key]
-        except KeyError:
-            pass
+from oslo.serialization import jsonutils
+
+from neutron.common import exceptions as n_exc
+
+
+def compile_projection(exclude=(), transforms=None):
+    """Build a function returning a copy of a resource to send to ODL.
+
+    The copy leaves out the exclude keys, and the value of each key in
+    transforms is replaced by transforms[key](value, *args), where args are
+    any extra arguments the projection is called with. The resource itself
+    is never modified, so a projection is safe to run on shared objects
+    from several threads.
+    """
+    exclude = frozenset(exclude)
+    transforms = tuple((transforms or {}).items())
+
+    def project(resource, *args):
+        payload = dict((key, value) for key, value in resource.items()
+                       if key not in exclude)
+        for key, transform in transforms:
+            if key in payload:
+                payload[key] = transform(payload[key], *args)
+        return payload
+
+    return project
+
+
+def chunks(iterable, size):
+    """Yield successive lists of at most size items from iterable."""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def content_hash(obj, keys):
+    """Return a stable digest of the values of keys in obj."""
+    values = [obj.get(key) for key in keys]
+    return hashlib.sha1(
+        jsonutils.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def changed_attributes(original, current, exclude=()):
+    """Return the attributes of current whose value differs in original.
+
+    Attributes in exclude are ignored. An empty dict means nothing changed.
+    """
+    return dict((key, value) for key, value in current.items()
+                if key not in exclude and original.get(key) != value)
+
+
+def iter_resources(getter, dbcontext, page_size):
+    """Yield every resource from a plugin getter, one page at a time.
+
+    The getter is called with limit/marker pagination ordered by id, so
+    only one page of resources is held in memory. A page_size of 0 reads
+    everything in a single call.
+
+    Neutron loads the marker object by id, so a marker deleted between two
+    pages raises NotFound. The walk then resumes from an earlier id of the
+    previous page, or from the start, skipping what it already yielded.
+    """
+    marker = None
+    last_id = None
+    resumed_after = None
+    fallbacks = []
+    while True:
+        if page_size:
+            try:
+                page = getter(dbcontext, sorts=[('id', True)],
+                              limit=page_size, marker=marker)
+            except n_exc.NotFound:
+                if marker is None:
+                    raise
+                marker = fallbacks.pop() if fallbacks else None
+                resumed_after = last_id
+                continue
+        else:
+            page = getter(dbcontext)
+        for resource in page:
+            if resumed_after is not None and resource['id'] <= resumed_after:
+                continue
+            last_id = resource['id']
+            yield resource
+        if not page_size or len(page) < page_size:
+            return
+        fallbacks = [resource['id'] for resource in page[:-1]]
+        marker = page[-1]['id']
@@ -7,55 +7,264 @@
 #
 # @author: Dave Tucker <djt@redhat.com>
 
+import threading
+
+import eventlet
 from oslo.config import cfg
 
+from neutron.extensions import firewall as fw_ext
 from neutron.openstack.common import log as logging
 from neutron.services.firewall.drivers import fwaas_base
 
 from odldrivers.common import client as odl_client
 from odldrivers.common import config  # noqa
+from odldrivers.common import metrics
+from odldrivers.common import utils as odl_utils
 
 LOG = logging.getLogger(__name__)
 
+FWAAS_DRIVER_NAME = 'OpenDaylight FWaaS driver'
+
+FIREWALLS = 'fw/firewalls'
+FIREWALL_RULES = 'fw/firewall_rules'
+
+# Attributes of a rule which ODL enforces. A rule is re-sent only when one
+# of them changes; its position is carried by the firewall's rule list.
+rule_attributes = ('protocol', 'ip_version', 'source_ip_address',
+                   'destination_ip_address', 'source_port',
+                   'destination_port', 'action', 'name', 'description',
+                   'shared', 'tenant_id')
+
+firewall_excluded_attributes = ('firewall_rule_list', 'add-router-ids',
+                                'del-router-ids', 'router_ids', 'status')
+
+rule_excluded_attributes = ('position', 'firewall_policy_id', 'enabled')
+
+
+def odl_rule_id(fw_id, rule_id):
+    """Return the id of a firewall's copy of a rule in ODL.
+
+    Firewalls sharing a policy each get their own copy of its rules, so
+    deleting or changing one firewall never touches another's rules.
+    """
+    return '%s_%s' % (fw_id, rule_id)
+
+
+class RuleDelta(object):
+
+    """The changes which turn one compiled rule set into another.
+
+    added, changed and removed are lists of rule ids, and reordered is true
+    when the rules both sets keep are in a different order.
+    """
+
+    def __init__(self, old, new):
+        self.added = [r for r in new.order if r not in old.hashes]
+        self.removed = [r for r in old.order if r not in new.hashes]
+        self.changed = [r for r in new.order if r in old.hashes and
+                        old.hashes[r] != new.hashes[r]]
+        self.reordered = ([r for r in old.order if r in new.hashes] !=
+                          [r for r in new.order if r in old.hashes])
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or
+                    self.reordered)
+
+    __nonzero__ = __bool__
+
+
+class CompiledRuleSet(object):
+
+    """The enabled rules of a firewall, in order, with their content hashes.
+
+    Only the hashes are kept, so the index of a firewall with thousands of
+    rules stays small.
+    """
+
+    def __init__(self, rules):
+        rules = sorted((r for r in rules if r.get('enabled', True)),
+                       key=lambda r: r.get('position') or 0)
+        self.order = [r['id'] for r in rules]
+        self.hashes = dict((r['id'], odl_utils.content_hash(
+            r, rule_attributes)) for r in rules)
+
+    def diff(self, new):
+        return RuleDelta(self, new)
+
 
 class OpenDaylightFwaasDriver(fwaas_base.FwaasDriverBase):
 
-    """OpenDaylight FWaaS Driver"""
+    """OpenDaylight FWaaS Driver
+
+    The rule set last sent for each firewall is kept compiled, so an update
+    sends ODL only the rules which were added, changed or removed, and the
+    firewall itself when the order of its rules changed. New rules are
+    created in bulk requests and updates and deletes are sent concurrently.
+    When the driver has no index for a firewall, after a restart for
+    instance, it is rebuilt from the rules ODL has for that firewall.
+    """
 
     def __init__(self):
         LOG.debug(_("Initializing OpenDaylight FWaaS driver"))
-        self.client = odl_client.OpenDaylightRestClient(
-            cfg.CONF.odl_rest.url,
-            cfg.CONF.odl_rest.username,
-            cfg.CONF.odl_rest.password,
-            cfg.CONF.odl_rest.timeout,
-            cfg.CONF.odl_rest.session_timeout
-        )
+        self.client = odl_client.get_client()
+        self.metrics = metrics.get_sink()
+        self.project_firewall = odl_utils.compile_projection(
+            firewall_excluded_attributes)
+        self.project_rule = odl_utils.compile_projection(
+            rule_excluded_attributes)
+        self.rule_index = {}
+        self._lock = threading.Lock()
 
     def create_firewall(self, apply_list, firewall):
         """Create the Firewall with default (drop all) policy.
         The default policy will be applied on all the interfaces of
         trusted zone.
         """
-        pass
+        return self._apply(firewall, firewall.get('firewall_rule_list', []),
+                           create=True)
 
     def delete_firewall(self, apply_list, firewall):
         """Delete firewall.
         Removes all policies created by this instance and frees up
         all the resources.
         """
-        pass
+        try:
+            with self._lock:
+                rules = self.rule_index.pop(firewall['id'], None)
+            if rules is None:
+                rules = self._load_rule_set(firewall['id'])
+            self._delete_rules(firewall['id'], rules.order)
+            # 404 errors are returned if the firewall is already gone.
+            self.client.sendjson('delete', FIREWALLS + '/' + firewall['id'],
+                                 None, [404])
+        except Exception:
+            LOG.exception(_("Failed to delete firewall %s on "
+                            "OpenDaylight"), firewall['id'])
+            raise fw_ext.FirewallInternalDriverError(
+                driver=FWAAS_DRIVER_NAME)
+        return True
 
     def update_firewall(self, apply_list, firewall):
         """Apply the policy on all trusted interfaces.
         Remove previous policy and apply the new policy on all trusted
         interfaces.
+
+        Only the difference between the previous and the new policy is
+        sent to OpenDaylight.
         """
-        pass
+        return self._apply(firewall, firewall.get('firewall_rule_list', []))
 
     def apply_default_policy(self, apply_list, firewall):
         """Apply the default policy on all trusted interfaces.
         Remove current policy and apply the default policy on all trusted
         interfaces.
         """
-        pass
+        return self._apply(firewall, [])
+
+    def _apply(self, firewall, rules, create=False):
+        """Make ODL's copy of a firewall enforce exactly rules."""
+        fw_id = firewall['id']
+        try:
+            with self.metrics.timer('fwaas.apply'):
+                new = CompiledRuleSet(rules)
+                if create:
+                    old = CompiledRuleSet([])
+                    self._send_firewall('post', firewall, [])
+                else:
+                    with self._lock:
+                        old = self.rule_index.get(fw_id)
+                    if old is None:
+                        old = self._load_rule_set(fw_id)
+                delta = old.diff(new)
+                if delta:
+                    self._push(firewall, rules, new, delta)
+        except Exception:
+            # Forget what ODL has so the next change starts from its rules.
+            with self._lock:
+                self.rule_index.pop(fw_id, None)
+            LOG.exception(_("Failed to apply the policy of firewall %s on "
+                            "OpenDaylight"), fw_id)
+            raise fw_ext.FirewallInternalDriverError(
+                driver=FWAAS_DRIVER_NAME)
+        with self._lock:
+            self.rule_index[fw_id] = new
+        return True
+
+    def _push(self, firewall, rules, new, delta):
+        LOG.debug(_("Updating firewall %(id)s: %(added)d rules added, "
+                    "%(changed)d changed and %(removed)d removed"),
+                  {'id': firewall['id'], 'added': len(delta.added),
+                   'changed': len(delta.changed),
+                   'removed': len(delta.removed)})
+        by_id = dict((rule['id'], rule) for rule in rules)
+        if delta.added:
+            payloads = [self._rule_payload(firewall, by_id[r])
+                        for r in delta.added]
+            # 400 errors are returned if a rule exists, which we ignore.
+            results = self.client.bulk_post(
+                FIREWALL_RULES, 'firewall_rule', payloads,
+                cfg.CONF.odl_rest.sync_batch_size,
+                cfg.CONF.odl_rest.sync_workers, [400])
+            failed = sum(len(result.failed) for result in results)
+            if failed:
+                raise fw_ext.FirewallInternalDriverError(
+                    driver=FWAAS_DRIVER_NAME)
+        if delta.changed:
+            self._each(lambda r: self.client.sendjson(
+                'put', FIREWALL_RULES + '/' + odl_rule_id(firewall['id'], r),
+                {'firewall_rule': self._rule_payload(firewall, by_id[r])}),
+                delta.changed)
+        if delta.added or delta.removed or delta.reordered:
+            self._send_firewall('put', firewall, new.order)
+        self._delete_rules(firewall['id'], delta.removed)
+
+    def _rule_payload(self, firewall, rule):
+        payload = self.project_rule(rule)
+        payload['id'] = odl_rule_id(firewall['id'], rule['id'])
+        payload['firewall_id'] = firewall['id']
+        return payload
+
+    def _send_firewall(self, method, firewall, order):
+        payload = self.project_firewall(firewall)
+        payload['firewall_rules'] = [odl_rule_id(firewall['id'], r)
+                                     for r in order]
+        if method == 'post':
+            # 400 errors are returned if the firewall exists.
+            self.client.sendjson('post', FIREWALLS,
+                                 {'firewall': payload}, [400])
+        else:
+            self.client.sendjson('put', FIREWALLS + '/' + firewall['id'],
+                                 {'firewall': payload})
+
+    def _delete_rules(self, fw_id, rule_ids):
+        # 404 errors are returned if a rule is already gone.
+        self._each(lambda r: self.client.sendjson(
+            'delete', FIREWALL_RULES + '/' + odl_rule_id(fw_id, r), None,
+            [404]), rule_ids)
+
+    def _each(self, func, rule_ids):
+        """Call func for every rule id, sync_workers at a time."""
+        pool = eventlet.GreenPool(max(cfg.CONF.odl_rest.sync_workers, 1))
+        for rule_id in pool.imap(func, rule_ids):
+            pass
+
+    def _load_rule_set(self, fw_id):
+        """Compile the rules ODL has for a firewall.
+
+        Only the firewall and its own rules are read. Rules are filtered
+        again here in case the controller ignores the firewall_id filter.
+        """
+        r = self.client.sendjson('get', FIREWALLS + '/' + fw_id, None, [404])
+        order = []
+        if r is not None:
+            order = r.json()['firewall'].get('firewall_rules') or []
+        positions = dict((rule_id, i) for i, rule_id in enumerate(order))
+        prefix = odl_rule_id(fw_id, '')
+        rules = self.client.list_collection(
+            FIREWALL_RULES, cfg.CONF.odl_rest.sync_page_size,
+            filters={'firewall_id': fw_id})
+        return CompiledRuleSet(
+            dict(rule, id=rule['id'][len(prefix):],
+                 position=positions.get(rule['id'], len(positions)))
+            for rule in rules if rule.get('firewall_id') == fw_id and
+            rule['id'].startswith(prefix))
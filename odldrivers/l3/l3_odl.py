@@ -7,26 +7,61 @@
 #
 # @author: Dave Tucker <djt@redhat.com>
 
+import os
+
 from oslo.config import cfg
+from oslo.utils import excutils
+import requests
 
 from neutron.api.rpc.agentnotifiers import l3_rpc_agent_api
 from neutron.common import constants as q_const
 from neutron.common import rpc as n_rpc
 from neutron.common import topics
+from neutron.common import utils
+from neutron import context as n_context
 from neutron.db import common_db_mixin
 from neutron.db import extraroute_db
 from neutron.db import l3_dvr_db
 from neutron.db import l3_gwmode_db
 from neutron.db import l3_rpc_base
+from neutron.extensions import l3
+from neutron.openstack.common import log
+from neutron.openstack.common import loopingcall
 from neutron.plugins.common import constants
 
 from odldrivers.common import client as odl_client
 from odldrivers.common import config  # noqa
-from odldrivers.common import utils
+from odldrivers.common import exceptions as odl_exc
+from odldrivers.common import journal
+from odldrivers.common import metrics
+from odldrivers.common import sync
+from odldrivers.common import utils as odl_utils
+
+LOG = log.getLogger(__name__)
 
 ROUTERS = 'routers'
 FLOATINGIPS = 'floatingips'
 
+not_found_exception_map = {ROUTERS: l3.RouterNotFound,
+                           FLOATINGIPS: l3.FloatingIPNotFound}
+
+# Attributes left out of the payload sent to ODL for each object type and
+# operation. Anything not listed is sent.
+payload_excluded_attributes = {
+    (ROUTERS, 'create'): (),
+    (ROUTERS, 'update'): ('id', 'tenant_id', 'status'),
+    (FLOATINGIPS, 'create'): (),
+    (FLOATINGIPS, 'update'): (),
+}
+
+# Attributes compared by the audit to decide whether the copy of an object
+# held by ODL is stale.
+reconcile_attributes_map = {
+    ROUTERS: ('name', 'admin_state_up', 'tenant_id', 'external_gateway_info'),
+    FLOATINGIPS: ('floating_network_id', 'floating_ip_address', 'router_id',
+                  'port_id', 'fixed_ip_address', 'tenant_id'),
+}
+
 
 class OpenDaylightRouterPluginRpcCallbacks(n_rpc.RpcCallback,
                                            l3_rpc_base.L3RpcCallbackMixin):
@@ -43,19 +78,47 @@ class OpenDaylightL3RouterPlugin(common_db_mixin.CommonDbMixin,
     This class implements a L3 service plugin that provides
     router and floatingip resources and manages associated
     request/response.
+
+    Changes are recorded in the journal after the database commit and sent
+    to OpenDaylight by its background workers, in order for each object.
+    Without the journal they are sent inline, and objects which fail are
+    marked dirty and resynced by a periodic task. The initial
+    full resync runs in the background, and changes made meanwhile are
+    sent once it is done.
     """
     supported_extension_aliases = ["dvr", "router", "ext-gw-mode",
                                    "extraroute"]
+    out_of_sync = True
 
-    def __init__(self):
-        self.setup_rpc()
-        self.client = odl_client.OpenDaylightRestClient(
-            cfg.CONF.odl_rest.url,
-            cfg.CONF.odl_rest.username,
-            cfg.CONF.odl_rest.password,
-            cfg.CONF.odl_rest.timeout,
-            cfg.CONF.odl_rest.session_timeout
-        )
+    def __init__(self, rpc=True):
+        """rpc=False leaves out the L3 agent RPC consumers, for tools
+        which only read the database and talk to ODL.
+        """
+        if rpc:
+            self.setup_rpc()
+        self.client = odl_client.get_client()
+        self.metrics = metrics.get_sink()
+        self.payloads = dict(
+            (key, odl_utils.compile_projection(excluded))
+            for key, excluded in payload_excluded_attributes.items())
+        self.dirty = sync.DirtyTracker(
+            cfg.CONF.odl_rest.dirty_resync_interval,
+            cfg.CONF.odl_rest.dirty_retry_interval_max)
+        self._dirty_resync_pid = None
+        self.journal = None
+        if cfg.CONF.odl_rest.journal_enabled:
+            self.journal = journal.create_journal(
+                (ROUTERS, FLOATINGIPS), self.dispatch_entry,
+                self.journal_entry_failed,
+                batch_handler=self.dispatch_batch,
+                batch_operations=[(FLOATINGIPS, 'create')])
+        self.resync = sync.BackgroundResync(
+            self._resync_snapshot, self._resync_replay, self.journal,
+            cfg.CONF.odl_rest.resync_retry_interval)
+        if self.journal:
+            # Drain entries left by a previous run without waiting for the
+            # next change.
+            self.journal.start()
 
     def setup_rpc(self):
         self.topic = topics.L3PLUGIN
@@ -75,47 +138,251 @@ class OpenDaylightL3RouterPlugin(common_db_mixin.CommonDbMixin,
         return ("L3 Router Service Plugin for basic L3 forwarding"
                 " using OpenDaylight")
 
-    def filter_update_router_attributes(self, router):
-        """Filter out router attributes for an update operation."""
-        utils.try_del(router, ['id', 'tenant_id', 'status'])
-
     def create_router(self, context, router):
         router_dict = super(OpenDaylightL3RouterPlugin, self).create_router(
             context, router)
-        url = ROUTERS
-        self.client.sendjson('post', url, {ROUTERS[:-1]: router_dict})
+        self.synchronize('create', ROUTERS, router_dict['id'])
         return router_dict
 
     def update_router(self, context, id, router):
         router_dict = super(OpenDaylightL3RouterPlugin, self).update_router(
             context, id, router)
-        url = ROUTERS + "/" + id
-        resource = router_dict.copy()
-        self.filter_update_router_attributes(resource)
-        self.client.sendjson('put', url, {ROUTERS[:-1]: resource})
+        self.synchronize('update', ROUTERS, id)
         return router_dict
 
     def delete_router(self, context, id):
-        super(OpenDaylightL3RouterPlugin, self).update_router(context, id)
-        url = ROUTERS + "/" + id
-        self.client.sendjson('delete', url, None)
+        super(OpenDaylightL3RouterPlugin, self).delete_router(context, id)
+        self.synchronize('delete', ROUTERS, id)
 
     def create_floatingip(self, context, floatingip,
                           initial_status=q_const.FLOATINGIP_STATUS_ACTIVE):
         fip_dict = super(OpenDaylightL3RouterPlugin, self).create_floatingip(
-            context, floatingip)
-        url = FLOATINGIPS
-        self.client.sendjson('post', url, {FLOATINGIPS[:-1]: fip_dict})
+            context, floatingip, initial_status)
+        self.synchronize('create', FLOATINGIPS, fip_dict['id'])
         return fip_dict
 
     def update_floatingip(self, context, id, floatingip):
         fip_dict = super(OpenDaylightL3RouterPlugin, self).update_floatingip(
             context, id, floatingip)
-        url = FLOATINGIPS + "/" + id
-        self.client.sendjson('put', url, {FLOATINGIPS[:-1]: fip_dict})
+        self.synchronize('update', FLOATINGIPS, id)
         return fip_dict
 
     def delete_floatingip(self, context, id):
-        super(OpenDaylightL3RouterPlugin, self).update_floatingip(context, id)
-        url = FLOATINGIPS + "/" + id
-        self.client.sendjson('delete', url, None)
+        super(OpenDaylightL3RouterPlugin, self).delete_floatingip(context, id)
+        self.synchronize('delete', FLOATINGIPS, id)
+
+    def synchronize(self, operation, object_type, obj_id):
+        """Send a committed change to ODL, through the journal if enabled."""
+        self.start_dirty_resync()
+        if self.out_of_sync:
+            self.resync.start()
+        if self.journal:
+            self.journal.record(object_type, obj_id, operation)
+            return
+        if self.out_of_sync:
+            self.dirty.mark(object_type, obj_id)
+            return
+        dbcontext = n_context.get_admin_context()
+        try:
+            self.sync_single_resource(operation, object_type, obj_id,
+                                      dbcontext)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self.dirty.mark(object_type, obj_id)
+
+    def dispatch_entry(self, entry):
+        """Send a journal entry to ODL from a background worker."""
+        self._check_in_sync()
+        dbcontext = n_context.get_admin_context()
+        self.sync_single_resource(entry.operation, entry.object_type,
+                                  entry.object_id, dbcontext)
+
+    def dispatch_batch(self, entries):
+        """Create a batch of floating IPs in one bulk request.
+
+        Returns the entries whose floating IP ODL did not accept, so the
+        journal retries just those.
+        """
+        self._check_in_sync()
+        dbcontext = n_context.get_admin_context()
+        resources = []
+        for entry in entries:
+            resource = self._get_resource(entry.object_type, entry.object_id,
+                                          dbcontext)
+            if resource is not None:
+                resources.append(
+                    self.payloads[(entry.object_type, 'create')](resource))
+        if not resources:
+            return []
+        # 400 errors are returned if an object exists, which we ignore.
+        results = self.client.bulk_post(FLOATINGIPS, FLOATINGIPS[:-1],
+                                        resources, len(resources), 1, [400])
+        failed = set()
+        for result in results:
+            failed.update(result.failed)
+        return [entry for entry in entries if entry.object_id in failed]
+
+    def _check_in_sync(self):
+        if self.out_of_sync:
+            # Wait for the background resync, which resumes the journal.
+            self.resync.start()
+            raise journal.RetryLater()
+
+    def _resync_snapshot(self):
+        self.sync_full(n_context.get_admin_context())
+
+    def _resync_replay(self):
+        if self.dirty:
+            self.sync_dirty(n_context.get_admin_context())
+
+    def journal_entry_failed(self, entry):
+        """Resync the object later when a journal entry is dropped."""
+        self.dirty.mark(entry.object_type, entry.object_id)
+        self.start_dirty_resync()
+
+    def _get_resource(self, object_type, obj_id, dbcontext):
+        """Read an object from the database, or None if it is gone."""
+        try:
+            return getattr(self, 'get_%s' % object_type[:-1])(dbcontext,
+                                                              obj_id)
+        except not_found_exception_map[object_type]:
+            LOG.debug(_('%(object_type)s not found (%(obj_id)s)'),
+                      {'object_type': object_type.capitalize(),
+                       'obj_id': obj_id})
+
+    def sync_single_resource(self, operation, object_type, obj_id,
+                             dbcontext):
+        """Send a single create, update or delete to OpenDaylight.
+
+        The object is read back from the database, so the latest state is
+        sent even when the operation was queued for a while.
+        """
+        with self.metrics.timer('sync_single_resource.%s.%s' %
+                                (object_type, operation)):
+            self._sync_single_resource(operation, object_type, obj_id,
+                                       dbcontext)
+
+    def _sync_single_resource(self, operation, object_type, obj_id,
+                              dbcontext):
+        if operation == 'delete':
+            # 404 errors are returned if the object is already gone.
+            self.client.sendjson('delete', object_type + '/' + obj_id, None,
+                                 [404])
+            return
+        resource = self._get_resource(object_type, obj_id, dbcontext)
+        if resource is None:
+            return
+        payload = self.payloads[(object_type, operation)](resource)
+        if operation == 'create':
+            # 400 errors are returned if an object exists, which we ignore.
+            self.client.sendjson('post', object_type,
+                                 {object_type[:-1]: payload}, [400])
+        else:
+            self.client.sendjson('put', object_type + '/' + obj_id,
+                                 {object_type[:-1]: payload})
+
+    @utils.synchronized('odl-l3-sync-full')
+    def sync_full(self, dbcontext):
+        """Create every router and floating IP which ODL is missing.
+
+        Transition to the in-sync state on success.
+        """
+        if not self.out_of_sync:
+            return
+        with self.metrics.timer('sync_full.l3'):
+            self._sync_full(dbcontext)
+        self.out_of_sync = False
+
+    def _sync_full(self, dbcontext):
+        page_size = cfg.CONF.odl_rest.sync_page_size
+        for object_type in (ROUTERS, FLOATINGIPS):
+            odl_ids = set(obj['id'] for obj in self.client.list_collection(
+                object_type, page_size, ['id']))
+            project = self.payloads[(object_type, 'create')]
+            resources = odl_utils.iter_resources(
+                getattr(self, 'get_%s' % object_type), dbcontext, page_size)
+            to_be_synced = (project(resource) for resource in resources
+                            if resource['id'] not in odl_ids)
+            # 400 errors are returned if an object exists, which we ignore.
+            results = self.client.bulk_post(
+                object_type, object_type[:-1], to_be_synced,
+                cfg.CONF.odl_rest.sync_batch_size,
+                cfg.CONF.odl_rest.sync_workers, [400])
+            failed = sum(len(result.failed) for result in results)
+            if failed:
+                raise odl_exc.OpendaylightSyncError(count=failed,
+                                                    collection=object_type)
+
+    def differences(self, object_type, dbcontext):
+        """Yield (id, kind) for the objects of object_type which differ.
+
+        Both sides are compared over reconcile_attributes_map; see
+        sync.compare.
+        """
+        page_size = cfg.CONF.odl_rest.sync_page_size
+        project = self.payloads[(object_type, 'create')]
+        resources = odl_utils.iter_resources(
+            getattr(self, 'get_%s' % object_type), dbcontext, page_size)
+        odl_resources = self.client.list_collection(object_type, page_size)
+        return sync.compare((project(resource) for resource in resources),
+                            odl_resources,
+                            reconcile_attributes_map[object_type])
+
+    @utils.synchronized('odl-l3-sync-dirty')
+    def sync_dirty(self, dbcontext):
+        """Resync only the objects marked dirty by earlier failures.
+
+        Each object is deleted from ODL if it is gone from the database,
+        and otherwise updated, or created if ODL does not have it. Objects
+        which fail again are backed off; see sync.DirtyTracker.
+        """
+        for object_type in (ROUTERS, FLOATINGIPS):
+            for obj_id, generation in self.dirty.pending(object_type).items():
+                try:
+                    self.resync_resource(object_type, obj_id, dbcontext)
+                except Exception as e:
+                    LOG.warning(_("Failed to resync %(type)s %(id)s: "
+                                  "%(exc)s"),
+                                {'type': object_type, 'id': obj_id,
+                                 'exc': e})
+                    self.dirty.failed(object_type, obj_id, generation)
+                else:
+                    self.dirty.clear(object_type, obj_id, generation)
+
+    def _sync_dirty_periodic(self):
+        # While out of sync the background resync replays dirty objects.
+        if not self.dirty or self.out_of_sync:
+            return
+        try:
+            self.sync_dirty(n_context.get_admin_context())
+        except Exception:
+            LOG.exception(_("Failed to resync dirty objects with "
+                            "OpenDaylight"))
+
+    def start_dirty_resync(self):
+        """Start resyncing dirty objects periodically, once in each process."""
+        interval = cfg.CONF.odl_rest.dirty_resync_interval
+        if not interval or self._dirty_resync_pid == os.getpid():
+            return
+        self._dirty_resync_pid = os.getpid()
+        loopingcall.FixedIntervalLoopingCall(self._sync_dirty_periodic).start(
+            interval=interval, initial_delay=interval)
+
+    def resync_resource(self, object_type, obj_id, dbcontext):
+        """Make ODL's copy of a single object match the Neutron DB."""
+        resource = self._get_resource(object_type, obj_id, dbcontext)
+        if resource is None:
+            self.sync_single_resource('delete', object_type, obj_id,
+                                      dbcontext)
+            return
+        update = self.payloads[(object_type, 'update')](resource)
+        try:
+            self.client.sendjson('put', object_type + '/' + obj_id,
+                                 {object_type[:-1]: update})
+        except requests.exceptions.HTTPError as e:
+            with excutils.save_and_reraise_exception() as ctx:
+                if e.response.status_code == 404:
+                    ctx.reraise = False
+                    create = self.payloads[(object_type, 'create')](resource)
+                    self.client.sendjson('post', object_type,
+                                         {object_type[:-1]: create}, [400])
@@ -7,81 +7,313 @@
 #
 # @author: Dave Tucker <djt@redhat.com>
 
+import os
+
 from oslo.config import cfg
 
+from neutron import context as n_context
+from neutron.db.loadbalancer import loadbalancer_db as ldb
+from neutron.extensions import loadbalancer
 from neutron.openstack.common import log as logging
+from neutron.openstack.common import loopingcall
+from neutron.plugins.common import constants
 from neutron.services.loadbalancer.drivers import lbaas_base
 
 from odldrivers.common import client as odl_client
 from odldrivers.common import config  # noqa
+from odldrivers.common import journal
+from odldrivers.common import metrics
+from odldrivers.common import utils as odl_utils
 
 LOG = logging.getLogger(__name__)
 
+VIPS = 'vips'
+POOLS = 'pools'
+MEMBERS = 'members'
+HEALTHMONITORS = 'health_monitors'
+
+# Path of each collection below the ODL northbound URL.
+collection_paths = {VIPS: 'lbaas/vips',
+                    POOLS: 'lbaas/pools',
+                    MEMBERS: 'lbaas/members',
+                    HEALTHMONITORS: 'lbaas/healthmonitors'}
+
+not_found_exception_map = {VIPS: loadbalancer.VipNotFound,
+                           POOLS: loadbalancer.PoolNotFound,
+                           MEMBERS: loadbalancer.MemberNotFound,
+                           HEALTHMONITORS: loadbalancer.HealthMonitorNotFound}
+
+status_models = {VIPS: ldb.Vip, POOLS: ldb.Pool, MEMBERS: ldb.Member}
+
+# Attributes left out of the payload sent to ODL for each object type.
+# Anything not listed is sent.
+payload_excluded_attributes = {
+    VIPS: ('status', 'status_description'),
+    POOLS: ('status', 'status_description', 'health_monitors_status'),
+    MEMBERS: ('status', 'status_description'),
+    HEALTHMONITORS: ('status', 'status_description'),
+}
+
+payload_transforms = {
+    HEALTHMONITORS: {'pools': lambda pools: [p['pool_id'] for p in pools]},
+}
+
 
 class OpenDaylightLbaasDriver(lbaas_base.LoadBalancerAbstractDriver):
 
-    """OpenDaylight LBaaS Driver"""
+    """OpenDaylight LBaaS Driver
+
+    Changes are recorded in the journal and sent to OpenDaylight by its
+    background workers, which set each object ACTIVE once ODL has it, or
+    ERROR when it could not be sent. New members are sent in bulk, so
+    adding many members to a pool costs a handful of requests. Without
+    the journal changes are sent inline.
+
+    Pool statistics are polled from ODL in the background every
+    lbaas_stats_interval seconds and served from memory.
+    """
 
     def __init__(self, plugin):
         LOG.debug(_("Initializing OpenDaylight LBaaS driver"))
         self.plugin = plugin
-        self.client = odl_client.OpenDaylightRestClient(
-            cfg.CONF.odl_rest.url,
-            cfg.CONF.odl_rest.username,
-            cfg.CONF.odl_rest.password,
-            cfg.CONF.odl_rest.timeout,
-            cfg.CONF.odl_rest.session_timeout
-        )
+        self.client = odl_client.get_client()
+        self.metrics = metrics.get_sink()
+        self.payloads = dict(
+            (object_type, odl_utils.compile_projection(
+                excluded, payload_transforms.get(object_type)))
+            for object_type, excluded in payload_excluded_attributes.items())
+        self.pool_stats = {}
+        self._stats_poller_pid = None
+        self.journal = None
+        if cfg.CONF.odl_rest.journal_enabled:
+            self.journal = journal.create_journal(
+                (VIPS, POOLS, MEMBERS, HEALTHMONITORS), self.dispatch_entry,
+                self.journal_entry_failed,
+                batch_handler=self.dispatch_batch,
+                batch_operations=[(MEMBERS, 'create')])
+            # Drain entries left by a previous run without waiting for the
+            # next change.
+            self.journal.start()
 
     def create_vip(self, context, vip):
         """Create a vip on the OpenDaylight Controller."""
-        pass
+        self.synchronize('create', VIPS, vip['id'])
 
     def update_vip(self, context, old_vip, vip):
         """Update a vip on the OpenDaylight Controller."""
-        pass
+        self.synchronize('update', VIPS, vip['id'])
 
     def delete_vip(self, context, vip):
         """Delete a vip on the OpenDaylight Controller."""
-        pass
+        self.plugin._delete_db_vip(context, vip['id'])
+        self.synchronize('delete', VIPS, vip['id'])
 
     def create_pool(self, context, pool):
         """Create a pool on the OpenDaylight Controller."""
-        pass
+        self.synchronize('create', POOLS, pool['id'])
 
     def update_pool(self, context, old_pool, pool):
         """Update a pool on the OpenDaylight Controller."""
-        pass
+        self.synchronize('update', POOLS, pool['id'])
 
     def delete_pool(self, context, pool):
         """Delete a pool on the OpenDaylight Controller."""
-        pass
+        self.plugin._delete_db_pool(context, pool['id'])
+        self.pool_stats.pop(pool['id'], None)
+        self.synchronize('delete', POOLS, pool['id'])
 
     def create_member(self, context, member):
         """Create a pool member on the OpenDaylight Controller."""
-        pass
+        self.synchronize('create', MEMBERS, member['id'])
 
     def update_member(self, context, old_member, member):
         """Update a pool member on the OpenDaylight Controller."""
-        pass
+        self.synchronize('update', MEMBERS, member['id'])
 
     def delete_member(self, context, member):
         """Delete a pool member on the OpenDaylight Controller."""
-        pass
+        self.plugin._delete_db_member(context, member['id'])
+        self.synchronize('delete', MEMBERS, member['id'])
 
     def create_pool_health_monitor(self, context, health_monitor, pool_id):
-        """Create a pool health monitor on the OpenDaylight Controller."""
-        pass
+        """Create a pool health monitor on the OpenDaylight Controller.
+
+        ODL learns of a health monitor when it is first associated with a
+        pool; later associations update its list of pools.
+        """
+        operation = 'create'
+        if len(health_monitor.get('pools') or ()) > 1:
+            operation = 'update'
+        self.synchronize(operation, HEALTHMONITORS, health_monitor['id'])
 
     def update_pool_health_monitor(self, context, old_health_monitor,
                                    health_monitor, pool_id):
         """Update a pool health monitor on the OpenDaylight Controller."""
-        pass
+        self.synchronize('update', HEALTHMONITORS, health_monitor['id'])
 
     def delete_pool_health_monitor(self, context, health_monitor, pool_id):
-        """Delete a pool health monitor on the OpenDaylight Controller."""
-        pass
+        """Delete a pool health monitor on the OpenDaylight Controller.
+
+        The health monitor is deleted from ODL once no pool uses it.
+        """
+        self.plugin._delete_db_pool_health_monitor(
+            context, health_monitor['id'], pool_id)
+        remaining = [p for p in health_monitor.get('pools') or ()
+                     if p['pool_id'] != pool_id]
+        self.synchronize('update' if remaining else 'delete',
+                         HEALTHMONITORS, health_monitor['id'])
 
     def stats(self, context, pool_id):
-        """Retrieve pool statistics from the OpenDaylight Controller"""
-        pass
+        """Retrieve pool statistics from the OpenDaylight Controller
+
+        The statistics last polled are returned, or None if ODL has not
+        reported any for the pool yet, in which case the plugin returns
+        those in its database.
+        """
+        self.start_stats_poller()
+        return self.pool_stats.get(pool_id)
+
+    def synchronize(self, operation, object_type, obj_id):
+        """Send a committed change to ODL, through the journal if enabled."""
+        if self.journal:
+            self.journal.record(object_type, obj_id, operation)
+            return
+        dbcontext = n_context.get_admin_context()
+        try:
+            self.sync_single_resource(operation, object_type, obj_id,
+                                      dbcontext)
+        except Exception:
+            LOG.exception(_("Failed to %(operation)s %(type)s %(id)s"),
+                          {'operation': operation, 'type': object_type,
+                           'id': obj_id})
+            if operation != 'delete':
+                self.set_status(dbcontext, object_type, obj_id,
+                                constants.ERROR)
+
+    def dispatch_entry(self, entry):
+        """Send a journal entry to ODL from a background worker."""
+        self.sync_single_resource(entry.operation, entry.object_type,
+                                  entry.object_id,
+                                  n_context.get_admin_context())
+
+    def dispatch_batch(self, entries):
+        """Create a batch of members in one bulk request.
+
+        Members ODL did not accept are set to ERROR, and their entries are
+        returned so the journal retries just those; a retry which succeeds
+        sets the member ACTIVE.
+        """
+        dbcontext = n_context.get_admin_context()
+        resources = []
+        for entry in entries:
+            resource = self._get_resource(entry.object_type, entry.object_id,
+                                          dbcontext)
+            if resource is not None:
+                resources.append(self.payloads[entry.object_type](resource))
+        if not resources:
+            return []
+        # 400 errors are returned if an object exists, which we ignore.
+        results = self.client.bulk_post(collection_paths[MEMBERS],
+                                        MEMBERS[:-1], resources,
+                                        len(resources), 1, [400])
+        failed = set()
+        for result in results:
+            failed.update(result.failed)
+        for resource in resources:
+            self.set_status(dbcontext, MEMBERS, resource['id'],
+                            constants.ERROR if resource['id'] in failed
+                            else constants.ACTIVE)
+        return [entry for entry in entries if entry.object_id in failed]
+
+    def journal_entry_failed(self, entry):
+        """Mark the object ERROR when a journal entry is dropped."""
+        if entry.operation != 'delete':
+            self.set_status(n_context.get_admin_context(), entry.object_type,
+                            entry.object_id, constants.ERROR)
+
+    def _get_resource(self, object_type, obj_id, dbcontext):
+        """Read an object from the database, or None if it is gone."""
+        try:
+            return getattr(self.plugin, 'get_%s' % object_type[:-1])(
+                dbcontext, obj_id)
+        except not_found_exception_map[object_type]:
+            LOG.debug(_('%(object_type)s not found (%(obj_id)s)'),
+                      {'object_type': object_type.capitalize(),
+                       'obj_id': obj_id})
+
+    def set_status(self, dbcontext, object_type, obj_id, status):
+        """Record the outcome of sending an object to ODL in the database."""
+        try:
+            if object_type != HEALTHMONITORS:
+                self.plugin.update_status(dbcontext,
+                                          status_models[object_type],
+                                          obj_id, status)
+                return
+            health_monitor = self.plugin.get_health_monitor(dbcontext,
+                                                            obj_id)
+            for pool in health_monitor.get('pools') or ():
+                self.plugin.update_pool_health_monitor(
+                    dbcontext, obj_id, pool['pool_id'], status)
+        except not_found_exception_map[object_type]:
+            pass
+
+    def sync_single_resource(self, operation, object_type, obj_id,
+                             dbcontext):
+        """Send a single create, update or delete to OpenDaylight.
+
+        The object is read back from the database, so the latest state is
+        sent even when the operation was queued for a while.
+        """
+        with self.metrics.timer('sync_single_resource.%s.%s' %
+                                (object_type, operation)):
+            self._sync_single_resource(operation, object_type, obj_id,
+                                       dbcontext)
+
+    def _sync_single_resource(self, operation, object_type, obj_id,
+                              dbcontext):
+        path = collection_paths[object_type]
+        if operation == 'delete':
+            # 404 errors are returned if the object is already gone.
+            self.client.sendjson('delete', path + '/' + obj_id, None, [404])
+            return
+        resource = self._get_resource(object_type, obj_id, dbcontext)
+        if resource is None:
+            return
+        payload = {object_type[:-1]: self.payloads[object_type](resource)}
+        if operation == 'create':
+            # 400 errors are returned if an object exists, which we ignore.
+            self.client.sendjson('post', path, payload, [400])
+        else:
+            self.client.sendjson('put', path + '/' + obj_id, payload)
+        self.set_status(dbcontext, object_type, obj_id, constants.ACTIVE)
+
+    def poll_stats(self):
+        """Fetch the statistics of every pool from ODL.
+
+        Pools are listed a page at a time, so a poll costs one request per
+        sync_page_size pools rather than one per pool.
+        """
+        with self.metrics.timer('lbaas.poll_stats'):
+            pool_stats = {}
+            for pool in self.client.list_collection(
+                    collection_paths[POOLS], cfg.CONF.odl_rest.sync_page_size,
+                    ['id', 'stats']):
+                if pool.get('stats'):
+                    pool_stats[pool['id']] = pool['stats']
+        self.pool_stats = pool_stats
+
+    def _poll_stats_periodic(self):
+        try:
+            self.poll_stats()
+        except Exception as e:
+            LOG.warning(_("Failed to poll pool statistics from "
+                          "OpenDaylight: %s"), e)
+
+    def start_stats_poller(self):
+        """Start polling pool statistics once in each process."""
+        interval = cfg.CONF.odl_rest.lbaas_stats_interval
+        if not interval or self._stats_poller_pid == os.getpid():
+            return
+        self._stats_poller_pid = os.getpid()
+        loopingcall.FixedIntervalLoopingCall(
+            self._poll_stats_periodic).start(interval=interval)
@@ -15,22 +15,42 @@
 # @author: Kyle Mestery, Cisco Systems, Inc.
 # @author: Dave Tucker, Hewlett-Packard Development Company L.P.
 
+import os
+
 from oslo.config import cfg
+from oslo.serialization import jsonutils
 from oslo.utils import excutils
 import requests
+import six
 
 from neutron.common import constants as n_const
 from neutron.common import exceptions as n_exc
 from neutron.common import utils
+from neutron import context as n_context
 from neutron.extensions import portbindings
+from neutron import manager
 from neutron.openstack.common import log
+from neutron.openstack.common import loopingcall
 from neutron.plugins.common import constants
 from neutron.plugins.ml2 import driver_api as api
 
+from odldrivers.common import cache
 from odldrivers.common import client as odl_client
 from odldrivers.common import config  # noqa
+from odldrivers.common import exceptions as odl_exc
+from odldrivers.common import journal
+from odldrivers.common import metrics
+from odldrivers.common import snapshot
+from odldrivers.common import sync
 from odldrivers.common import utils as odl_utils
 
+try:
+    from neutron.callbacks import events
+    from neutron.callbacks import registry
+    from neutron.callbacks import resources
+except ImportError:
+    registry = None
+
 LOG = log.getLogger(__name__)
 
 ODL_NETWORK = 'network'
@@ -44,6 +64,39 @@ not_found_exception_map = {ODL_NETWORKS: n_exc.NetworkNotFound,
                            ODL_SUBNETS: n_exc.SubnetNotFound,
                            ODL_PORTS: n_exc.PortNotFound}
 
+# Attributes compared by the reconciler to decide whether the copy of an
+# object held by ODL is stale.
+reconcile_attributes_map = {
+    ODL_NETWORKS: ('name', 'admin_state_up', 'shared', 'tenant_id',
+                   'router:external', 'provider:network_type',
+                   'provider:physical_network', 'provider:segmentation_id'),
+    ODL_SUBNETS: ('name', 'network_id', 'ip_version', 'cidr', 'gateway_ip',
+                  'enable_dhcp', 'tenant_id'),
+    ODL_PORTS: ('name', 'network_id', 'admin_state_up', 'mac_address',
+                'fixed_ips', 'device_id', 'device_owner', 'tenant_id'),
+}
+
+# Attributes left out of the payload sent to ODL for each object type and
+# operation. Anything not listed, including extension attributes, is sent.
+payload_excluded_attributes = {
+    (ODL_NETWORKS, 'create'): ('status', 'subnets'),
+    (ODL_NETWORKS, 'update'): ('id', 'status', 'subnets', 'tenant_id'),
+    (ODL_SUBNETS, 'create'): (),
+    (ODL_SUBNETS, 'update'): ('id', 'network_id', 'ip_version', 'cidr',
+                              'allocation_pools', 'tenant_id'),
+    (ODL_PORTS, 'create'): ('status',),
+    (ODL_PORTS, 'update'): ('network_id', 'id', 'status', 'mac_address',
+                            'tenant_id', 'fixed_ips'),
+}
+
+# Attributes rewritten on the way to ODL, mapped to the name of the driver
+# method called as method(value, plugin, dbcontext) to produce the new value.
+payload_transforms = {
+    (ODL_PORTS, 'create'): {'security_groups': 'expand_security_groups',
+                            'mac_address': 'upper_mac_address'},
+    (ODL_PORTS, 'update'): {'security_groups': 'expand_security_groups'},
+}
+
 
 class OpenDaylightMechanismDriver(api.MechanismDriver):
 
@@ -55,22 +108,67 @@ class OpenDaylightMechanismDriver(api.MechanismDriver):
     """
     auth = None
     out_of_sync = True
+    supported_network_types = frozenset([
+        constants.TYPE_LOCAL, constants.TYPE_GRE, constants.TYPE_VXLAN,
+        constants.TYPE_VLAN])
 
     def initialize(self):
         required_opts = ('url', 'username', 'password')
         for opt in required_opts:
+            if opt == 'url' and cfg.CONF.odl_rest.cluster_urls:
+                continue
             if not getattr(cfg.CONF.odl_rest, opt):
                 raise cfg.RequiredOptError(opt, 'odl_rest')
 
-        self.client = odl_client.OpenDaylightRestClient(
-            cfg.CONF.odl_rest.url,
-            cfg.CONF.odl_rest.username,
-            cfg.CONF.odl_rest.password,
-            cfg.CONF.odl_rest.timeout,
-            cfg.CONF.odl_rest.session_timeout
-        )
+        self.client = odl_client.get_client()
+        self.metrics = metrics.get_sink()
+        self.payloads = self.compile_payloads()
+        self.comparisons = self.compile_comparisons()
+        self.dirty = sync.DirtyTracker(
+            cfg.CONF.odl_rest.dirty_resync_interval,
+            cfg.CONF.odl_rest.dirty_retry_interval_max)
+        self._reconciler_pid = None
+        self._dirty_resync_pid = None
+        self.journal = None
+        if cfg.CONF.odl_rest.journal_enabled:
+            self.journal = journal.create_journal(
+                (ODL_NETWORKS, ODL_SUBNETS, ODL_PORTS),
+                self.dispatch_entry, self.journal_entry_failed)
+        self.snapshot = None
+        if cfg.CONF.odl_rest.snapshot_path:
+            self.snapshot = snapshot.Snapshot(
+                cfg.CONF.odl_rest.snapshot_path,
+                (ODL_NETWORKS, ODL_SUBNETS, ODL_PORTS),
+                cfg.CONF.odl_rest.snapshot_save_interval)
+            self.snapshot.load()
+        self.resync = sync.BackgroundResync(
+            self._resync_snapshot, self._resync_replay, self.journal,
+            cfg.CONF.odl_rest.resync_retry_interval)
+        self.sg_cache = cache.TTLCache(cfg.CONF.odl_rest.sg_cache_size,
+                                       cfg.CONF.odl_rest.sg_cache_ttl)
+        self.supported_network_types = frozenset(
+            cfg.CONF.odl_rest.network_types)
+        self.hostconfigs = None
+        segment_ttl = 0
+        if cfg.CONF.odl_rest.hostconfig_enabled:
+            segment_ttl = cfg.CONF.odl_rest.hostconfig_cache_ttl
+            self.hostconfigs = cache.TTLCache(
+                cfg.CONF.odl_rest.segment_cache_size, segment_ttl)
+        self.segment_cache = cache.TTLCache(
+            cfg.CONF.odl_rest.segment_cache_size, segment_ttl)
+        if registry is not None:
+            for resource in (resources.SECURITY_GROUP,
+                             resources.SECURITY_GROUP_RULE):
+                for event in (events.AFTER_CREATE, events.AFTER_UPDATE,
+                              events.AFTER_DELETE):
+                    registry.subscribe(self.security_group_changed,
+                                       resource, event)
         self.vif_type = portbindings.VIF_TYPE_OVS
         self.vif_details = {portbindings.CAP_PORT_FILTER: True}
+        if self.journal:
+            # Drain entries left by a previous run without waiting for the
+            # next change.
+            self.journal.start()
 
     # Postcommit hooks are used to trigger synchronization.
 
@@ -78,9 +176,11 @@ class OpenDaylightMechanismDriver(api.MechanismDriver):
         self.synchronize('create', ODL_NETWORKS, context)
 
     def update_network_postcommit(self, context):
+        self.segment_cache.invalidate(context.current['id'])
         self.synchronize('update', ODL_NETWORKS, context)
 
     def delete_network_postcommit(self, context):
+        self.segment_cache.invalidate(context.current['id'])
         self.synchronize('delete', ODL_NETWORKS, context)
 
     def create_subnet_postcommit(self, context):
@@ -102,112 +202,280 @@ class OpenDaylightMechanismDriver(api.MechanismDriver):
         self.synchronize('delete', ODL_PORTS, context)
 
     def synchronize(self, operation, object_type, context):
-        """Synchronize ODL with Neutron following a configuration change."""
+        """Synchronize ODL with Neutron following a configuration change.
+
+        Until the first full resync has finished in the background, changes
+        are only recorded, to be replayed once it is done.
+        """
+        self.start_reconciler()
+        self.start_dirty_resync()
+        if self.snapshot is not None:
+            self.snapshot.start_saver()
         if self.out_of_sync:
-            self.sync_full(context)
+            self.resync.start()
+        changes = None
+        if operation == 'update' and cfg.CONF.odl_rest.delta_updates:
+            changes = self.update_delta(object_type, context)
+            if changes == {}:
+                self.metrics.incr('synchronize.%s.unchanged' % object_type)
+                return
+        if self.journal:
+            self.journal.record(object_type, context.current['id'], operation,
+                                changes)
+        elif self.out_of_sync:
+            self.dirty.mark(object_type, context.current['id'])
         else:
-            self.sync_object(operation, object_type, context)
-
-    def filter_create_network_attributes(self, network, context, dbcontext):
-        """Filter out network attributes not required for a create."""
-        odl_utils.try_del(network, ['status', 'subnets'])
+            self.sync_object(operation, object_type, context, changes)
 
-    def filter_create_subnet_attributes(self, subnet, context, dbcontext):
-        """Filter out subnet attributes not required for a create."""
-        pass
+    def update_delta(self, object_type, context):
+        """Return the attributes an update changed which ODL is sent.
 
-    def filter_create_port_attributes(self, port, context, dbcontext):
-        """Filter out port attributes not required for a create."""
-        self.add_security_groups(context, dbcontext, port)
+        The attributes are those of context.current which differ from
+        context.original, or None when the original is not known and the
+        whole object has to be sent.
+        """
+        original = getattr(context, 'original', None)
+        if original is None:
+            return None
+        return odl_utils.changed_attributes(
+            original, context.current,
+            payload_excluded_attributes[(object_type, 'update')])
+
+    def dispatch_entry(self, entry):
+        """Send a journal entry to ODL from a background worker."""
+        if self.out_of_sync:
+            # Wait for the background resync, which resumes the journal.
+            self.resync.start()
+            raise journal.RetryLater()
+        plugin = manager.NeutronManager.get_plugin()
+        dbcontext = n_context.get_admin_context()
+        self.sync_single_resource(entry.operation, entry.object_type,
+                                  entry.object_id, plugin, dbcontext,
+                                  entry.data)
+
+    def journal_entry_failed(self, entry):
+        """Resync the object later when a journal entry is dropped."""
+        self.dirty.mark(entry.object_type, entry.object_id)
+        self.start_dirty_resync()
+
+    def _resync_snapshot(self):
+        self.sync_full(manager.NeutronManager.get_plugin(),
+                       n_context.get_admin_context())
+
+    def _resync_replay(self):
+        if self.dirty:
+            self.sync_dirty(manager.NeutronManager.get_plugin(),
+                            n_context.get_admin_context())
+
+    def compile_payloads(self):
+        """Build the payload projection for each object type and operation.
+
+        Each projection is called as project(resource, plugin, dbcontext)
+        and returns a new dict, leaving the database result untouched.
+        """
+        payloads = {}
+        for key, excluded in payload_excluded_attributes.items():
+            transforms = dict((attr, getattr(self, method))
+                              for attr, method in
+                              payload_transforms.get(key, {}).items())
+            payloads[key] = odl_utils.compile_projection(excluded, transforms)
+        return payloads
+
+    def compile_comparisons(self):
+        """Build the projection differences() uses for each object type.
+
+        These are the create projections, less the transforms of attributes
+        outside reconcile_attributes_map, so comparing ports does not read
+        their security groups.
+        """
+        comparisons = {}
+        for object_type, keys in reconcile_attributes_map.items():
+            key = (object_type, 'create')
+            transforms = dict((attr, getattr(self, method))
+                              for attr, method in
+                              payload_transforms.get(key, {}).items()
+                              if attr in keys)
+            comparisons[object_type] = odl_utils.compile_projection(
+                payload_excluded_attributes[key], transforms)
+        return comparisons
+
+    def upper_mac_address(self, mac_address, plugin, dbcontext):
         # TODO(kmestery): Converting to uppercase due to ODL bug
         # https://bugs.opendaylight.org/show_bug.cgi?id=477
-        port['mac_address'] = port['mac_address'].upper()
-        odl_utils.try_del(port, ['status'])
+        return mac_address.upper()
 
     def sync_resources(self, resource_name, collection_name, resources,
-                       context, dbcontext, attr_filter):
+                       plugin, dbcontext, tree=None):
         """Sync objects from Neutron over to OpenDaylight.
 
         This will handle syncing networks, subnets, and ports from Neutron to
         OpenDaylight. It also filters out the requisite items which are not
-        valid for create API operations.
+        valid for create API operations. The ids already present in
+        OpenDaylight are read with a single paged listing of the collection
+        instead of a GET per resource.
+
+        resources may be any iterable; it is consumed lazily, so only the
+        batches in flight are held in memory. If tree is given, the content
+        hash of every resource is added to it.
         """
-        to_be_synced = []
-        for resource in resources:
-            try:
-                urlpath = collection_name + '/' + resource['id']
-                self.client.sendjson('get', urlpath, None)
-            except requests.exceptions.HTTPError as e:
-                with excutils.save_and_reraise_exception() as ctx:
-                    if e.response.status_code == 404:
-                        attr_filter(resource, context, dbcontext)
-                        to_be_synced.append(resource)
-                        ctx.reraise = False
-
-        key = resource_name if len(to_be_synced) == 1 else collection_name
-
-        # 400 errors are returned if an object exists, which we ignore.
-        self.client.sendjson('post', collection_name,
-                             {key: to_be_synced}, [400])
+        with self.metrics.timer('sync_resources.%s.list' % collection_name):
+            odl_ids = set(obj['id'] for obj in self.client.list_collection(
+                collection_name, cfg.CONF.odl_rest.sync_page_size, ['id']))
+
+        project = self.payloads[(collection_name, 'create')]
+
+        def to_be_synced():
+            for resource in resources:
+                if tree is not None:
+                    tree.set(resource['id'],
+                             self.content_hash(collection_name, resource))
+                if resource['id'] not in odl_ids:
+                    yield project(resource, plugin, dbcontext)
+
+        with self.metrics.timer('sync_resources.' + collection_name):
+            # 400 errors are returned if an object exists, which we ignore.
+            results = self.client.bulk_post(
+                collection_name, resource_name, to_be_synced(),
+                cfg.CONF.odl_rest.sync_batch_size,
+                cfg.CONF.odl_rest.sync_workers, [400])
+        failed = sum(len(result.failed) for result in results)
+        self.metrics.incr('sync_resources.%s.created' % collection_name,
+                          sum(result.count for result in results) - failed)
+        if failed:
+            self.metrics.incr('sync_resources.%s.failed' % collection_name,
+                              failed)
+            raise odl_exc.OpendaylightSyncError(count=failed,
+                                                collection=collection_name)
 
     @utils.synchronized('odl-sync-full')
-    def sync_full(self, context):
+    def sync_full(self, plugin, dbcontext):
         """Resync the entire database to ODL.
 
-        Transition to the in-sync state on success.
+        Transition to the in-sync state on success. This runs in the
+        background from self.resync, so API requests do not wait for it.
+        If a snapshot from before a restart was loaded, only the objects
+        which differ from it are resynced.
         Note: we only allow a single thead in here at a time.
         """
         if not self.out_of_sync:
             return
-        dbcontext = context._plugin_context
-        networks = context._plugin.get_networks(dbcontext)
-        subnets = context._plugin.get_subnets(dbcontext)
-        ports = context._plugin.get_ports(dbcontext)
-
-        self.sync_resources(ODL_NETWORK, ODL_NETWORKS, networks,
-                            context, dbcontext,
-                            self.filter_create_network_attributes)
-        self.sync_resources(ODL_SUBNET, ODL_SUBNETS, subnets,
-                            context, dbcontext,
-                            self.filter_create_subnet_attributes)
-        self.sync_resources(ODL_PORT, ODL_PORTS, ports,
-                            context, dbcontext,
-                            self.filter_create_port_attributes)
+        if self.snapshot is not None and self.snapshot.loaded:
+            if self._odl_has_data():
+                with self.metrics.timer('sync_full.warm'):
+                    self._sync_changed(plugin, dbcontext)
+                self.out_of_sync = False
+                return
+            LOG.info(_("OpenDaylight has lost its data, ignoring the "
+                       "snapshot"))
+        with self.metrics.timer('sync_full'):
+            self._sync_full(plugin, dbcontext)
         self.out_of_sync = False
 
-    def filter_update_network_attributes(self, network, context, dbcontext):
-        """Filter out network attributes for an update operation."""
-        odl_utils.try_del(network, ['id', 'status', 'subnets', 'tenant_id'])
-
-    def filter_update_subnet_attributes(self, subnet, context, dbcontext):
-        """Filter out subnet attributes for an update operation."""
-        odl_utils.try_del(subnet, ['id', 'network_id', 'ip_version', 'cidr',
-                         'allocation_pools', 'tenant_id'])
-
-    def filter_update_port_attributes(self, port, context, dbcontext):
-        """Filter out port attributes for an update operation."""
-        self.add_security_groups(context, dbcontext, port)
-        odl_utils.try_del(port, ['network_id', 'id', 'status', 'mac_address',
-                       'tenant_id', 'fixed_ips'])
+    def _sync_full(self, plugin, dbcontext):
+        page_size = cfg.CONF.odl_rest.sync_page_size
+        if self.snapshot is not None:
+            # Don't trust a snapshot from before a resync which failed.
+            self.snapshot.invalidate()
+        trees = {}
+        for resource_name, collection_name in ((ODL_NETWORK, ODL_NETWORKS),
+                                               (ODL_SUBNET, ODL_SUBNETS),
+                                               (ODL_PORT, ODL_PORTS)):
+            resources = odl_utils.iter_resources(
+                getattr(plugin, 'get_%s' % collection_name), dbcontext,
+                page_size)
+            trees[collection_name] = snapshot.MerkleTree()
+            self.sync_resources(resource_name, collection_name, resources,
+                                plugin, dbcontext, trees[collection_name])
+        if self.snapshot is not None:
+            for collection_name, tree in trees.items():
+                self.snapshot.replace(collection_name, tree)
+            self.snapshot.maybe_save(force=True)
+
+    def _odl_has_data(self):
+        """Check that ODL has not lost what the snapshot says it has.
+
+        A controller restarted with an empty datastore has no networks;
+        one page of one network is enough to tell.
+        """
+        if not self.snapshot.size(ODL_NETWORKS):
+            return True
+        networks = self.client.list_collection(ODL_NETWORKS, 1, ['id'])
+        return next(iter(networks), None) is not None
 
-    create_object_map = {ODL_NETWORKS: filter_create_network_attributes,
-                         ODL_SUBNETS: filter_create_subnet_attributes,
-                         ODL_PORTS: filter_create_port_attributes}
+    def _sync_changed(self, plugin, dbcontext):
+        """Resync the objects which changed since the snapshot was saved.
 
-    update_object_map = {ODL_NETWORKS: filter_update_network_attributes,
-                         ODL_SUBNETS: filter_update_subnet_attributes,
-                         ODL_PORTS: filter_update_port_attributes}
+        The database is hashed into a tree per object type and compared
+        with the snapshot's, walking only the buckets whose digests differ.
+        Nothing is read from ODL.
+        """
+        page_size = cfg.CONF.odl_rest.sync_page_size
+        changed = 0
+        for object_type in (ODL_NETWORKS, ODL_SUBNETS, ODL_PORTS):
+            tree = snapshot.MerkleTree()
+            for resource in odl_utils.iter_resources(
+                    getattr(plugin, 'get_%s' % object_type), dbcontext,
+                    page_size):
+                tree.set(resource['id'],
+                         self.content_hash(object_type, resource))
+            for obj_id in self.snapshot.diff(object_type, tree):
+                self.dirty.mark(object_type, obj_id)
+                changed += 1
+        LOG.info(_("%d objects changed since the last OpenDaylight "
+                   "snapshot"), changed)
+        self.metrics.incr('sync_full.warm.changed', changed)
+        if changed:
+            self.sync_dirty(plugin, dbcontext)
+        self.snapshot.maybe_save(force=True)
+
+    def content_hash(self, object_type, resource):
+        """Hash the attributes of a resource which are sent to ODL."""
+        excluded = payload_excluded_attributes[(object_type, 'create')]
+        return odl_utils.content_hash(
+            resource, sorted(key for key in resource if key not in excluded))
+
+    def _pushed(self, object_type, obj_id, resource):
+        """Record in the snapshot that ODL now has resource, or not."""
+        if self.snapshot is None:
+            return
+        if resource is None:
+            self.snapshot.discard(object_type, obj_id)
+        else:
+            self.snapshot.set(object_type, obj_id,
+                              self.content_hash(object_type, resource))
 
     def sync_single_resource(self, operation, object_type, obj_id,
-                             context, attr_filter_create, attr_filter_update):
+                             plugin, dbcontext, changes=None):
         """Sync over a single resource from Neutron to OpenDaylight.
 
         Handle syncing a single operation over to OpenDaylight, and correctly
         filter attributes out which are not required for the requisite
-        operation (create or update) being handled.
+        operation (create or update) being handled. An update given the
+        attributes which changed sends just those, without reading the
+        object from the database.
         """
-        dbcontext = context._plugin_context
-        if operation == 'create':
+        with self.metrics.timer('sync_single_resource.%s.%s' %
+                                (object_type, operation)):
+            self._sync_single_resource(operation, object_type, obj_id,
+                                       plugin, dbcontext, changes)
+
+    def _sync_single_resource(self, operation, object_type, obj_id,
+                              plugin, dbcontext, changes=None):
+        if operation == 'delete':
+            # 404 errors are returned if the object is already gone.
+            self.client.sendjson('delete', object_type + '/' + obj_id, None,
+                                 [404])
+            self._pushed(object_type, obj_id, None)
+            return
+        elif operation == 'update' and changes is not None:
+            # The snapshot keeps the hash of the whole object as it was
+            # last sent, so a warm start resyncs the object once more.
+            payload = self.payloads[(object_type, 'update')](
+                changes, plugin, dbcontext)
+            self.client.sendjson('put', object_type + '/' + obj_id,
+                                 {object_type[:-1]: payload}, [400])
+            return
+        elif operation == 'create':
             urlpath = object_type
             method = 'post'
         else:
@@ -215,67 +483,282 @@ class OpenDaylightMechanismDriver(api.MechanismDriver):
             method = 'put'
 
         try:
-            obj_getter = getattr(context._plugin, 'get_%s' % object_type[:-1])
-            resource = obj_getter(dbcontext, obj_id)
+            obj_getter = getattr(plugin, 'get_%s' % object_type[:-1])
+            with self.metrics.timer('db.get.' + object_type):
+                resource = obj_getter(dbcontext, obj_id)
         except not_found_exception_map[object_type]:
             LOG.debug(_('%(object_type)s not found (%(obj_id)s)'),
                       {'object_type': object_type.capitalize(),
                       'obj_id': obj_id})
         else:
-            if operation == 'create':
-                attr_filter_create(self, resource, context, dbcontext)
-            elif operation == 'update':
-                attr_filter_update(self, resource, context, dbcontext)
-            try:
-                # 400 errors are returned if an object exists, which we ignore.
-                self.client.sendjson(method, urlpath,
-                                     {object_type[:-1]: resource}, [400])
-            except Exception:
-                with excutils.save_and_reraise_exception():
-                    self.out_of_sync = True
-
-    def sync_object(self, operation, object_type, context):
+            payload = self.payloads[(object_type, operation)](
+                resource, plugin, dbcontext)
+            # 400 errors are returned if an object exists, which we ignore.
+            self.client.sendjson(method, urlpath,
+                                 {object_type[:-1]: payload}, [400])
+            self._pushed(object_type, obj_id, resource)
+
+    def sync_object(self, operation, object_type, context, changes=None):
         """Synchronize the single modified record to ODL."""
         obj_id = context.current['id']
 
-        self.sync_single_resource(operation, object_type, obj_id, context,
-                                  self.create_object_map[object_type],
-                                  self.update_object_map[object_type])
+        try:
+            self.sync_single_resource(operation, object_type, obj_id,
+                                      context._plugin,
+                                      context._plugin_context, changes)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self.dirty.mark(object_type, obj_id)
+
+    def resync_resource(self, object_type, obj_id, plugin, dbcontext):
+        """Make ODL's copy of a single object match the Neutron DB.
+
+        The object is deleted from ODL if it no longer exists in Neutron,
+        updated if ODL has it, and created otherwise.
+        """
+        urlpath = object_type + '/' + obj_id
+        try:
+            obj_getter = getattr(plugin, 'get_%s' % object_type[:-1])
+            resource = obj_getter(dbcontext, obj_id)
+        except not_found_exception_map[object_type]:
+            self.client.sendjson('delete', urlpath, None, [404])
+            self._pushed(object_type, obj_id, None)
+            return
+
+        update = self.payloads[(object_type, 'update')](
+            resource, plugin, dbcontext)
+        try:
+            self.client.sendjson('put', urlpath, {object_type[:-1]: update})
+        except requests.exceptions.HTTPError as e:
+            with excutils.save_and_reraise_exception() as ctx:
+                if e.response.status_code == 404:
+                    ctx.reraise = False
+                    create = self.payloads[(object_type, 'create')](
+                        resource, plugin, dbcontext)
+                    self.client.sendjson('post', object_type,
+                                         {object_type[:-1]: create}, [400])
+        self._pushed(object_type, obj_id, resource)
+
+    @utils.synchronized('odl-sync-dirty')
+    def sync_dirty(self, plugin, dbcontext):
+        """Resync only the objects marked dirty by earlier failures.
+
+        Objects which fail again stay dirty and are backed off; see
+        sync.DirtyTracker.
+        """
+        self.metrics.gauge('dirty', len(self.dirty))
+        for object_type in (ODL_NETWORKS, ODL_SUBNETS, ODL_PORTS):
+            pending = self.dirty.pending(object_type)
+            for obj_id, generation in pending.items():
+                try:
+                    self.resync_resource(object_type, obj_id, plugin,
+                                         dbcontext)
+                except Exception as e:
+                    LOG.warning(_("Failed to resync %(type)s %(id)s: "
+                                  "%(exc)s"),
+                                {'type': object_type, 'id': obj_id,
+                                 'exc': e})
+                    self.dirty.failed(object_type, obj_id, generation)
+                else:
+                    self.dirty.clear(object_type, obj_id, generation)
+
+    def reconcile(self):
+        """Push the objects whose content differs between Neutron and ODL.
+
+        Both sides are hashed over reconcile_attributes_map; objects which
+        are missing, extra or different are marked dirty and resynced.
+        """
+        plugin = manager.NeutronManager.get_plugin()
+        dbcontext = n_context.get_admin_context()
+        for object_type in (ODL_NETWORKS, ODL_SUBNETS, ODL_PORTS):
+            for obj_id, kind in self.differences(object_type, plugin,
+                                                 dbcontext):
+                self.dirty.mark(object_type, obj_id)
+        if self.dirty:
+            LOG.info(_("Reconciling %d objects with OpenDaylight"),
+                     len(self.dirty))
+            self.sync_dirty(plugin, dbcontext)
+
+    def differences(self, object_type, plugin, dbcontext):
+        """Yield (id, kind) for the objects of object_type which differ.
+
+        Neutron objects are filtered as for a create and both sides are
+        compared over reconcile_attributes_map; see sync.compare.
+        """
+        page_size = cfg.CONF.odl_rest.sync_page_size
+        project = self.comparisons[object_type]
+        resources = odl_utils.iter_resources(
+            getattr(plugin, 'get_%s' % object_type), dbcontext, page_size)
+        filtered = (project(resource, plugin, dbcontext)
+                    for resource in resources)
+        odl_resources = self.client.list_collection(object_type, page_size)
+        return sync.compare(filtered, odl_resources,
+                            reconcile_attributes_map[object_type])
+
+    def _reconcile_periodic(self):
+        try:
+            self.reconcile()
+        except Exception:
+            LOG.exception(_("Failed to reconcile with OpenDaylight"))
+
+    def start_reconciler(self):
+        """Start the periodic reconciler once in each process."""
+        interval = cfg.CONF.odl_rest.reconcile_interval
+        if not interval or self._reconciler_pid == os.getpid():
+            return
+        self._reconciler_pid = os.getpid()
+        loopingcall.FixedIntervalLoopingCall(self._reconcile_periodic).start(
+            interval=interval, initial_delay=interval)
+
+    def _sync_dirty_periodic(self):
+        # While out of sync the background resync replays dirty objects.
+        if not self.dirty or self.out_of_sync:
+            return
+        try:
+            self.sync_dirty(manager.NeutronManager.get_plugin(),
+                            n_context.get_admin_context())
+        except Exception:
+            LOG.exception(_("Failed to resync dirty objects with "
+                            "OpenDaylight"))
+
+    def start_dirty_resync(self):
+        """Start resyncing dirty objects periodically, once in each process.
 
-    def add_security_groups(self, context, dbcontext, port):
+        Objects which failed to reach ODL are only marked on the API path;
+        this task pushes them, so no request waits on earlier failures.
+        """
+        interval = cfg.CONF.odl_rest.dirty_resync_interval
+        if not interval or self._dirty_resync_pid == os.getpid():
+            return
+        self._dirty_resync_pid = os.getpid()
+        loopingcall.FixedIntervalLoopingCall(self._sync_dirty_periodic).start(
+            interval=interval, initial_delay=interval)
+
+    def expand_security_groups(self, security_groups, plugin, dbcontext):
+        """Return the entire records of a list of security group ids.
+
+        Records are served from sg_cache, so ports sharing a group only
+        read it from the database once per change to the group.
+        """
+        with self.metrics.timer('add_security_groups'):
+            return [self.sg_cache.get_or_load(
+                    sg, lambda: plugin.get_security_group(dbcontext, sg))
+                    for sg in security_groups]
+
+    def add_security_groups(self, plugin, dbcontext, port):
         """Populate the 'security_groups' field with entire records."""
-        groups = [context._plugin.get_security_group(dbcontext, sg)
-                  for sg in port['security_groups']]
-        port['security_groups'] = groups
+        port['security_groups'] = self.expand_security_groups(
+            port['security_groups'], plugin, dbcontext)
+
+    def security_group_changed(self, resource, event, trigger, **kwargs):
+        """Drop cached security groups after a group or rule changes."""
+        sg_id = kwargs.get('security_group_id')
+        for key in ('security_group', 'security_group_rule'):
+            if not sg_id and kwargs.get(key):
+                sg_id = (kwargs[key].get('security_group_id') or
+                         kwargs[key].get('id'))
+        if sg_id:
+            self.sg_cache.invalidate(sg_id)
+        else:
+            self.sg_cache.clear()
 
     def bind_port(self, context):
         LOG.debug(_("Attempting to bind port %(port)s on "
                     "network %(network)s"),
                   {'port': context.current['id'],
                    'network': context.network.current['id']})
-        for segment in context.network.network_segments:
-            if self.check_segment(segment):
-                context.set_binding(segment[api.ID],
-                                    self.vif_type,
-                                    self.vif_details,
-                                    status=n_const.PORT_STATUS_ACTIVE)
-                LOG.debug(_("Bound using segment: %s"), segment)
-                return
-            else:
-                LOG.debug(_("Refusing to bind port for segment ID %(id)s, "
-                            "segment %(seg)s, phys net %(physnet)s, and "
-                            "network type %(nettype)s"),
-                          {'id': segment[api.ID],
-                           'seg': segment[api.SEGMENTATION_ID],
-                           'physnet': segment[api.PHYSICAL_NETWORK],
-                           'nettype': segment[api.NETWORK_TYPE]})
-
-    def check_segment(self, segment):
+        host = context.host if self.hostconfigs is not None else None
+        segment = self.select_segment(context.network, host)
+        if segment is None:
+            LOG.debug(_("Refusing to bind port %(port)s, no segment of "
+                        "network %(network)s is supported on host "
+                        "%(host)s"),
+                      {'port': context.current['id'],
+                       'network': context.network.current['id'],
+                       'host': context.host})
+            return
+        context.set_binding(segment[api.ID],
+                            self.vif_type,
+                            self.vif_details,
+                            status=n_const.PORT_STATUS_ACTIVE)
+        LOG.debug(_("Bound using segment: %s"), segment)
+
+    def select_segment(self, network, host=None):
+        """Return the first segment of a network ports can be bound to.
+
+        The choice is cached per network and host. It is recomputed when
+        the network's segments differ from those it was made for, or
+        after the network is updated or deleted.
+        """
+        segments = network.network_segments
+        signature = tuple((s[api.ID], s[api.NETWORK_TYPE],
+                           s[api.PHYSICAL_NETWORK]) for s in segments)
+        network_id = network.current['id']
+        cached = self.segment_cache.get(network_id)
+        if cached is not None and cached[0] == signature and host in cached[1]:
+            return cached[1][host]
+        hostconfig = self.get_hostconfig(host) if host else None
+        if hostconfig is False:
+            # ODL could not be asked, so bind without the host's config
+            # and don't remember the choice.
+            return next((s for s in segments if self.check_segment(s)), None)
+        segment = next((s for s in segments
+                        if self.check_segment(s, hostconfig)), None)
+        choices = {}
+        if cached is not None and cached[0] == signature:
+            choices.update(cached[1])
+        choices[host] = segment
+        self.segment_cache.set(network_id, (signature, choices))
+        return segment
+
+    def get_hostconfig(self, host):
+        """Return the network types and physical networks a host supports.
+
+        The result is a dict with 'network_types' and 'bridge_mappings'
+        keys, or None if ODL has no hostconfig for the host; either is
+        cached for hostconfig_cache_ttl seconds. False is returned,
+        uncached, if ODL could not be reached.
+        """
+        hostconfig = self.hostconfigs.get(host, False)
+        if hostconfig is not False:
+            return hostconfig
+        try:
+            response = self.client.sendjson('get', 'hostconfigs/' + host,
+                                            None, ignorecodes=[404])
+        except Exception as e:
+            LOG.warning(_("Failed to fetch the hostconfig of %(host)s: "
+                          "%(exc)s"), {'host': host, 'exc': e})
+            return False
+        hostconfig = None
+        if response is not None:
+            hostconfig = self.parse_hostconfig(
+                response.json().get('hostconfig') or {})
+        self.hostconfigs.set(host, hostconfig)
+        return hostconfig
+
+    @staticmethod
+    def parse_hostconfig(hostconfig):
+        config = hostconfig.get('config') or {}
+        if isinstance(config, six.string_types):
+            config = jsonutils.loads(config)
+        return {'network_types': frozenset(
+                    config.get('allowed_network_types') or ()),
+                'bridge_mappings': frozenset(
+                    config.get('bridge_mappings') or ())}
+
+    def check_segment(self, segment, hostconfig=None):
         """Verify a segment is valid for the OpenDaylight MechanismDriver.
 
-        Verify the requested segment is supported by ODL and return True or
-        False to indicate this to callers.
+        Verify the requested segment is supported by ODL, and by the host
+        if its hostconfig is given, and return True or False to indicate
+        this to callers.
         """
         network_type = segment[api.NETWORK_TYPE]
-        return network_type in [constants.TYPE_LOCAL, constants.TYPE_GRE,
-                                constants.TYPE_VXLAN, constants.TYPE_VLAN]
+        if network_type not in self.supported_network_types:
+            return False
+        if hostconfig is None:
+            return True
+        if network_type not in hostconfig['network_types']:
+            return False
+        physnet = segment[api.PHYSICAL_NETWORK]
+        return not physnet or physnet in hostconfig['bridge_mappings']
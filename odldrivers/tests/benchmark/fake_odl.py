@@ -0,0 +1,216 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import base64
+import collections
+import gzip
+import io
+import random
+import threading
+import time
+import uuid
+
+from oslo.serialization import jsonutils
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse as urlparse
+
+PREFIX = '/controller/nb/v2/neutron'
+
+
+class FakeOpenDaylight(object):
+
+    """In-process fake of the OpenDaylight Neutron northbound API.
+
+    Serves the networks, subnets, ports, routers and floatingips
+    collections, including bulk creates and limit/marker/fields listing,
+    behind JSESSIONID authentication. Every request can be delayed by
+    latency seconds and fails with a 503 with probability error_rate.
+    Sessions expire after session_ttl seconds, or when expire_sessions()
+    is called; 0 keeps them forever.
+
+    counts tallies requests by method, by method and collection, logins,
+    rejected sessions and injected errors.
+    """
+
+    collections = ('networks', 'subnets', 'ports', 'routers', 'floatingips')
+
+    def __init__(self, username='admin', password='admin', latency=0,
+                 error_rate=0, session_ttl=0, seed=None):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.error_rate = error_rate
+        self.session_ttl = session_ttl
+        self.random = random.Random(seed)
+        self.resources = dict((c, {}) for c in self.collections)
+        self.sessions = {}
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d%s' % (self._server.server_address[1],
+                                          PREFIX)
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.odl = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def expire_sessions(self):
+        with self._lock:
+            self.sessions.clear()
+
+    def _count(self, *keys):
+        with self._lock:
+            for key in keys:
+                self.counts[key] += 1
+
+    def _cookies(self, headers):
+        cookies = {}
+        for part in (headers.get('Cookie') or '').split(';'):
+            name, sep, value = part.strip().partition('=')
+            if sep:
+                cookies[name] = value
+        return cookies
+
+    def authenticate(self, headers):
+        """Return (authenticated, Set-Cookie headers) for a request."""
+        session = self._cookies(headers).get('JSESSIONID')
+        now = time.time()
+        with self._lock:
+            expires = self.sessions.get(session)
+            if expires is not None and (not expires or expires > now):
+                return True, []
+        credentials = (headers.get('Authorization') or '').split(' ', 1)
+        if (len(credentials) != 2 or credentials[0] != 'Basic' or
+                base64.b64decode(credentials[1].encode('ascii')) !=
+                ('%s:%s' % (self.username, self.password)).encode('utf-8')):
+            self._count('unauthorized')
+            return False, []
+        session = uuid.uuid4().hex
+        with self._lock:
+            self.sessions[session] = (now + self.session_ttl
+                                      if self.session_ttl else 0)
+            self.counts['login'] += 1
+        return True, [('Set-Cookie', 'JSESSIONID=%s; Path=/' % session),
+                      ('Set-Cookie', 'JSESSIONIDSSO=%s; Path=/' % session)]
+
+    def handle(self, method, path, headers, body):
+        """Serve one request. Returns (status, headers, body object)."""
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse.urlparse(path)
+        parts = url.path[len(PREFIX):].strip('/').split('/')
+        collection = parts[0]
+        self._count(method, '%s %s' % (method, collection))
+        ok, cookies = self.authenticate(headers)
+        if not ok:
+            return 401, [], None
+        if self.error_rate and self.random.random() < self.error_rate:
+            self._count('error')
+            return 503, cookies, None
+        if collection not in self.resources:
+            return 404, cookies, None
+        query = urlparse.parse_qs(url.query)
+        obj = jsonutils.loads(body.decode('utf-8')) if body else None
+        with self._lock:
+            status, result = getattr(self, '_' + method.lower())(
+                collection, parts[1] if len(parts) > 1 else None, query, obj)
+        return status, cookies, result
+
+    def _get(self, collection, obj_id, query, obj):
+        resources = self.resources[collection]
+        if obj_id is not None:
+            if obj_id not in resources:
+                return 404, None
+            return 200, {collection[:-1]: resources[obj_id]}
+        ids = sorted(resources)
+        if 'marker' in query:
+            ids = [i for i in ids if i > query['marker'][0]]
+        if 'limit' in query:
+            ids = ids[:int(query['limit'][0])]
+        items = [resources[i] for i in ids]
+        if 'fields' in query:
+            items = [dict((k, v) for k, v in item.items()
+                          if k in query['fields']) for item in items]
+        return 200, {collection: items}
+
+    def _post(self, collection, obj_id, query, obj):
+        resources = self.resources[collection]
+        if collection in obj:
+            items = obj[collection]
+        else:
+            items = [obj[collection[:-1]]]
+        if any(item['id'] in resources for item in items):
+            return 400, None
+        for item in items:
+            resources[item['id']] = item
+        return 201, obj
+
+    def _put(self, collection, obj_id, query, obj):
+        resources = self.resources[collection]
+        if obj_id not in resources:
+            return 404, None
+        resources[obj_id].update(obj[collection[:-1]])
+        return 200, {collection[:-1]: resources[obj_id]}
+
+    def _delete(self, collection, obj_id, query, obj):
+        if self.resources[collection].pop(obj_id, None) is None:
+            return 404, None
+        return 204, None
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # Keep connections open so that the client's pooling is exercised.
+    protocol_version = 'HTTP/1.1'
+
+    def _dispatch(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        status, headers, obj = self.server.odl.handle(
+            self.command, self.path, self.headers, body)
+        data = b''
+        if obj is not None:
+            data = jsonutils.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,481 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark the OpenDaylight drivers against a fake northbound server.
+
+Usage: python -m odldrivers.tests.benchmark.run [options] [scenario ...]
+
+Each scenario drives the ML2 mechanism driver or the L3 router plugin
+against an in-process FakeOpenDaylight and reports operations per second,
+p50/p99 latency, the requests the controller received and peak memory.
+Pass --json to save the results and --baseline to fail when throughput
+drops below a previous run.
+"""
+
+import argparse
+import collections
+import contextlib
+import copy
+import functools
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import eventlet
+import mock
+from oslo.config import cfg
+from oslo.serialization import jsonutils
+
+from neutron.common import exceptions as n_exc
+from neutron.extensions import l3
+
+from odldrivers.common import client as odl_client
+from odldrivers.l3 import l3_odl
+from odldrivers.ml2 import mech_driver
+from odldrivers.tests.benchmark import fake_odl
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+TENANT_ID = 'bench-tenant'
+SECURITY_GROUP_ID = 'bench-sg'
+
+Result = collections.namedtuple('Result', [
+    'scenario', 'ops', 'failures', 'seconds', 'ops_per_sec', 'p50', 'p99',
+    'requests', 'logins', 'errors', 'peak_memory'])
+
+
+def _id(kind, i):
+    return '%s-%08d' % (kind, i)
+
+
+def make_network(i):
+    return {'id': _id('net', i), 'name': 'net%d' % i, 'tenant_id': TENANT_ID,
+            'admin_state_up': True, 'shared': False, 'status': 'ACTIVE',
+            'subnets': [_id('subnet', i)], 'router:external': False,
+            'provider:network_type': 'vxlan',
+            'provider:physical_network': None,
+            'provider:segmentation_id': 1000 + i}
+
+
+def make_subnet(i):
+    return {'id': _id('subnet', i), 'name': 'subnet%d' % i,
+            'network_id': _id('net', i), 'tenant_id': TENANT_ID,
+            'ip_version': 4, 'cidr': '10.%d.%d.0/24' % (i // 256, i % 256),
+            'gateway_ip': '10.%d.%d.1' % (i // 256, i % 256),
+            'enable_dhcp': True, 'allocation_pools': [],
+            'dns_nameservers': [], 'host_routes': []}
+
+
+def make_port(i, network=0):
+    return {'id': _id('port', i), 'name': '',
+            'network_id': _id('net', network), 'tenant_id': TENANT_ID,
+            'admin_state_up': True, 'status': 'DOWN',
+            'mac_address': 'fa:16:3e:%02x:%02x:%02x' % (
+                i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff),
+            'fixed_ips': [{'subnet_id': _id('subnet', network),
+                           'ip_address': '10.0.%d.%d' % (i // 250,
+                                                         i % 250 + 2)}],
+            'device_id': _id('vm', i), 'device_owner': 'compute:nova',
+            'security_groups': [SECURITY_GROUP_ID]}
+
+
+def make_router(i):
+    return {'id': _id('router', i), 'name': 'router%d' % i,
+            'tenant_id': TENANT_ID, 'status': 'ACTIVE',
+            'admin_state_up': True, 'external_gateway_info': None}
+
+
+def make_floatingip(i):
+    return {'id': _id('fip', i), 'tenant_id': TENANT_ID, 'status': 'ACTIVE',
+            'floating_ip_address': '172.24.%d.%d' % (i // 250, i % 250 + 2),
+            'floating_network_id': _id('net', 0),
+            'router_id': _id('router', i), 'port_id': _id('port', i),
+            'fixed_ip_address': '10.0.%d.%d' % (i // 250, i % 250 + 2)}
+
+
+class FakeNeutronPlugin(object):
+
+    """Just enough of the core and L3 plugin API to feed the drivers."""
+
+    not_found = {'networks': (n_exc.NetworkNotFound, 'net_id'),
+                 'subnets': (n_exc.SubnetNotFound, 'subnet_id'),
+                 'ports': (n_exc.PortNotFound, 'port_id'),
+                 'routers': (l3.RouterNotFound, 'router_id'),
+                 'floatingips': (l3.FloatingIPNotFound, 'floatingip_id')}
+
+    def __init__(self):
+        self.objects = collections.defaultdict(dict)
+
+    def add(self, collection, obj):
+        self.objects[collection][obj['id']] = obj
+        return obj
+
+    def _list(self, collection, context, filters=None, fields=None,
+              sorts=None, limit=None, marker=None, page_reverse=False):
+        ids = sorted(self.objects[collection])
+        if marker:
+            ids = [i for i in ids if i > marker]
+        if limit:
+            ids = ids[:limit]
+        return [copy.deepcopy(self.objects[collection][i]) for i in ids]
+
+    def _get(self, collection, context, id, fields=None):
+        try:
+            return copy.deepcopy(self.objects[collection][id])
+        except KeyError:
+            exc, key = self.not_found[collection]
+            raise exc(**{key: id})
+
+    def __getattr__(self, name):
+        if name.startswith('get_'):
+            collection = name[len('get_'):]
+            if collection in self.not_found:
+                return functools.partial(self._list, collection)
+            if collection + 's' in self.not_found:
+                return functools.partial(self._get, collection + 's')
+        raise AttributeError(name)
+
+    def get_security_group(self, context, id, fields=None):
+        return {'id': id, 'name': 'default', 'tenant_id': TENANT_ID,
+                'security_group_rules': []}
+
+
+class FakeContext(object):
+
+    """The parts of an ML2 driver context the mechanism driver reads."""
+
+    def __init__(self, plugin, current):
+        self._plugin = plugin
+        self._plugin_context = None
+        self.current = current
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(percent / 100.0 * (len(values) - 1)))]
+
+
+@contextlib.contextmanager
+def record_requests(latencies):
+    """Append the latency of every HTTP request the client sends."""
+    send = odl_client.OpenDaylightRestClient._send
+
+    def timed_send(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return send(self, *args, **kwargs)
+        finally:
+            latencies.append(time.time() - start)
+
+    with mock.patch.object(odl_client.OpenDaylightRestClient, '_send',
+                           timed_send):
+        yield
+
+
+class Benchmark(object):
+
+    scenarios = ('port_burst', 'full_resync', 'warm_restart',
+                 'session_storm', 'l3_burst')
+
+    def __init__(self, args):
+        self.args = args
+
+    def _setup(self):
+        args = self.args
+        self.odl = fake_odl.FakeOpenDaylight(
+            latency=args.latency / 1000.0, error_rate=args.error_rate,
+            seed=args.seed).start()
+        self.tempdir = tempfile.mkdtemp()
+        overrides = {'url': self.odl.url, 'username': 'admin',
+                     'password': 'admin', 'journal_enabled': args.journal,
+                     'journal_path': os.path.join(self.tempdir, 'journal'),
+                     'snapshot_path': os.path.join(self.tempdir, 'snapshot'),
+                     'retry_backoff': 0.01}
+        for name, value in overrides.items():
+            cfg.CONF.set_override(name, value, 'odl_rest')
+        odl_client._client = None
+        self.plugin = FakeNeutronPlugin()
+        self.op_latencies = []
+        self.request_latencies = []
+        self.failures = 0
+        self.patchers = []
+
+    def _teardown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.odl.stop()
+        odl_client._client = None
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _op(self, func, *args):
+        start = time.time()
+        try:
+            func(*args)
+        except Exception:
+            self.failures += 1
+        self.op_latencies.append(time.time() - start)
+
+    def _drain(self, driver):
+        """Wait for the background resync and journal to send everything."""
+        def busy():
+            return (driver.out_of_sync or driver.resync.running or
+                    driver.dirty or driver.journal and driver.journal.size())
+
+        deadline = time.time() + self.args.timeout
+        while busy() and time.time() < deadline:
+            eventlet.sleep(0.01)
+
+    def _mech_driver(self):
+        # Journal workers look the core plugin up instead of being given it.
+        patcher = mock.patch.object(mech_driver.manager.NeutronManager,
+                                    'get_plugin', return_value=self.plugin)
+        patcher.start()
+        self.patchers.append(patcher)
+        mech = mech_driver.OpenDaylightMechanismDriver()
+        mech.initialize()
+        return mech
+
+    def _l3_plugin(self):
+        with mock.patch.object(l3_odl.OpenDaylightL3RouterPlugin,
+                               'setup_rpc'):
+            plugin = l3_odl.OpenDaylightL3RouterPlugin()
+        for name in ('get_router', 'get_routers', 'get_floatingip',
+                     'get_floatingips'):
+            setattr(plugin, name, getattr(self.plugin, name))
+        return plugin
+
+    def port_burst(self):
+        """Create count ports one after the other on a single network."""
+        mech = self._mech_driver()
+        self.plugin.add('subnets', make_subnet(0))
+        network = self.plugin.add('networks', make_network(0))
+        # The first change triggers the initial full sync; keep it out of
+        # the measurement.
+        mech.create_network_postcommit(FakeContext(self.plugin, network))
+        self._drain(mech)
+        self.op_latencies = []
+        start = time.time()
+        for i in range(self.args.count):
+            port = self.plugin.add('ports', make_port(i))
+            self._op(mech.create_port_postcommit,
+                     FakeContext(self.plugin, port))
+        self._drain(mech)
+        return self.args.count, time.time() - start
+
+    def full_resync(self):
+        """Push a large database to an empty controller."""
+        mech = self._mech_driver()
+        networks = max(self.args.count // 10, 1)
+        for i in range(networks):
+            self.plugin.add('networks', make_network(i))
+            self.plugin.add('subnets', make_subnet(i))
+        for i in range(self.args.count):
+            self.plugin.add('ports', make_port(i, i % networks))
+        start = time.time()
+        self._op(mech.sync_full, self.plugin, None)
+        return networks * 2 + self.args.count, time.time() - start
+
+    def warm_restart(self):
+        """Restart after a full resync with 1% of the ports changed."""
+        mech = self._mech_driver()
+        networks = max(self.args.count // 10, 1)
+        for i in range(networks):
+            self.plugin.add('networks', make_network(i))
+            self.plugin.add('subnets', make_subnet(i))
+        for i in range(self.args.count):
+            self.plugin.add('ports', make_port(i, i % networks))
+        mech.sync_full(self.plugin, None)
+        for i in range(0, self.args.count, 100):
+            self.plugin.objects['ports'][_id('port', i)]['name'] = 'changed'
+        mech = self._mech_driver()
+        mech.out_of_sync = True
+        # Only count what the restart costs.
+        del self.request_latencies[:]
+        self.odl.counts.clear()
+        start = time.time()
+        self._op(mech.sync_full, self.plugin, None)
+        return networks * 2 + self.args.count, time.time() - start
+
+    def session_storm(self):
+        """Expire every session while concurrent readers keep going."""
+        client = odl_client.get_client()
+        count = self.args.count
+        expire_every = max(count // 10, 1)
+        done = [0]
+
+        def reader():
+            while done[0] < count:
+                done[0] += 1
+                if done[0] % expire_every == 0:
+                    # A session timeout hits the controller and every
+                    # client-side deadline at the same moment.
+                    self.odl.expire_sessions()
+                    for member in client.members:
+                        member.auth.session_deadline = 0
+                self._op(client.sendjson, 'get', 'networks?limit=1', None)
+
+        pool = eventlet.GreenPool(self.args.concurrency)
+        start = time.time()
+        for i in range(self.args.concurrency):
+            pool.spawn_n(reader)
+        pool.waitall()
+        return count, time.time() - start
+
+    def l3_burst(self):
+        """Create count routers, then count floating IPs on them."""
+        plugin = self._l3_plugin()
+        # Get the initial full sync out of the way first.
+        plugin.synchronize('create', l3_odl.ROUTERS,
+                           self.plugin.add('routers', make_router(0))['id'])
+        self._drain(plugin)
+        self.op_latencies = []
+        start = time.time()
+        for i in range(1, self.args.count):
+            router = self.plugin.add('routers', make_router(i))
+            self._op(plugin.synchronize, 'create', l3_odl.ROUTERS,
+                     router['id'])
+        for i in range(self.args.count):
+            fip = self.plugin.add('floatingips', make_floatingip(i))
+            self._op(plugin.synchronize, 'create', l3_odl.FLOATINGIPS,
+                     fip['id'])
+        self._drain(plugin)
+        return self.args.count * 2 - 1, time.time() - start
+
+    def run(self, scenario):
+        self._setup()
+        try:
+            if tracemalloc:
+                tracemalloc.start()
+            with record_requests(self.request_latencies):
+                ops, seconds = getattr(self, scenario)()
+            if tracemalloc:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                # Without tracemalloc only the process high water mark is
+                # available, which never goes down between scenarios.
+                peak_memory = resource.getrusage(
+                    resource.RUSAGE_SELF).ru_maxrss * 1024
+        finally:
+            self._teardown()
+        latencies = self.op_latencies or self.request_latencies
+        counts = self.odl.counts
+        return Result(
+            scenario=scenario, ops=ops, failures=self.failures,
+            seconds=seconds, ops_per_sec=ops / seconds if seconds else 0.0,
+            p50=percentile(latencies, 50), p99=percentile(latencies, 99),
+            requests=dict((k, v) for k, v in counts.items() if ' ' in k),
+            logins=counts['login'], errors=counts['error'],
+            peak_memory=peak_memory)
+
+
+def print_results(results, out=sys.stdout):
+    out.write('%-14s %8s %6s %9s %10s %9s %9s %8s %7s %10s\n' % (
+        'scenario', 'ops', 'fail', 'seconds', 'ops/sec', 'p50 ms', 'p99 ms',
+        'requests', 'logins', 'peak KiB'))
+    for r in results:
+        out.write('%-14s %8d %6d %9.3f %10.1f %9.2f %9.2f %8d %7d %10d\n' % (
+            r.scenario, r.ops, r.failures, r.seconds, r.ops_per_sec,
+            r.p50 * 1000, r.p99 * 1000, sum(r.requests.values()), r.logins,
+            r.peak_memory // 1024))
+    for r in results:
+        out.write('\n%s requests:\n' % r.scenario)
+        for key in sorted(r.requests):
+            out.write('  %-24s %d\n' % (key, r.requests[key]))
+
+
+def check_baseline(results, baseline, tolerance, out=sys.stderr):
+    """Return False if any scenario got slower than baseline allows."""
+    previous = dict((r['scenario'], r) for r in baseline)
+    ok = True
+    for r in results:
+        if r.scenario not in previous:
+            continue
+        floor = previous[r.scenario]['ops_per_sec'] * (1 - tolerance)
+        if r.ops_per_sec < floor:
+            out.write('%s regressed: %.1f ops/sec, baseline %.1f\n' % (
+                r.scenario, r.ops_per_sec,
+                previous[r.scenario]['ops_per_sec']))
+            ok = False
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the OpenDaylight drivers against a fake '
+                    'OpenDaylight northbound server.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help='Scenarios to run: %s (default: all)' %
+                             ', '.join(Benchmark.scenarios))
+    parser.add_argument('--count', type=int, default=1000,
+                        help='Objects or requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help='Concurrent readers in session_storm')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Controller latency per request, in ms')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of requests failing with a 503')
+    parser.add_argument('--journal', action='store_true',
+                        help='Send changes through the journal')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='Seconds to wait for the journal to drain')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the injected errors')
+    parser.add_argument('--json', metavar='FILE',
+                        help='Write the results to FILE as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='Fail if ops/sec drops below a previous --json')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed fractional drop against --baseline')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log driver warnings')
+    args = parser.parse_args(argv)
+    for scenario in args.scenarios:
+        if scenario not in Benchmark.scenarios:
+            parser.error('unknown scenario %s' % scenario)
+
+    # neutron-server runs the drivers monkey patched, so measure them so.
+    eventlet.monkey_patch()
+    logging.basicConfig(
+        level=logging.WARNING if args.verbose else logging.CRITICAL)
+    cfg.CONF(args=[], default_config_files=[])
+
+    benchmark = Benchmark(args)
+    results = [benchmark.run(scenario)
+               for scenario in args.scenarios or Benchmark.scenarios]
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(jsonutils.dumps([r._asdict() for r in results],
+                                    indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = jsonutils.loads(f.read())
+        if not check_baseline(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import six
+
+from neutron.tests import base
+
+from odldrivers.cmd import audit
+from odldrivers.common import sync
+
+
+class AuditTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(AuditTestCase, self).setUp()
+        self.repaired = []
+        self.networks = self._collection('networks', [
+            ('n1', sync.MISSING), ('n2', sync.EXTRA)])
+        self.ports = self._collection('ports', [
+            ('p1', sync.DIVERGENT), ('p2', sync.EXTRA)])
+        self.out = six.StringIO()
+
+    def _collection(self, object_type, differences):
+        def repair(obj_id):
+            self.repaired.append(obj_id)
+        return audit.Collection(object_type, lambda: iter(differences),
+                                repair)
+
+    def test_differences_reported(self):
+        auditor = audit.Audit([self.networks, self.ports], out=self.out)
+        self.assertFalse(auditor.run())
+        self.assertEqual([], self.repaired)
+        lines = self.out.getvalue().splitlines()
+        self.assertIn('networks n1 missing', lines)
+        self.assertIn('ports p1 divergent', lines)
+        self.assertEqual({'missing': 1, 'extra': 1, 'divergent': 0,
+                          'repaired': 0, 'failed': 0},
+                         auditor.counts['networks'])
+
+    def test_repair_pushes_parents_first_and_deletes_children_first(self):
+        auditor = audit.Audit([self.networks, self.ports], repair=True,
+                              out=self.out)
+        self.assertTrue(auditor.run())
+        self.assertEqual(['n1', 'p1', 'p2', 'n2'], self.repaired)
+
+    def test_failed_repair_counted(self):
+        ports = self.ports._replace(repair=mock.Mock(
+            side_effect=[None, Exception('boom')]))
+        auditor = audit.Audit([ports], repair=True, repair_workers=1,
+                              out=self.out)
+        self.assertFalse(auditor.run())
+        self.assertEqual(1, auditor.counts['ports']['failed'])
+
+    def test_in_sync(self):
+        auditor = audit.Audit([self._collection('ports', [])], out=self.out)
+        self.assertTrue(auditor.run())
+
+
+class GetCollectionsTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(GetCollectionsTestCase, self).setUp()
+        self.manager = mock.patch.object(audit.manager,
+                                         'NeutronManager').start()
+        self.l3_plugin = mock.patch.object(
+            audit.l3_odl, 'OpenDaylightL3RouterPlugin').start()
+        self.addCleanup(mock.patch.stopall)
+        audit.cfg.CONF.set_override('service_plugins',
+                                    ['odl-router', 'firewall'])
+
+    def test_l3_plugin_built_without_rpc(self):
+        collections = audit.get_collections('ctx')
+        self.assertEqual(['routers', 'floatingips'],
+                         [c.object_type for c in collections])
+        self.l3_plugin.assert_called_once_with(rpc=False)
+        self.assertFalse(self.manager.get_service_plugins.called)
+        self.assertEqual([], audit.cfg.CONF.service_plugins)
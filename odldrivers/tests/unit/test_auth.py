@@ -0,0 +1,86 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+import mock
+from oslo.config import cfg
+import requests
+
+from neutron.tests import base
+
+from odldrivers.common import auth
+
+
+class JsessionIdTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(JsessionIdTestCase, self).setUp()
+        self.session = mock.Mock()
+        response = self.session.get.return_value
+        response.cookies = {'JSESSIONID': 'id', 'JSESSIONIDSSO': 'sso'}
+        self.auth = auth.JsessionId('http://127.0.0.1:9999', 'someuser',
+                                    'somepass', 30, probe_path='probe',
+                                    request_timeout=10,
+                                    get_session=lambda: self.session)
+
+    def test_probe_uses_pooled_session(self):
+        self.auth.obtain_auth_cookies()
+        self.session.get.assert_called_once_with(
+            'http://127.0.0.1:9999/probe', auth=('someuser', 'somepass'),
+            timeout=10)
+        self.assertEqual({'JSESSIONID': 'id', 'JSESSIONIDSSO': 'sso'},
+                         self.auth.auth_cookies)
+        self.assertGreater(self.auth.session_deadline, time.time())
+
+    def test_default_probe_path_matches_option(self):
+        jsession = auth.JsessionId('http://127.0.0.1:9999', 'someuser',
+                                   'somepass', 30)
+        self.assertEqual('http://127.0.0.1:9999/' +
+                         cfg.CONF.odl_rest.auth_probe_path, jsession.url)
+
+    def test_concurrent_refresh_is_single_flight(self):
+        get = self.session.get
+        self.session.get = mock.Mock(
+            side_effect=lambda *a, **kw: time.sleep(0.1) or get.return_value)
+        threads = [threading.Thread(target=self.auth, args=(mock.Mock(),))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.session.get.call_count)
+
+    def test_caller_behind_finished_refresh_reuses_cookies(self):
+        generation = self.auth._generation
+        self.auth.obtain_auth_cookies(generation)
+        self.auth.obtain_auth_cookies(generation)
+        self.assertEqual(1, self.session.get.call_count)
+
+    def test_valid_session_not_refreshed(self):
+        request = mock.Mock()
+        self.auth(request)
+        self.auth(request)
+        self.assertEqual(1, self.session.get.call_count)
+        request.prepare_cookies.assert_called_with(self.auth.auth_cookies)
+
+    def test_stale_session_cookie_replaced(self):
+        request = requests.Request(
+            'GET', 'http://127.0.0.1:9999/networks',
+            cookies={'JSESSIONID': 'stale'}).prepare()
+        self.auth(request)
+        self.assertEqual(['JSESSIONID=id', 'JSESSIONIDSSO=sso'],
+                         sorted(request.headers['Cookie'].split('; ')))
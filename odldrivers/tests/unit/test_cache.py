@@ -0,0 +1,72 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.tests import base
+
+from odldrivers.common import cache
+
+
+class TTLCacheTestCase(base.BaseTestCase):
+
+    def test_get_or_load_loads_once(self):
+        c = cache.TTLCache(10, 0)
+        loader = mock.Mock(return_value='sg')
+        self.assertEqual('sg', c.get_or_load('a', loader))
+        self.assertEqual('sg', c.get_or_load('a', loader))
+        loader.assert_called_once_with()
+
+    def test_least_recently_used_evicted(self):
+        c = cache.TTLCache(2, 0)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')
+        c.set('c', 3)
+        self.assertEqual(1, c.get('a'))
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(2, len(c))
+
+    @mock.patch('time.time')
+    def test_entries_expire(self, time):
+        c = cache.TTLCache(10, 60)
+        time.return_value = 100
+        c.set('a', 1)
+        time.return_value = 159
+        self.assertEqual(1, c.get('a'))
+        time.return_value = 161
+        self.assertIsNone(c.get('a'))
+
+    def test_invalidate(self):
+        c = cache.TTLCache(10, 0)
+        c.set('a', 1)
+        c.invalidate('a')
+        self.assertIsNone(c.get('a'))
+
+    def test_value_loaded_across_invalidate_not_cached(self):
+        c = cache.TTLCache(10, 0)
+
+        def loader():
+            c.invalidate('a')
+            return 'stale'
+
+        self.assertEqual('stale', c.get_or_load('a', loader))
+        self.assertEqual('fresh', c.get_or_load('a', lambda: 'fresh'))
+        self.assertEqual('fresh', c.get('a'))
+
+    def test_zero_size_disables_cache(self):
+        c = cache.TTLCache(0, 0)
+        c.set('a', 1)
+        self.assertIsNone(c.get('a'))
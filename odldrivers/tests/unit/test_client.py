@@ -0,0 +1,301 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import gzip
+import io
+
+import mock
+
+from oslo.config import cfg
+import requests
+
+from neutron.tests import base
+
+from odldrivers.common import client as odl_client
+from odldrivers.common import exceptions as odl_exc
+from odldrivers.common import metrics
+from odldrivers.tests.benchmark import fake_odl
+
+
+class OpenDaylightRestClientTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(OpenDaylightRestClientTestCase, self).setUp()
+        cfg.CONF.set_override('url', 'http://127.0.0.1:9999', 'odl_rest')
+        cfg.CONF.set_override('username', 'someuser', 'odl_rest')
+        cfg.CONF.set_override('password', 'somepass', 'odl_rest')
+        self.client = odl_client.OpenDaylightRestClient(
+            'http://127.0.0.1:9999', 'someuser', 'somepass', 10, 30,
+            pool_idle_timeout=60)
+
+    def test_get_client_is_shared(self):
+        odl_client._client = None
+        self.addCleanup(setattr, odl_client, '_client', None)
+        self.assertIs(odl_client.get_client(), odl_client.get_client())
+
+    def test_session_is_reused(self):
+        self.assertIs(self.client.session, self.client.session)
+
+    def test_idle_session_is_recycled(self):
+        first = self.client.session
+        self.client._last_used -= 61
+        self.assertIsNot(first, self.client.session)
+
+    def test_sendjson_uses_pooled_session(self):
+        with mock.patch.object(self.client.session, 'request') as request:
+            request.return_value.status_code = 200
+            self.client.sendjson('get', 'networks', None)
+            request.assert_called_once_with(
+                'get', url='http://127.0.0.1:9999/networks',
+                headers={'Content-Type': 'application/json'}, data=None,
+                auth=self.client.members[0].auth, timeout=10)
+
+    def _sent(self, obj):
+        with mock.patch.object(self.client.session, 'request') as request:
+            request.return_value.status_code = 200
+            self.client.sendjson('post', 'networks', obj)
+            kwargs = request.call_args[1]
+            return kwargs['data'], kwargs['headers']
+
+    def test_sendjson_compact(self):
+        data, headers = self._sent({'network': {'id': 'a'}})
+        self.assertEqual(b'{"network": {"id": "a"}}', data)
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_sendjson_compresses_large_bodies(self):
+        self.client.compress_threshold = 10
+        data, headers = self._sent({'network': {'id': 'a'}})
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual(b'{"network": {"id": "a"}}',
+                         gzip.GzipFile(fileobj=io.BytesIO(data)).read())
+
+    def test_sendjson_records_metrics(self):
+        self.client.metrics = metrics.MemorySink()
+        with mock.patch.object(self.client.session, 'request') as request:
+            request.return_value.status_code = 201
+            request.return_value.content = b'{}'
+            self.client.sendjson('post', 'ports', {'port': {'id': 'a'}})
+        sink = self.client.metrics
+        self.assertEqual(1, len(sink.timings['request.ports.post']))
+        self.assertEqual(1, len(sink.timings['encode.ports']))
+        self.assertEqual(1, sink.counters['request.ports.post.status.201'])
+        self.assertEqual(21, sink.counters['request.ports.post.bytes_sent'])
+        self.assertEqual(2,
+                         sink.counters['request.ports.post.bytes_received'])
+
+    def test_missing_json_encoder_falls_back(self):
+        self.assertIs(odl_client.jsonutils.dumps,
+                      odl_client.load_json_encoder('no_such_json_module'))
+
+    def test_unknown_backend_falls_back(self):
+        client = odl_client.OpenDaylightRestClient(
+            'http://127.0.0.1:9999', 'someuser', 'somepass', 10, 30,
+            backend='twisted')
+        self.assertEqual('requests', client.backend)
+        self.assertIsInstance(client.session.get_adapter(client.url),
+                              requests.adapters.HTTPAdapter)
+
+    def _page(self, *ids):
+        response = mock.Mock()
+        response.json.return_value = {'networks': [{'id': i} for i in ids]}
+        return response
+
+    def test_list_collection_follows_markers(self):
+        with mock.patch.object(self.client, 'sendjson') as sendjson:
+            sendjson.side_effect = [self._page('a', 'b'),
+                                    self._page('c', 'd'),
+                                    self._page('e')]
+            ids = [n['id'] for n in
+                   self.client.list_collection('networks', 2, ['id'])]
+            self.assertEqual(['a', 'b', 'c', 'd', 'e'], ids)
+            sendjson.assert_has_calls([
+                mock.call('get', 'networks?fields=id&limit=2', None),
+                mock.call('get', 'networks?fields=id&limit=2&marker=b', None),
+                mock.call('get', 'networks?fields=id&limit=2&marker=d', None)])
+
+    def test_list_collection_stops_when_limit_is_ignored(self):
+        with mock.patch.object(self.client, 'sendjson') as sendjson:
+            sendjson.return_value = self._page('a', 'b')
+            ids = [n['id'] for n in self.client.list_collection('networks', 2)]
+            self.assertEqual(['a', 'b'], ids)
+            self.assertEqual(2, sendjson.call_count)
+
+    def test_list_collection_nested_path(self):
+        with mock.patch.object(self.client, 'sendjson') as sendjson:
+            sendjson.return_value.json.return_value = {'pools': [{'id': 'a'}]}
+            self.assertEqual([{'id': 'a'}],
+                             list(self.client.list_collection('lbaas/pools')))
+            sendjson.assert_called_once_with('get', 'lbaas/pools', None)
+
+    def test_bulk_post_nested_path(self):
+        with mock.patch.object(self.client, 'sendjson') as sendjson:
+            self.client.bulk_post('lbaas/members', 'member',
+                                  [{'id': 'a'}, {'id': 'b'}], 2, 1)
+            sendjson.assert_called_once_with(
+                'post', 'lbaas/members',
+                {'members': [{'id': 'a'}, {'id': 'b'}]}, [])
+
+    def test_bulk_post_retries_failed_batch_individually(self):
+        def sendjson(method, urlpath, obj, ignorecodes=[]):
+            if obj.get('networks') or obj['network']['id'] == 'c':
+                raise Exception('boom')
+
+        resources = [{'id': i} for i in 'abcde']
+        with mock.patch.object(self.client, 'sendjson',
+                               side_effect=sendjson) as send:
+            results = self.client.bulk_post('networks', 'network',
+                                            resources, 2, 2)
+            self.assertEqual([(0, 2, []), (1, 2, ['c']), (2, 1, [])],
+                             sorted(results))
+            self.assertEqual(7, send.call_count)
+
+    def test_bulk_post_with_existing_object_creates_the_rest(self):
+        odl = fake_odl.FakeOpenDaylight().start()
+        self.addCleanup(odl.stop)
+        client = odl_client.OpenDaylightRestClient(odl.url, 'admin', 'admin',
+                                                   10, 30)
+        client.sendjson('post', 'floatingips', {'floatingip': {'id': 'f1'}})
+        results = client.bulk_post(
+            'floatingips', 'floatingip',
+            [{'id': 'f1'}, {'id': 'f2'}, {'id': 'f3'}], 3, 1, [400])
+        self.assertEqual([(0, 3, [])], results)
+        self.assertEqual(set(['f1', 'f2', 'f3']),
+                         set(odl.resources['floatingips']))
+
+
+class OpenDaylightRestClientRetryTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(OpenDaylightRestClientRetryTestCase, self).setUp()
+        self.client = odl_client.OpenDaylightRestClient(
+            'http://127.0.0.1:9999', 'someuser', 'somepass', 10, 30,
+            retry_count=2, retry_backoff=0,
+            circuit_failure_threshold=3, circuit_reset_timeout=30)
+        self.breaker = self.client.members[0].breaker
+        self.request = mock.patch.object(self.client.session,
+                                         'request').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _response(self, status_code):
+        response = mock.Mock(status_code=status_code, content=b'')
+        if status_code >= 400:
+            error = requests.exceptions.HTTPError(response=response)
+            response.raise_for_status.side_effect = error
+        return response
+
+    def test_idempotent_request_retried(self):
+        self.request.side_effect = [requests.exceptions.Timeout(),
+                                    self._response(503),
+                                    self._response(200)]
+        self.client.sendjson('put', 'networks/a', {'network': {}})
+        self.assertEqual(3, self.request.call_count)
+        self.assertFalse(self.breaker.is_open)
+
+    def test_post_not_retried(self):
+        self.request.return_value = self._response(503)
+        self.assertRaises(requests.exceptions.HTTPError,
+                          self.client.sendjson, 'post', 'networks',
+                          {'network': {}})
+        self.assertEqual(1, self.request.call_count)
+
+    def test_circuit_opens_and_fails_fast(self):
+        self.request.side_effect = requests.exceptions.ConnectionError()
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.client.sendjson, 'get', 'networks', None)
+        self.assertEqual(3, self.request.call_count)
+        self.assertTrue(self.breaker.is_open)
+        self.request.reset_mock()
+        self.assertRaises(odl_exc.OpendaylightUnavailable,
+                          self.client.sendjson, 'get', 'networks', None)
+        self.assertFalse(self.request.called)
+
+    def test_circuit_closes_after_trial_raising_other_error(self):
+        self.request.side_effect = requests.exceptions.ConnectionError()
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.client.sendjson, 'get', 'networks', None)
+        self.breaker.opened_at -= 31
+        self.request.side_effect = odl_exc.OpendaylightAuthError(msg='boom')
+        self.assertRaises(odl_exc.OpendaylightAuthError,
+                          self.client.sendjson, 'get', 'networks', None)
+        self.breaker.opened_at -= 31
+        self.request.side_effect = None
+        self.request.return_value = self._response(200)
+        self.client.sendjson('get', 'networks', None)
+        self.assertFalse(self.breaker.is_open)
+
+    @mock.patch('time.time')
+    def test_circuit_half_open_trial(self, time):
+        time.return_value = 100
+        breaker = odl_client.CircuitBreaker(1, 30)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.return_value = 131
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+
+
+class OpenDaylightRestClientClusterTestCase(base.BaseTestCase):
+
+    urls = ['http://10.0.0.1:8080', 'http://10.0.0.2:8080']
+
+    def setUp(self):
+        super(OpenDaylightRestClientClusterTestCase, self).setUp()
+        self.client = odl_client.OpenDaylightRestClient(
+            None, 'someuser', 'somepass', 10, 30, cluster_urls=self.urls,
+            retry_backoff=0, circuit_failure_threshold=1,
+            circuit_reset_timeout=30)
+        self.request = mock.patch.object(self.client.session,
+                                         'request').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _urls(self):
+        return [c[1]['url'] for c in self.request.call_args_list]
+
+    @mock.patch('time.time', return_value=100)
+    def test_requests_are_spread(self, time):
+        self.request.return_value.status_code = 200
+        for i in range(4):
+            self.client.sendjson('get', 'networks', None)
+        urls = self._urls()
+        for url in self.urls:
+            self.assertEqual(2, urls.count(url + '/networks'))
+
+    def test_slow_member_is_avoided(self):
+        self.request.return_value.status_code = 200
+        self.client.members[0].latency = 2.0
+        self.client.members[1].latency = 0.1
+        self.client.sendjson('get', 'networks', None)
+        self.assertEqual(['http://10.0.0.2:8080/networks'], self._urls())
+
+    def test_post_fails_over_on_connection_error(self):
+        response = mock.Mock(status_code=201, content=b'')
+        self.request.side_effect = [requests.exceptions.ConnectionError(),
+                                    response]
+        self.assertIs(response, self.client.sendjson('post', 'networks',
+                                                     {'network': {}}))
+        self.assertEqual(['http://10.0.0.1:8080/networks',
+                          'http://10.0.0.2:8080/networks'], self._urls())
+        self.assertTrue(self.client.members[0].breaker.is_open)
+
+    def test_unavailable_when_every_member_is_down(self):
+        self.request.side_effect = requests.exceptions.ConnectionError()
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.client.sendjson, 'get', 'networks', None)
+        self.request.reset_mock()
+        self.assertRaises(odl_exc.OpendaylightUnavailable,
+                          self.client.sendjson, 'get', 'networks', None)
+        self.assertFalse(self.request.called)
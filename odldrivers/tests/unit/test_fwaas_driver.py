@@ -0,0 +1,128 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.tests import base
+
+from odldrivers.common import client as odl_client
+from odldrivers.fwaas import driver
+
+
+class OpenDaylightFwaasDriverTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(OpenDaylightFwaasDriverTestCase, self).setUp()
+        self.client = mock.patch.object(driver.odl_client,
+                                        'get_client').start().return_value
+        self.client.bulk_post.return_value = []
+        self.addCleanup(mock.patch.stopall)
+        self.driver = driver.OpenDaylightFwaasDriver()
+        self.rules = [self._rule(i) for i in range(1, 1001)]
+        self.firewall = {'id': 'fw1', 'tenant_id': 't1', 'status': 'ACTIVE',
+                         'firewall_rule_list': self.rules}
+        self.driver.create_firewall([], self.firewall)
+        self.client.reset_mock()
+
+    def _rule(self, i, action='allow'):
+        return {'id': 'r%d' % i, 'position': i, 'protocol': 'tcp',
+                'destination_port': str(i), 'action': action,
+                'enabled': True}
+
+    def _calls(self, method):
+        return [c[0][1] for c in self.client.sendjson.call_args_list
+                if c[0][0] == method]
+
+    def test_create_sends_rules_in_bulk(self):
+        self.client.reset_mock()
+        self.driver.create_firewall([], dict(self.firewall, id='fw2'))
+        args = self.client.bulk_post.call_args[0]
+        self.assertEqual(('fw/firewall_rules', 'firewall_rule'), args[:2])
+        self.assertEqual(1000, len(args[2]))
+        self.assertEqual({'id': 'fw2_r1', 'protocol': 'tcp',
+                          'destination_port': '1', 'action': 'allow',
+                          'firewall_id': 'fw2'}, args[2][0])
+        self.assertEqual(['fw/firewalls'], self._calls('post'))
+        put = self.client.sendjson.call_args[0][2]['firewall']
+        self.assertEqual(['fw2_r%d' % i for i in range(1, 1001)],
+                         put['firewall_rules'])
+        self.assertNotIn('firewall_rule_list', put)
+
+    def test_firewalls_sharing_a_policy_keep_their_own_rules(self):
+        self.driver.create_firewall([], dict(self.firewall, id='fw2'))
+        self.client.reset_mock()
+        self.client.sendjson.return_value = None
+        self.client.list_collection.return_value = []
+        self.driver.delete_firewall([], self.firewall)
+        deleted = self._calls('delete')
+        self.assertEqual(1001, len(deleted))
+        self.assertTrue(all(path.startswith('fw/firewall_rules/fw1_')
+                            for path in deleted[:-1]))
+        self.assertEqual('fw/firewalls/fw1', deleted[-1])
+        self.assertIn('fw2', self.driver.rule_index)
+
+    def test_unchanged_policy_sends_nothing(self):
+        self.driver.update_firewall([], self.firewall)
+        self.assertFalse(self.client.sendjson.called)
+        self.assertFalse(self.client.bulk_post.called)
+
+    def test_update_sends_only_the_delta(self):
+        self.rules[10] = self._rule(11, action='deny')
+        del self.rules[20]
+        self.rules.append(self._rule(1001))
+        self.driver.update_firewall([], self.firewall)
+        self.assertEqual(['fw1_r1001'],
+                         [r['id'] for r in
+                          self.client.bulk_post.call_args[0][2]])
+        self.assertEqual(['fw/firewall_rules/fw1_r11', 'fw/firewalls/fw1'],
+                         sorted(self._calls('put')))
+        self.assertEqual(['fw/firewall_rules/fw1_r21'],
+                         self._calls('delete'))
+
+    def test_reorder_only_updates_firewall(self):
+        self.rules[0]['position'], self.rules[1]['position'] = 2, 1
+        self.driver.update_firewall([], self.firewall)
+        self.assertEqual(['fw/firewalls/fw1'], self._calls('put'))
+        self.assertFalse(self.client.bulk_post.called)
+
+    def test_default_policy_removes_every_rule(self):
+        self.driver.apply_default_policy([], self.firewall)
+        self.assertEqual(1000, len(self._calls('delete')))
+
+    def test_failed_bulk_create_raises_and_reloads_index(self):
+        self.client.bulk_post.return_value = [
+            odl_client.BatchResult(0, 1, ['r1001'])]
+        self.rules.append(self._rule(1001))
+        self.assertRaises(driver.fw_ext.FirewallInternalDriverError,
+                          self.driver.update_firewall, [], self.firewall)
+        self.assertNotIn('fw1', self.driver.rule_index)
+
+    def test_index_rebuilt_from_odl(self):
+        self.driver.rule_index.clear()
+        odl_rules = [self.driver._rule_payload(self.firewall, r)
+                     for r in self.rules[:2]]
+        # Another firewall's copy of a rule, from a controller which
+        # ignores the filter.
+        odl_rules.append(dict(odl_rules[0], id='fw2_r1', firewall_id='fw2'))
+        self.client.list_collection.return_value = odl_rules
+        self.client.sendjson.return_value.json.return_value = {
+            'firewall': {'id': 'fw1', 'firewall_rules': ['fw1_r1', 'fw1_r2']}}
+        self.firewall['firewall_rule_list'] = self.rules[:3]
+        self.driver.update_firewall([], self.firewall)
+        self.assertEqual(['fw1_r3'], [r['id'] for r in
+                                      self.client.bulk_post.call_args[0][2]])
+        self.assertEqual([], self._calls('delete'))
+        self.client.list_collection.assert_called_once_with(
+            'fw/firewall_rules', 1000, filters={'firewall_id': 'fw1'})
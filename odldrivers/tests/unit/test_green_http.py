@@ -0,0 +1,118 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+import ssl
+
+import eventlet
+import mock
+import requests
+
+from neutron.tests import base
+
+from odldrivers.common import client as odl_client
+from odldrivers.common import green_http
+from odldrivers.tests.benchmark import fake_odl
+
+
+class GreenHTTPAdapterTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(GreenHTTPAdapterTestCase, self).setUp()
+        self.odl = fake_odl.FakeOpenDaylight().start()
+        self.addCleanup(self.odl.stop)
+        self.client = odl_client.OpenDaylightRestClient(
+            self.odl.url, 'admin', 'admin', 10, 30, pool_maxsize=2,
+            backend='eventlet')
+
+    def _adapter(self):
+        return self.client.session.get_adapter(self.odl.url)
+
+    def test_sendjson_through_green_adapter(self):
+        self.assertIsInstance(self._adapter(), green_http.GreenHTTPAdapter)
+        self.client.sendjson('post', 'networks', {'network': {'id': 'n1'}})
+        r = self.client.sendjson('get', 'networks/n1', None)
+        self.assertEqual({'network': {'id': 'n1'}}, r.json())
+        self.assertIsNone(self.client.sendjson('get', 'networks/n2', None,
+                                               [404]))
+        self.assertEqual(1, self.odl.counts['login'])
+
+    def test_many_green_threads_share_the_pool(self):
+        self.odl.latency = 0.01
+        pool = eventlet.GreenPool(50)
+        for i in range(50):
+            pool.spawn_n(self.client.sendjson, 'post', 'networks',
+                         {'network': {'id': 'n%d' % i}})
+        pool.waitall()
+        self.assertEqual(50, len(self.odl.resources['networks']))
+        for conn_pool in self._adapter().pools.values():
+            self.assertLessEqual(conn_pool.current_size, 2)
+
+    def test_stale_connection_is_replaced(self):
+        self.client.sendjson('get', 'networks', None)
+        for conn_pool in self._adapter().pools.values():
+            for conn in conn_pool.free_items:
+                conn.sock.close()
+        self.client.sendjson('get', 'networks', None)
+
+    def test_errors_map_to_requests_exceptions(self):
+        adapter = green_http.GreenHTTPAdapter()
+        request = requests.Request('GET', self.odl.url + '/networks').prepare()
+        with mock.patch.object(green_http.httplib.HTTPConnection, 'request',
+                               side_effect=socket.timeout()):
+            self.assertRaises(requests.exceptions.Timeout, adapter.send,
+                              request, timeout=1)
+        with mock.patch.object(green_http.httplib.HTTPConnection, 'request',
+                               side_effect=socket.error()):
+            self.assertRaises(requests.exceptions.ConnectionError,
+                              adapter.send, request, timeout=1)
+
+    def _failing_after_write(self, method):
+        adapter = self._adapter()
+        self.client.sendjson('get', 'networks', None)
+        request = requests.Request(method, self.odl.url + '/networks',
+                                   data='{}').prepare()
+        with mock.patch.object(green_http.httplib.HTTPConnection,
+                               'getresponse',
+                               side_effect=green_http.httplib.BadStatusLine(
+                                   '')) as getresponse:
+            self.assertRaises(requests.exceptions.ConnectionError,
+                              adapter.send, request, timeout=1)
+        return getresponse.call_count
+
+    def test_post_not_sent_again_after_write(self):
+        self.assertEqual(1, self._failing_after_write('POST'))
+
+    def test_put_sent_again_after_write(self):
+        self.assertEqual(2, self._failing_after_write('PUT'))
+
+    def test_proxies_rejected(self):
+        request = requests.Request('GET', self.odl.url + '/networks').prepare()
+        self.assertRaises(requests.exceptions.RequestException,
+                          self._adapter().send, request, timeout=1,
+                          proxies={'http': 'http://proxy:3128'})
+
+    def test_https_verify_and_cert_honored(self):
+        adapter = green_http.GreenHTTPAdapter()
+        url = green_http.urlparse.urlsplit('https://odl:8443/networks')
+        pool = adapter._pool(url, False, None)
+        self.assertEqual(ssl.CERT_NONE, pool.context.verify_mode)
+        with mock.patch.object(ssl, 'create_default_context') as create:
+            pool = adapter._pool(url, '/etc/odl/ca.pem',
+                                 ('client.pem', 'client.key'))
+        create.assert_called_once_with(cafile='/etc/odl/ca.pem')
+        create.return_value.load_cert_chain.assert_called_once_with(
+            'client.pem', 'client.key')
+        self.assertIs(create.return_value, pool.context)
@@ -0,0 +1,222 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import mock
+
+from neutron.tests import base
+
+from odldrivers.common import exceptions as odl_exc
+from odldrivers.common import journal
+
+
+class JournalTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(JournalTestCase, self).setUp()
+        self.handler = mock.Mock()
+        self.on_failure = mock.Mock()
+        self.journal = journal.Journal(':memory:', ('networks', 'ports'),
+                                       self.handler, self.on_failure,
+                                       max_retries=1, retry_interval=0)
+        # Drive the journal by hand rather than from worker threads.
+        self.journal.start = mock.Mock()
+
+    def _drain(self):
+        while self.journal.dispatch_one():
+            pass
+
+    def _dispatched(self):
+        return [(c[0][0].object_id, c[0][0].operation)
+                for c in self.handler.call_args_list]
+
+    def test_record_starts_workers(self):
+        self.journal.record('networks', 'net1', 'create')
+        self.journal.start.assert_called_once_with()
+        self.assertEqual(1, self.journal.size())
+
+    def test_entries_dispatched_in_order(self):
+        self.journal.record('networks', 'net1', 'delete')
+        self.journal.record('ports', 'port1', 'create')
+        self.journal.record('networks', 'net1', 'create')
+        self._drain()
+        self.assertEqual([('net1', 'delete'), ('port1', 'create'),
+                          ('net1', 'create')], self._dispatched())
+
+    def test_object_blocked_while_older_entry_in_flight(self):
+        self.journal.record('networks', 'net1', 'create')
+        first = self.journal.claim()
+        self.assertEqual('net1', first.object_id)
+        self.journal.record('networks', 'net1', 'update')
+        self.journal.record('ports', 'port1', 'create')
+        second = self.journal.claim()
+        self.assertEqual('port1', second.object_id)
+        self.assertIsNone(self.journal.claim())
+        self.journal.complete(first)
+        self.assertEqual(('net1', 'update'), self.journal.claim()[2:4])
+
+    def test_other_object_types_ignored(self):
+        self.journal.record('routers', 'router1', 'create')
+        self.assertIsNone(self.journal.claim())
+        self.assertEqual(0, self.journal.size())
+
+    def test_failed_entry_retried_then_dropped(self):
+        self.handler.side_effect = Exception('boom')
+        self.journal.record('networks', 'net1', 'create')
+        self._drain()
+        self.assertEqual(2, self.handler.call_count)
+        self.assertEqual('net1', self.on_failure.call_args[0][0].object_id)
+        self.assertIsNone(self.journal.claim())
+
+    def test_create_update_coalesced_into_create(self):
+        self.journal.record('ports', 'port1', 'create')
+        self.journal.record('ports', 'port1', 'update')
+        self.journal.record('ports', 'port1', 'update')
+        self._drain()
+        self.assertEqual([('port1', 'create')], self._dispatched())
+
+    def test_update_update_coalesced(self):
+        self.journal.record('ports', 'port1', 'update')
+        self.journal.record('ports', 'port1', 'update')
+        self._drain()
+        self.assertEqual([('port1', 'update')], self._dispatched())
+
+    def test_update_data_merged(self):
+        self.journal.record('ports', 'port1', 'update', {'name': 'a'})
+        self.journal.record('ports', 'port1', 'update',
+                            {'name': 'b', 'admin_state_up': False})
+        self._drain()
+        self.assertEqual({'name': 'b', 'admin_state_up': False},
+                         self.handler.call_args[0][0].data)
+
+    def test_update_without_data_drops_data(self):
+        self.journal.record('ports', 'port1', 'update', {'name': 'a'})
+        self.journal.record('ports', 'port1', 'update')
+        self._drain()
+        self.assertIsNone(self.handler.call_args[0][0].data)
+
+    def test_create_delete_cancel_out(self):
+        self.journal.record('ports', 'port1', 'create')
+        self.journal.record('ports', 'port1', 'update')
+        self.journal.record('ports', 'port1', 'delete')
+        self._drain()
+        self.assertEqual([], self._dispatched())
+
+    def test_update_delete_coalesced_into_delete(self):
+        self.journal.record('ports', 'port1', 'update')
+        self.journal.record('ports', 'port1', 'delete')
+        self._drain()
+        self.assertEqual([('port1', 'delete')], self._dispatched())
+
+    def test_entry_in_flight_not_coalesced(self):
+        self.journal.record('ports', 'port1', 'create')
+        entry = self.journal.claim()
+        self.journal.record('ports', 'port1', 'update')
+        self.journal.complete(entry)
+        self._drain()
+        self.assertEqual([('port1', 'update')], self._dispatched())
+
+    def test_unavailable_controller_keeps_entry_and_retries(self):
+        self.handler.side_effect = odl_exc.OpendaylightUnavailable(url='x')
+        self.journal.record('ports', 'port1', 'create')
+        self.journal.dispatch_one()
+        entry = self.journal.claim()
+        self.assertEqual(('port1', 0), (entry.object_id, entry.retry_count))
+        self.assertGreater(self.journal._paused_until, 0)
+        self.assertFalse(self.on_failure.called)
+
+    def _batched(self, failed=()):
+        batches = []
+
+        def batch_handler(entries):
+            batches.append([e.object_id for e in entries])
+            return [e for e in entries if e.object_id in failed]
+
+        self.journal.batch_handler = batch_handler
+        self.journal.batch_operations = frozenset([('ports', 'create')])
+        self.journal.batch_size = 2
+        return batches
+
+    def test_batch_operations_dispatched_together(self):
+        batches = self._batched()
+        for port in ('port1', 'port2', 'port3'):
+            self.journal.record('ports', port, 'create')
+        self.journal.record('ports', 'port4', 'update')
+        self._drain()
+        self.assertEqual([['port1', 'port2'], ['port3']], batches)
+        self.assertEqual([('port4', 'update')], self._dispatched())
+
+    def test_failed_batch_entries_retried(self):
+        batches = self._batched(failed=['port2'])
+        self.journal.record('ports', 'port1', 'create')
+        self.journal.record('ports', 'port2', 'create')
+        self._drain()
+        self.assertEqual([['port1', 'port2'], ['port2']], batches)
+        self.assertEqual('port2', self.on_failure.call_args[0][0].object_id)
+
+    def test_retry_later_keeps_retries(self):
+        self.handler.side_effect = [journal.RetryLater(), None]
+        self.journal.record('networks', 'net1', 'create')
+        self.assertTrue(self.journal.dispatch_one())
+        entry = self.journal.claim()
+        self.assertEqual(('net1', 0), (entry.object_id, entry.retry_count))
+
+    def test_drop_pending_creates_up_to_watermark(self):
+        self.journal.record('networks', 'net1', 'create')
+        self.journal.record('networks', 'net2', 'delete')
+        watermark = self.journal.watermark()
+        self.journal.record('networks', 'net3', 'create')
+        self.assertEqual(1, self.journal.drop_pending('create', watermark))
+        self._drain()
+        self.assertEqual([('net2', 'delete'), ('net3', 'create')],
+                         self._dispatched())
+
+    def test_drop_pending_keeps_create_updated_after_watermark(self):
+        self.journal.record('networks', 'net1', 'create')
+        watermark = self.journal.watermark()
+        self.journal.record('networks', 'net1', 'update')
+        self.assertEqual(0, self.journal.drop_pending('create', watermark))
+        self._drain()
+        self.assertEqual([('net1', 'create')], self._dispatched())
+
+    def test_stale_processing_entry_requeued(self):
+        self.journal.processing_timeout = 0
+        self.journal.record('networks', 'net1', 'create')
+        # Claimed by a worker which died before completing it.
+        self.assertIsNotNone(self.journal.claim())
+        self.journal.record('networks', 'net1', 'update')
+        self.assertIsNone(self.journal.claim())
+        with mock.patch.object(journal.time, 'time',
+                               return_value=journal.time.time() + 1):
+            self.journal._maintain()
+        self._drain()
+        self.assertEqual([('net1', 'create'), ('net1', 'update')],
+                         self._dispatched())
+
+    def test_journal_without_data_column_upgraded(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'journal.sqlite')
+        conn = sqlite3.connect(path)
+        conn.executescript(journal._SCHEMA.replace(',\n    data TEXT', ''))
+        conn.close()
+        old = journal.Journal(path, ('ports',), self.handler)
+        old.start = mock.Mock()
+        old.record('ports', 'port1', 'update', {'name': 'a'})
+        self.assertEqual({'name': 'a'}, old.claim().data)
@@ -0,0 +1,160 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from oslo.config import cfg
+import requests
+
+from neutron.extensions import l3
+from neutron.tests import base
+
+from odldrivers.common import journal
+from odldrivers.l3 import l3_odl
+from odldrivers.tests.benchmark import fake_odl
+
+
+class OpenDaylightL3RouterPluginTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(OpenDaylightL3RouterPluginTestCase, self).setUp()
+        cfg.CONF.set_override('journal_enabled', False, 'odl_rest')
+        cfg.CONF.set_override('dirty_resync_interval', 0, 'odl_rest')
+        mock.patch.object(l3_odl.OpenDaylightL3RouterPlugin,
+                          'setup_rpc').start()
+        self.client = mock.patch.object(l3_odl.odl_client,
+                                        'get_client').start().return_value
+        mock.patch.object(l3_odl.n_context, 'get_admin_context').start()
+        self.addCleanup(mock.patch.stopall)
+        self.plugin = l3_odl.OpenDaylightL3RouterPlugin()
+        self.plugin.out_of_sync = False
+        self.router = {'id': 'r1', 'tenant_id': 't1', 'status': 'ACTIVE',
+                       'name': 'router1'}
+        self.plugin.get_router = mock.Mock(
+            side_effect=lambda context, id: dict(self.router))
+
+    def test_rpc_not_started_when_disabled(self):
+        l3_odl.OpenDaylightL3RouterPlugin.setup_rpc.reset_mock()
+        l3_odl.OpenDaylightL3RouterPlugin(rpc=False)
+        self.assertFalse(l3_odl.OpenDaylightL3RouterPlugin.setup_rpc.called)
+
+    def test_update_sends_filtered_router(self):
+        self.plugin.synchronize('update', l3_odl.ROUTERS, 'r1')
+        self.client.sendjson.assert_called_once_with(
+            'put', 'routers/r1', {'router': {'name': 'router1'}})
+
+    def test_delete_ignores_missing_router(self):
+        self.plugin.synchronize('delete', l3_odl.ROUTERS, 'r1')
+        self.client.sendjson.assert_called_once_with(
+            'delete', 'routers/r1', None, [404])
+
+    def test_failed_router_is_resynced(self):
+        self.client.sendjson.side_effect = [Exception('boom'),
+                                            mock.Mock(), mock.Mock()]
+        self.assertRaises(Exception, self.plugin.synchronize,
+                          'create', l3_odl.ROUTERS, 'r1')
+        self.assertEqual({'r1': 1}, self.plugin.dirty.pending('routers'))
+        self.plugin.synchronize('delete', l3_odl.FLOATINGIPS, 'f1')
+        self.assertTrue(self.plugin.dirty)
+        self.plugin._sync_dirty_periodic()
+        self.assertFalse(self.plugin.dirty)
+        self.client.sendjson.assert_has_calls([
+            mock.call('delete', 'floatingips/f1', None, [404]),
+            mock.call('put', 'routers/r1',
+                      {'router': {'name': 'router1'}})])
+
+    def test_router_rejected_again_is_backed_off(self):
+        self.plugin.dirty = l3_odl.sync.DirtyTracker(60)
+        self.plugin.dirty.mark(l3_odl.ROUTERS, 'r1')
+        self.client.sendjson.side_effect = Exception('boom')
+        self.plugin._sync_dirty_periodic()
+        self.plugin._sync_dirty_periodic()
+        self.assertEqual(1, self.client.sendjson.call_count)
+        self.assertTrue(self.plugin.dirty)
+
+    def test_journal_entry_does_not_resync_dirty_objects(self):
+        self.plugin.dirty.mark(l3_odl.ROUTERS, 'r2')
+        self.plugin.dispatch_entry(
+            journal.Entry(1, l3_odl.ROUTERS, 'r1', 'update', 0))
+        self.client.sendjson.assert_called_once_with(
+            'put', 'routers/r1', {'router': {'name': 'router1'}})
+        self.assertTrue(self.plugin.dirty)
+
+    def test_resync_deletes_missing_router(self):
+        self.plugin.get_router.side_effect = l3.RouterNotFound(router_id='r1')
+        self.plugin.resync_resource(l3_odl.ROUTERS, 'r1', None)
+        self.client.sendjson.assert_called_once_with(
+            'delete', 'routers/r1', None, [404])
+
+    def _http_error(self, status_code):
+        return requests.exceptions.HTTPError(
+            response=mock.Mock(status_code=status_code))
+
+    def test_resync_creates_router_odl_lacks(self):
+        self.client.sendjson.side_effect = [self._http_error(404), None]
+        self.plugin.resync_resource(l3_odl.ROUTERS, 'r1', None)
+        self.client.sendjson.assert_called_with(
+            'post', 'routers', {'router': self.router}, [400])
+
+    def test_resync_error_other_than_missing_raised(self):
+        self.client.sendjson.side_effect = self._http_error(400)
+        self.assertRaises(requests.exceptions.HTTPError,
+                          self.plugin.resync_resource, l3_odl.ROUTERS, 'r1',
+                          None)
+        self.assertEqual(1, self.client.sendjson.call_count)
+
+    def test_change_queued_while_out_of_sync(self):
+        self.plugin.out_of_sync = True
+        self.plugin.resync = mock.Mock()
+        self.plugin.synchronize('update', l3_odl.ROUTERS, 'r1')
+        self.plugin.resync.start.assert_called_once_with()
+        self.assertEqual({'r1': 1}, self.plugin.dirty.pending('routers'))
+        self.assertFalse(self.client.sendjson.called)
+
+    def test_journal_records_change(self):
+        self.plugin.journal = mock.Mock(spec=journal.Journal)
+        self.plugin.synchronize('create', l3_odl.FLOATINGIPS, 'f1')
+        self.plugin.journal.record.assert_called_once_with(
+            l3_odl.FLOATINGIPS, 'f1', 'create')
+        self.assertFalse(self.client.sendjson.called)
+
+    def test_floatingip_creates_batched(self):
+        self.plugin.get_floatingip = mock.Mock(
+            side_effect=lambda context, id: {'id': id})
+        self.client.bulk_post.return_value = [
+            l3_odl.odl_client.BatchResult(0, 2, ['f2'])]
+        entries = [journal.Entry(i, l3_odl.FLOATINGIPS, fip, 'create', 0)
+                   for i, fip in enumerate(['f1', 'f2'])]
+        failed = self.plugin.dispatch_batch(entries)
+        self.assertEqual([entries[1]], failed)
+        self.client.bulk_post.assert_called_once_with(
+            'floatingips', 'floatingip', [{'id': 'f1'}, {'id': 'f2'}], 2, 1,
+            [400])
+
+    def test_floatingip_batch_with_existing_floatingip(self):
+        odl = fake_odl.FakeOpenDaylight().start()
+        self.addCleanup(odl.stop)
+        self.plugin.client = l3_odl.odl_client.OpenDaylightRestClient(
+            odl.url, 'admin', 'admin', 10, 30)
+        self.plugin.get_floatingip = mock.Mock(
+            side_effect=lambda context, id: {'id': id})
+        # Created by the background resync or a POST which timed out.
+        self.plugin.client.sendjson('post', 'floatingips',
+                                    {'floatingip': {'id': 'f1'}})
+        entries = [journal.Entry(i, l3_odl.FLOATINGIPS, fip, 'create', 0)
+                   for i, fip in enumerate(['f1', 'f2', 'f3'])]
+        self.assertEqual([], self.plugin.dispatch_batch(entries))
+        self.assertEqual(set(['f1', 'f2', 'f3']),
+                         set(odl.resources['floatingips']))
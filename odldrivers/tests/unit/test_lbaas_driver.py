@@ -0,0 +1,124 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from oslo.config import cfg
+
+from neutron.plugins.common import constants
+from neutron.tests import base
+
+from odldrivers.common import client as odl_client
+from odldrivers.common import journal
+from odldrivers.lbaas import driver
+
+
+class OpenDaylightLbaasDriverTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(OpenDaylightLbaasDriverTestCase, self).setUp()
+        cfg.CONF.set_override('journal_enabled', False, 'odl_rest')
+        self.client = mock.patch.object(driver.odl_client,
+                                        'get_client').start().return_value
+        self.dbcontext = mock.patch.object(
+            driver.n_context, 'get_admin_context').start().return_value
+        self.addCleanup(mock.patch.stopall)
+        self.plugin = mock.Mock()
+        self.plugin.get_member.side_effect = lambda context, id: {
+            'id': id, 'pool_id': 'p1', 'address': '10.0.0.1',
+            'protocol_port': 80, 'status': 'PENDING_CREATE'}
+        self.plugin.get_health_monitor.return_value = {
+            'id': 'hm1', 'type': 'HTTP',
+            'pools': [{'pool_id': 'p1', 'status': 'PENDING_CREATE'}]}
+        self.driver = driver.OpenDaylightLbaasDriver(self.plugin)
+
+    def test_create_member_sends_member_and_sets_active(self):
+        self.driver.create_member(None, {'id': 'm1'})
+        self.client.sendjson.assert_called_once_with(
+            'post', 'lbaas/members',
+            {'member': {'id': 'm1', 'pool_id': 'p1', 'address': '10.0.0.1',
+                        'protocol_port': 80}}, [400])
+        self.plugin.update_status.assert_called_once_with(
+            self.dbcontext, driver.ldb.Member, 'm1', constants.ACTIVE)
+
+    def test_failed_member_is_set_to_error(self):
+        self.client.sendjson.side_effect = Exception('boom')
+        self.driver.create_member(None, {'id': 'm1'})
+        self.plugin.update_status.assert_called_once_with(
+            self.dbcontext, driver.ldb.Member, 'm1', constants.ERROR)
+
+    def test_delete_member_removes_db_member(self):
+        self.driver.delete_member('ctx', {'id': 'm1'})
+        self.plugin._delete_db_member.assert_called_once_with('ctx', 'm1')
+        self.client.sendjson.assert_called_once_with(
+            'delete', 'lbaas/members/m1', None, [404])
+
+    def test_health_monitor_sends_pool_ids(self):
+        self.driver.create_pool_health_monitor(
+            None, self.plugin.get_health_monitor.return_value, 'p1')
+        self.client.sendjson.assert_called_once_with(
+            'post', 'lbaas/healthmonitors',
+            {'health_monitor': {'id': 'hm1', 'type': 'HTTP',
+                                'pools': ['p1']}}, [400])
+        self.plugin.update_pool_health_monitor.assert_called_once_with(
+            self.dbcontext, 'hm1', 'p1', constants.ACTIVE)
+
+    def test_health_monitor_deleted_with_last_pool(self):
+        self.driver.delete_pool_health_monitor(
+            'ctx', self.plugin.get_health_monitor.return_value, 'p1')
+        self.plugin._delete_db_pool_health_monitor.assert_called_once_with(
+            'ctx', 'hm1', 'p1')
+        self.client.sendjson.assert_called_once_with(
+            'delete', 'lbaas/healthmonitors/hm1', None, [404])
+
+    def test_dispatch_batch_creates_members_in_bulk(self):
+        self.client.bulk_post.return_value = [
+            odl_client.BatchResult(0, 3, ['m2'])]
+        entries = [journal.Entry(i, driver.MEMBERS, 'm%d' % i, 'create', 0)
+                   for i in range(1, 4)]
+        failed = self.driver.dispatch_batch(entries)
+        self.assertEqual([entries[1]], failed)
+        args = self.client.bulk_post.call_args[0]
+        self.assertEqual(('lbaas/members', 'member'), args[:2])
+        self.assertEqual(['m1', 'm2', 'm3'], [m['id'] for m in args[2]])
+        self.assertEqual(
+            [('m1', constants.ACTIVE), ('m2', constants.ERROR),
+             ('m3', constants.ACTIVE)],
+            [c[0][2:] for c in self.plugin.update_status.call_args_list])
+
+    def test_journal_started_at_init(self):
+        cfg.CONF.set_override('journal_enabled', True, 'odl_rest')
+        with mock.patch.object(driver.journal,
+                               'create_journal') as create_journal:
+            driver.OpenDaylightLbaasDriver(self.plugin)
+        create_journal.return_value.start.assert_called_once_with()
+
+    def test_stats_served_from_last_poll(self):
+        self.client.list_collection.return_value = [
+            {'id': 'p1', 'stats': {'bytes_in': 10, 'bytes_out': 20,
+                                   'active_connections': 1,
+                                   'total_connections': 2}},
+            {'id': 'p2'}]
+        with mock.patch.object(driver.loopingcall,
+                               'FixedIntervalLoopingCall') as looping:
+            self.assertIsNone(self.driver.stats(None, 'p1'))
+            self.driver.stats(None, 'p1')
+            self.assertEqual(1, looping.call_count)
+        self.driver.poll_stats()
+        self.assertEqual(10, self.driver.stats(None, 'p1')['bytes_in'])
+        self.assertIsNone(self.driver.stats(None, 'p2'))
+        self.client.list_collection.assert_called_once_with(
+            'lbaas/pools', cfg.CONF.odl_rest.sync_page_size,
+            ['id', 'stats'])
@@ -14,6 +14,12 @@
 #    under the License.
 # @author: Kyle Mestery, Cisco Systems, Inc.
 
+import os
+import shutil
+import tempfile
+
+import mock
+
 from neutron.plugins.common import constants
 from neutron.plugins.ml2 import config as config
 from neutron.plugins.ml2 import driver_api as api
@@ -43,6 +49,8 @@ class OpenDaylightTestCase(test_plugin.NeutronDbPluginV2TestCase):
                                      'odl_rest')
         config.cfg.CONF.set_override('username', 'someuser', 'odl_rest')
         config.cfg.CONF.set_override('password', 'somepass', 'odl_rest')
+        # Send changes inline so they go through check_sendjson.
+        config.cfg.CONF.set_override('journal_enabled', False, 'odl_rest')
 
         super(OpenDaylightTestCase, self).setUp(PLUGIN_NAME)
         self.port_create_status = 'DOWN'
@@ -52,6 +60,9 @@ class OpenDaylightTestCase(test_plugin.NeutronDbPluginV2TestCase):
 
     def check_sendjson(self, method, urlpath, obj, ignorecodes=[]):
         self.assertFalse(urlpath.startswith("http://"))
+        response = mock.Mock()
+        response.json.return_value = {}
+        return response
 
     def test_check_segment(self):
         """Validate the check_segment call."""
@@ -119,3 +130,331 @@ class OpenDaylightMechanismTestSubnetsV2(test_plugin.TestSubnetsV2,
 class OpenDaylightMechanismTestPortsV2(test_plugin.TestPortsV2,
                                        OpenDaylightTestCase):
     pass
+
+
+class OpenDaylightDriverTestCase(base.BaseTestCase):
+
+    """Configures the driver to send changes inline to a mocked ODL."""
+
+    def setUp(self):
+        super(OpenDaylightDriverTestCase, self).setUp()
+        config.cfg.CONF.set_override('url', 'http://127.0.0.1:9999',
+                                     'odl_rest')
+        config.cfg.CONF.set_override('username', 'someuser', 'odl_rest')
+        config.cfg.CONF.set_override('password', 'somepass', 'odl_rest')
+        config.cfg.CONF.set_override('journal_enabled', False, 'odl_rest')
+        config.cfg.CONF.set_override('snapshot_path', '', 'odl_rest')
+        config.cfg.CONF.set_override('dirty_resync_interval', 0, 'odl_rest')
+
+
+class OpenDaylightSecurityGroupCacheTestCase(OpenDaylightDriverTestCase):
+
+    def setUp(self):
+        super(OpenDaylightSecurityGroupCacheTestCase, self).setUp()
+        self.mech = mech_odl.OpenDaylightMechanismDriver()
+        self.mech.initialize()
+        self.plugin = mock.Mock()
+        self.plugin.get_security_group.side_effect = (
+            lambda dbcontext, sg: {'id': sg})
+
+    def _add_security_groups(self, *groups):
+        port = {'security_groups': list(groups)}
+        self.mech.add_security_groups(self.plugin, None, port)
+        return port
+
+    def test_security_group_loaded_once(self):
+        for i in range(3):
+            port = self._add_security_groups('sg1', 'sg2')
+        self.assertEqual([{'id': 'sg1'}, {'id': 'sg2'}],
+                         port['security_groups'])
+        self.assertEqual(2, self.plugin.get_security_group.call_count)
+
+    def test_rule_change_invalidates_group(self):
+        self._add_security_groups('sg1', 'sg2')
+        self.mech.security_group_changed(
+            'security_group_rule', 'after_create', None,
+            security_group_rule={'id': 'rule1', 'security_group_id': 'sg1'})
+        self._add_security_groups('sg1', 'sg2')
+        self.assertEqual(3, self.plugin.get_security_group.call_count)
+
+    def test_unknown_group_change_clears_cache(self):
+        self._add_security_groups('sg1', 'sg2')
+        self.mech.security_group_changed('security_group_rule',
+                                         'after_delete', None,
+                                         security_group_rule_id='rule1')
+        self._add_security_groups('sg1', 'sg2')
+        self.assertEqual(4, self.plugin.get_security_group.call_count)
+
+
+class OpenDaylightPayloadTestCase(OpenDaylightDriverTestCase):
+
+    def setUp(self):
+        super(OpenDaylightPayloadTestCase, self).setUp()
+        self.mech = mech_odl.OpenDaylightMechanismDriver()
+        self.mech.initialize()
+        self.plugin = mock.Mock()
+        self.plugin.get_security_group.side_effect = (
+            lambda dbcontext, sg: {'id': sg})
+        self.port = {'id': 'p1', 'network_id': 'n1', 'status': 'DOWN',
+                     'tenant_id': 't1', 'mac_address': 'fa:16:3e:00:00:01',
+                     'fixed_ips': [], 'security_groups': ['sg1'],
+                     'binding:host_id': 'compute1'}
+
+    def test_port_create_payload(self):
+        payload = self.mech.payloads[('ports', 'create')](
+            self.port, self.plugin, None)
+        self.assertEqual({'id': 'p1', 'network_id': 'n1', 'tenant_id': 't1',
+                          'mac_address': 'FA:16:3E:00:00:01',
+                          'fixed_ips': [], 'security_groups': [{'id': 'sg1'}],
+                          'binding:host_id': 'compute1'}, payload)
+        self.assertEqual(['sg1'], self.port['security_groups'])
+
+    def test_port_update_payload(self):
+        payload = self.mech.payloads[('ports', 'update')](
+            self.port, self.plugin, None)
+        self.assertEqual({'security_groups': [{'id': 'sg1'}],
+                          'binding:host_id': 'compute1'}, payload)
+
+    def test_port_differences_skip_security_groups(self):
+        self.mech.client = mock.Mock()
+        self.mech.client.list_collection.return_value = [
+            dict(self.port, mac_address='FA:16:3E:00:00:01')]
+        self.plugin.get_ports.return_value = [self.port]
+        self.assertEqual([], list(self.mech.differences('ports', self.plugin,
+                                                        None)))
+        self.assertFalse(self.plugin.get_security_group.called)
+
+
+class OpenDaylightDeltaUpdateTestCase(OpenDaylightDriverTestCase):
+
+    def setUp(self):
+        super(OpenDaylightDeltaUpdateTestCase, self).setUp()
+        config.cfg.CONF.set_override('delta_updates', True, 'odl_rest')
+        self.client = mock.Mock()
+        mock.patch.object(odl_client, 'get_client',
+                          return_value=self.client).start()
+        self.mech = mech_odl.OpenDaylightMechanismDriver()
+        self.mech.initialize()
+        self.mech.out_of_sync = False
+        self.plugin = mock.Mock()
+        self.plugin.get_security_group.side_effect = (
+            lambda dbcontext, sg: {'id': sg})
+        self.original = {'id': 'p1', 'network_id': 'n1', 'status': 'DOWN',
+                         'name': 'port', 'admin_state_up': True,
+                         'security_groups': ['sg1']}
+
+    def _update(self, original=None, **changes):
+        context = mock.Mock(original=original, _plugin=self.plugin,
+                            current=dict(self.original, **changes))
+        self.mech.update_port_postcommit(context)
+
+    def test_changed_attributes_sent_without_db_read(self):
+        self._update(self.original, name='renamed', status='ACTIVE')
+        self.client.sendjson.assert_called_once_with(
+            'put', 'ports/p1', {'port': {'name': 'renamed'}}, [400])
+        self.assertFalse(self.plugin.get_port.called)
+        self.assertFalse(self.plugin.get_security_group.called)
+
+    def test_changed_security_groups_expanded(self):
+        self._update(self.original, security_groups=['sg1', 'sg2'])
+        self.client.sendjson.assert_called_once_with(
+            'put', 'ports/p1',
+            {'port': {'security_groups': [{'id': 'sg1'}, {'id': 'sg2'}]}},
+            [400])
+
+    def test_failed_object_resynced_in_background(self):
+        self.client.sendjson.side_effect = [Exception('boom'), None, None]
+        self.assertRaises(Exception, self._update, self.original,
+                          name='renamed')
+        self._update(dict(self.original, id='p2'), id='p2', name='renamed')
+        self.assertEqual(2, self.client.sendjson.call_count)
+        self.assertFalse(self.plugin.get_port.called)
+        mock.patch.object(mech_odl.manager.NeutronManager, 'get_plugin',
+                          return_value=self.plugin).start()
+        mock.patch.object(mech_odl.n_context, 'get_admin_context').start()
+        self.plugin.get_port.return_value = dict(self.original,
+                                                 name='renamed')
+        self.mech._sync_dirty_periodic()
+        self.plugin.get_port.assert_called_once_with(mock.ANY, 'p1')
+        self.assertFalse(self.mech.dirty)
+
+    def test_update_without_relevant_change_skipped(self):
+        self._update(self.original, status='ACTIVE')
+        self.assertFalse(self.client.sendjson.called)
+
+    def test_update_without_original_sends_whole_object(self):
+        self.plugin.get_port.return_value = dict(self.original,
+                                                 name='renamed')
+        self._update(name='renamed')
+        self.client.sendjson.assert_called_once_with(
+            'put', 'ports/p1',
+            {'port': {'name': 'renamed', 'admin_state_up': True,
+                      'security_groups': [{'id': 'sg1'}]}}, [400])
+
+
+class OpenDaylightJournalTestCase(OpenDaylightDriverTestCase):
+
+    def setUp(self):
+        super(OpenDaylightJournalTestCase, self).setUp()
+        config.cfg.CONF.set_override('journal_enabled', True, 'odl_rest')
+        config.cfg.CONF.set_override('journal_path', ':memory:', 'odl_rest')
+        # Drive the journal by hand rather than from worker threads.
+        mock.patch.object(mech_odl.journal.Journal, 'start').start()
+        self.client = mock.patch.object(odl_client,
+                                        'get_client').start().return_value
+        self.plugin = mock.patch.object(
+            mech_odl.manager.NeutronManager, 'get_plugin').start().return_value
+        mock.patch.object(mech_odl.n_context, 'get_admin_context').start()
+        self.addCleanup(mock.patch.stopall)
+        self.mech = mech_odl.OpenDaylightMechanismDriver()
+        self.mech.initialize()
+        self.mech.out_of_sync = False
+        self.plugin.get_network.return_value = {'id': 'n1', 'name': 'net1',
+                                                'status': 'ACTIVE'}
+
+    def test_postcommit_recorded_then_sent_by_worker(self):
+        context = mock.Mock(current={'id': 'n1'})
+        self.mech.create_network_postcommit(context)
+        self.assertFalse(self.client.sendjson.called)
+        self.assertEqual(1, self.mech.journal.size())
+        self.assertTrue(self.mech.journal.dispatch_one())
+        self.client.sendjson.assert_called_once_with(
+            'post', 'networks', {'network': {'id': 'n1', 'name': 'net1'}},
+            [400])
+        self.assertEqual(0, self.mech.journal.size())
+
+    def test_dirty_objects_not_resynced_ahead_of_entries(self):
+        self.mech.dirty.mark('networks', 'n2')
+        self.mech.create_network_postcommit(mock.Mock(current={'id': 'n1'}))
+        self.assertTrue(self.mech.journal.dispatch_one())
+        self.assertEqual(1, self.client.sendjson.call_count)
+        self.plugin.get_network.assert_called_once_with(mock.ANY, 'n1')
+        self.assertTrue(self.mech.dirty)
+
+
+class OpenDaylightBindPortTestCase(OpenDaylightDriverTestCase):
+
+    def setUp(self):
+        super(OpenDaylightBindPortTestCase, self).setUp()
+        config.cfg.CONF.set_override('hostconfig_enabled', True, 'odl_rest')
+        self.mech = mech_odl.OpenDaylightMechanismDriver()
+        self.mech.initialize()
+        self.sendjson = mock.patch.object(self.mech.client,
+                                          'sendjson').start()
+        self.addCleanup(mock.patch.stopall)
+        self.sendjson.return_value.json.return_value = {'hostconfig': {
+            'host-id': 'compute1',
+            'config': '{"allowed_network_types": ["vlan", "vxlan"], '
+                      '"bridge_mappings": {"physnet2": "br-eth2"}}'}}
+        self.segments = [self._segment('s1', constants.TYPE_FLAT, 'physnet1'),
+                         self._segment('s2', constants.TYPE_VLAN, 'physnet1'),
+                         self._segment('s3', constants.TYPE_VLAN, 'physnet2'),
+                         self._segment('s4', constants.TYPE_VXLAN, None)]
+
+    def _segment(self, segment_id, network_type, physnet):
+        return {api.ID: segment_id, api.NETWORK_TYPE: network_type,
+                api.PHYSICAL_NETWORK: physnet, api.SEGMENTATION_ID: 1}
+
+    def _context(self, host='compute1'):
+        context = mock.Mock(host=host, current={'id': 'p1'})
+        context.network.current = {'id': 'n1'}
+        context.network.network_segments = self.segments
+        return context
+
+    def _bound_segment(self, context):
+        self.mech.bind_port(context)
+        if not context.set_binding.called:
+            return None
+        return context.set_binding.call_args[0][0]
+
+    def test_binds_segment_allowed_by_hostconfig(self):
+        self.assertEqual('s3', self._bound_segment(self._context()))
+        self.sendjson.assert_called_once_with(
+            'get', 'hostconfigs/compute1', None, ignorecodes=[404])
+
+    def test_choice_and_hostconfig_are_cached(self):
+        self._bound_segment(self._context())
+        with mock.patch.object(self.mech, 'check_segment') as check:
+            self.assertEqual('s3', self._bound_segment(self._context()))
+            self.assertFalse(check.called)
+        self.assertEqual(1, self.sendjson.call_count)
+
+    def test_segment_change_invalidates_choice(self):
+        self._bound_segment(self._context())
+        self.segments = self.segments[3:]
+        self.assertEqual('s4', self._bound_segment(self._context()))
+        self.assertEqual(1, self.sendjson.call_count)
+
+    def test_host_without_hostconfig_binds_blindly(self):
+        self.sendjson.return_value = None
+        self.assertEqual('s2', self._bound_segment(self._context()))
+
+    def test_unreachable_odl_is_not_cached(self):
+        self.sendjson.side_effect = Exception('boom')
+        self.assertEqual('s2', self._bound_segment(self._context()))
+        self.assertEqual('s2', self._bound_segment(self._context()))
+        self.assertEqual(2, self.sendjson.call_count)
+
+    def test_unsupported_network_is_not_bound(self):
+        self.segments = self.segments[:1]
+        self.assertIsNone(self._bound_segment(self._context()))
+
+
+class OpenDaylightWarmStartTestCase(OpenDaylightDriverTestCase):
+
+    def setUp(self):
+        super(OpenDaylightWarmStartTestCase, self).setUp()
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        config.cfg.CONF.set_override(
+            'snapshot_path', os.path.join(tempdir, 'snapshot.json'),
+            'odl_rest')
+        self.client = mock.patch.object(mech_odl.odl_client,
+                                        'get_client').start().return_value
+        self.client.list_collection.return_value = iter([])
+        self.client.bulk_post.side_effect = self._bulk_post
+        self.posted = []
+        self.addCleanup(mock.patch.stopall)
+        self.plugin = mock.Mock()
+        self.networks = [{'id': 'n%d' % i, 'name': 'net%d' % i}
+                         for i in range(100)]
+        self.plugin.get_networks.side_effect = self._networks
+        self.plugin.get_network.side_effect = lambda context, id: next(
+            n for n in self.networks if n['id'] == id)
+        self.plugin.get_subnets.return_value = []
+        self.plugin.get_ports.return_value = []
+
+    def _bulk_post(self, collection, resource_name, resources, *args):
+        self.posted.extend(resources)
+        return []
+
+    def _networks(self, context, **kwargs):
+        return [dict(n) for n in self.networks
+                if not kwargs.get('marker') or n['id'] > kwargs['marker']]
+
+    def _start(self):
+        mech = mech_odl.OpenDaylightMechanismDriver()
+        mech.out_of_sync = True
+        mech.initialize()
+        mech.sync_full(self.plugin, None)
+        return mech
+
+    def test_restart_only_resyncs_changed_objects(self):
+        self._start()
+        self.networks[5]['name'] = 'renamed'
+        self.client.reset_mock()
+        self.client.list_collection.return_value = iter([{'id': 'n0'}])
+        self.posted = []
+        mech = self._start()
+        self.assertEqual([], self.posted)
+        self.client.sendjson.assert_called_once_with(
+            'put', 'networks/n5', {'network': {'name': 'renamed'}})
+        self.assertFalse(mech.out_of_sync)
+
+    def test_odl_without_data_gets_full_resync(self):
+        self._start()
+        self.client.reset_mock()
+        self.client.list_collection.return_value = iter([])
+        self.posted = []
+        self._start()
+        self.assertEqual(100, len(self.posted))
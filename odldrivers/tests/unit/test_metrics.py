@@ -0,0 +1,85 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from oslo.config import cfg
+
+from neutron.tests import base
+
+from odldrivers.common import metrics
+
+
+class MemorySinkTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(MemorySinkTestCase, self).setUp()
+        self.sink = metrics.MemorySink()
+
+    def test_counters_and_gauges(self):
+        self.sink.incr('status.200')
+        self.sink.incr('status.200', 2)
+        self.sink.gauge('journal.depth.ports', 5)
+        self.assertEqual(3, self.sink.counters['status.200'])
+        self.assertEqual({'journal.depth.ports': 5}, self.sink.gauges)
+
+    def test_percentile(self):
+        for i in range(101):
+            self.sink.timing('request.ports.put', i / 1000.0)
+        self.assertEqual(0.05, self.sink.percentile('request.ports.put', 50))
+        self.assertEqual(0.099, self.sink.percentile('request.ports.put', 99))
+        self.assertIsNone(self.sink.percentile('request.ports.get', 50))
+
+    @mock.patch('time.time')
+    def test_timer(self, time):
+        time.side_effect = [10, 10.5]
+        with self.sink.timer('sync_full'):
+            pass
+        self.assertEqual([0.5], self.sink.timings['sync_full'])
+
+
+class StatsdSinkTestCase(base.BaseTestCase):
+
+    def test_statsd_datagrams(self):
+        sink = metrics.StatsdSink('127.0.0.1', 8125, 'odl')
+        sink._socket = mock.Mock()
+        sink.timing('request.ports.put', 0.25)
+        sink.incr('request.ports.put.status.200')
+        sink.gauge('dirty', 3)
+        self.assertEqual(
+            [b'odl.request.ports.put:250|ms',
+             b'odl.request.ports.put.status.200:1|c',
+             b'odl.dirty:3|g'],
+            [c[0][0] for c in sink._socket.sendto.call_args_list])
+
+
+class LoadSinkTestCase(base.BaseTestCase):
+
+    def test_builtin_sinks(self):
+        conf = cfg.CONF.odl_rest
+        self.assertIsInstance(metrics.load_sink('', conf), metrics.NullSink)
+        self.assertIsInstance(metrics.load_sink('memory', conf),
+                              metrics.MemorySink)
+        self.assertIsInstance(metrics.load_sink('statsd', conf),
+                              metrics.StatsdSink)
+
+    def test_sink_loaded_by_import_path(self):
+        sink = metrics.load_sink('odldrivers.common.metrics.MemorySink',
+                                 cfg.CONF.odl_rest)
+        self.assertIsInstance(sink, metrics.MemorySink)
+
+    def test_missing_sink_disables_metrics(self):
+        sink = metrics.load_sink('no_such_module.Sink', cfg.CONF.odl_rest)
+        self.assertFalse(sink.enabled)
@@ -0,0 +1,119 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+
+import mock
+
+from neutron.tests import base
+
+from odldrivers.common import snapshot
+
+
+class MerkleTreeTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(MerkleTreeTestCase, self).setUp()
+        self.hashes = dict(('id%d' % i, 'h%d' % i) for i in range(1000))
+        self.tree = snapshot.MerkleTree(self.hashes)
+
+    def test_equal_trees_have_equal_roots(self):
+        other = snapshot.MerkleTree(dict(self.hashes))
+        self.assertEqual(self.tree.root, other.root)
+        self.assertEqual([], self.tree.diff(other))
+
+    def test_diff_finds_changed_added_and_removed(self):
+        other = snapshot.MerkleTree(dict(self.hashes))
+        other.set('id1', 'changed')
+        other.set('new', 'h')
+        other.discard('id2')
+        self.assertEqual(['id1', 'id2', 'new'], sorted(self.tree.diff(other)))
+
+    def test_diff_only_walks_differing_buckets(self):
+        other = snapshot.MerkleTree(dict(self.hashes))
+        other.set('id1', 'changed')
+        differing = [i for i in range(len(other.buckets))
+                     if self.tree.digest(i) != other.digest(i)]
+        self.assertEqual(1, len(differing))
+
+    def test_set_same_hash_keeps_digest(self):
+        root = self.tree.root
+        self.tree.set('id1', 'h1')
+        self.assertIsNotNone(self.tree._root)
+        self.assertEqual(root, self.tree.root)
+
+
+class SnapshotTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(SnapshotTestCase, self).setUp()
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self.path = os.path.join(tempdir, 'state', 'snapshot.json')
+        self.snapshot = snapshot.Snapshot(self.path, ('networks', 'ports'),
+                                          save_interval=0)
+
+    def test_missing_file_is_not_loaded(self):
+        self.assertFalse(self.snapshot.load())
+        self.assertFalse(self.snapshot.loaded)
+
+    def test_changes_survive_reload(self):
+        self.snapshot.set('networks', 'n1', 'a')
+        self.snapshot.set('ports', 'p1', 'b')
+        self.snapshot.discard('ports', 'p1')
+        self.snapshot.maybe_save()
+        loaded = snapshot.Snapshot(self.path, ('networks', 'ports'))
+        self.assertTrue(loaded.load())
+        self.assertEqual('a', loaded.trees['networks'].get('n1'))
+        self.assertEqual(0, loaded.size('ports'))
+
+    def test_saves_are_rate_limited(self):
+        self.snapshot.save_interval = 3600
+        self.snapshot.set('networks', 'n1', 'a')
+        self.snapshot.maybe_save()
+        self.snapshot.set('networks', 'n2', 'b')
+        self.snapshot.maybe_save()
+        loaded = snapshot.Snapshot(self.path, ('networks', 'ports'))
+        loaded.load()
+        self.assertEqual(1, loaded.size('networks'))
+        self.snapshot.maybe_save(force=True)
+        loaded.load()
+        self.assertEqual(2, loaded.size('networks'))
+
+    def test_changes_are_not_saved_inline(self):
+        self.snapshot.set('networks', 'n1', 'a')
+        self.assertFalse(os.path.exists(self.path))
+
+    @mock.patch.object(snapshot.loopingcall, 'FixedIntervalLoopingCall')
+    def test_saver_started_once(self, looping_call):
+        self.snapshot.save_interval = 10
+        self.snapshot.start_saver()
+        self.snapshot.start_saver()
+        looping_call.assert_called_once_with(self.snapshot.maybe_save)
+        looping_call.return_value.start.assert_called_once_with(
+            interval=10, initial_delay=10)
+
+    def test_different_object_types_are_ignored(self):
+        self.snapshot.save()
+        other = snapshot.Snapshot(self.path, ('networks',))
+        self.assertFalse(other.load())
+
+    def test_invalidate_removes_file(self):
+        self.snapshot.set('networks', 'n1', 'a')
+        self.snapshot.invalidate()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(0, self.snapshot.size('networks'))
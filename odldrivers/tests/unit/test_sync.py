@@ -0,0 +1,111 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.tests import base
+
+from odldrivers.common import sync
+
+
+class DirtyTrackerTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(DirtyTrackerTestCase, self).setUp()
+        self.dirty = sync.DirtyTracker()
+
+    def test_clear(self):
+        self.assertFalse(self.dirty)
+        self.dirty.mark('ports', 'port1')
+        self.assertTrue(self.dirty)
+        generation = self.dirty.pending('ports')['port1']
+        self.dirty.clear('ports', 'port1', generation)
+        self.assertFalse(self.dirty)
+
+    def test_marked_again_during_resync_stays_dirty(self):
+        self.dirty.mark('ports', 'port1')
+        generation = self.dirty.pending('ports')['port1']
+        self.dirty.mark('ports', 'port1')
+        self.dirty.clear('ports', 'port1', generation)
+        self.assertEqual(['port1'], list(self.dirty.pending('ports')))
+
+    @mock.patch('time.time')
+    def test_failed_object_backs_off(self, time):
+        dirty = sync.DirtyTracker(retry_interval=5, retry_interval_max=12)
+        time.return_value = 100
+        dirty.mark('ports', 'port1')
+        dirty.mark('ports', 'port2')
+        delays = []
+        for i in range(3):
+            generation = dirty.pending('ports')['port1']
+            dirty.failed('ports', 'port1', generation)
+            self.assertEqual(['port2'], list(dirty.pending('ports')))
+            start = time.return_value
+            while 'port1' not in dirty.pending('ports'):
+                time.return_value += 1
+            delays.append(time.return_value - start)
+        self.assertEqual([5, 10, 12], delays)
+        dirty.failed('ports', 'port1', dirty.pending('ports')['port1'])
+        dirty.mark('ports', 'port1')
+        self.assertIn('port1', dirty.pending('ports'))
+        self.assertEqual(2, len(dirty))
+
+
+class FindDifferencesTestCase(base.BaseTestCase):
+
+    def test_compare_classifies_differences(self):
+        neutron = [{'id': 'same', 'name': 'a'},
+                   {'id': 'changed', 'name': 'b'},
+                   {'id': 'missing', 'name': 'c'}]
+        odl = [{'id': 'same', 'name': 'a'},
+               {'id': 'changed', 'name': 'B'},
+               {'id': 'extra', 'name': 'd'}]
+        self.assertEqual(
+            set([('changed', sync.DIVERGENT), ('missing', sync.MISSING),
+                 ('extra', sync.EXTRA)]),
+            set(sync.compare(iter(neutron), iter(odl), ('name',))))
+
+
+class BackgroundResyncTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(BackgroundResyncTestCase, self).setUp()
+        self.journal = mock.Mock()
+        self.journal.watermark.return_value = 42
+        self.snapshot = mock.Mock()
+        self.replay = mock.Mock()
+        self.resync = sync.BackgroundResync(self.snapshot, self.replay,
+                                            self.journal, retry_interval=5)
+        self.spawn_n = mock.patch.object(sync.eventlet, 'spawn_n').start()
+        self.sleep = mock.patch.object(sync.eventlet, 'sleep').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_started_once(self):
+        self.resync.start()
+        self.resync.start()
+        self.assertTrue(self.resync.running)
+        self.spawn_n.assert_called_once_with(self.resync._run)
+        self.journal.pause.assert_called_once_with()
+
+    def test_snapshot_retried_then_replayed(self):
+        self.snapshot.side_effect = [Exception('boom'), None]
+        self.resync.start()
+        self.resync._run()
+        self.assertEqual(2, self.snapshot.call_count)
+        self.sleep.assert_called_once_with(5)
+        self.journal.drop_pending.assert_called_once_with('create', 42)
+        self.journal.resume.assert_called_once_with()
+        self.replay.assert_called_once_with()
+        self.assertFalse(self.resync.running)
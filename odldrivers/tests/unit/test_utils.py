@@ -0,0 +1,88 @@
+# Copyright (c) 2014 Red Hat Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from neutron.common import exceptions as n_exc
+from neutron.tests import base
+
+from odldrivers.common import utils
+
+
+class UtilsTestCase(base.BaseTestCase):
+
+    def test_compile_projection(self):
+        project = utils.compile_projection(
+            exclude=('status',),
+            transforms={'mac_address': lambda mac, end: mac.upper() + end,
+                        'missing': lambda value, end: value})
+        port = {'id': 'a', 'status': 'DOWN', 'mac_address': 'fa:16:3e:aa'}
+        self.assertEqual({'id': 'a', 'mac_address': 'FA:16:3E:AA!'},
+                         project(port, '!'))
+        self.assertEqual('DOWN', port['status'])
+        self.assertEqual('fa:16:3e:aa', port['mac_address'])
+
+    def test_chunks(self):
+        self.assertEqual([[1, 2], [3, 4], [5]],
+                         list(utils.chunks(iter(range(1, 6)), 2)))
+
+    def test_iter_resources_pages_by_marker(self):
+        getter = mock.Mock(side_effect=[[{'id': 'a'}, {'id': 'b'}],
+                                        [{'id': 'c'}]])
+        ids = [r['id'] for r in utils.iter_resources(getter, 'ctx', 2)]
+        self.assertEqual(['a', 'b', 'c'], ids)
+        getter.assert_has_calls([
+            mock.call('ctx', sorts=[('id', True)], limit=2, marker=None),
+            mock.call('ctx', sorts=[('id', True)], limit=2, marker='b')])
+
+    def test_iter_resources_survives_deleted_marker(self):
+        pages = {None: [{'id': 'a'}, {'id': 'b'}, {'id': 'c'}],
+                 'b': [{'id': 'd'}, {'id': 'e'}, {'id': 'f'}],
+                 'f': [{'id': 'g'}]}
+
+        def getter(context, sorts, limit, marker):
+            if marker == 'c':
+                # c was deleted after the first page was read.
+                raise n_exc.NotFound()
+            return pages[marker]
+
+        ids = [r['id'] for r in utils.iter_resources(getter, 'ctx', 3)]
+        self.assertEqual(['a', 'b', 'c', 'd', 'e', 'f', 'g'], ids)
+
+    def test_iter_resources_restarts_when_whole_page_deleted(self):
+        pages = {None: [[{'id': 'a'}, {'id': 'b'}], [{'id': 'c'}]]}
+
+        def getter(context, sorts, limit, marker):
+            if marker is not None:
+                raise n_exc.NotFound()
+            return pages[None].pop(0)
+
+        ids = [r['id'] for r in utils.iter_resources(getter, 'ctx', 2)]
+        self.assertEqual(['a', 'b', 'c'], ids)
+
+    def test_iter_resources_keeps_ids_out_of_order_without_resume(self):
+        pages = {None: [{'id': 'n9'}, {'id': 'n10'}], 'n10': [{'id': 'n2'}]}
+
+        def getter(context, sorts, limit, marker):
+            return pages[marker]
+
+        ids = [r['id'] for r in utils.iter_resources(getter, 'ctx', 2)]
+        self.assertEqual(['n9', 'n10', 'n2'], ids)
+
+    def test_iter_resources_is_lazy(self):
+        getter = mock.Mock(return_value=[{'id': 'a'}, {'id': 'b'}])
+        next(utils.iter_resources(getter, 'ctx', 2))
+        getter.assert_called_once_with('ctx', sorts=[('id', True)], limit=2,
+                                       marker=None)